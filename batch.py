@@ -0,0 +1,188 @@
+# Параллельная пакетная обработка папок.
+# Файлы распределяются по процессам (ProcessPoolExecutor по числу ядер),
+# число одновременно обрабатываемых файлов ограничено, чтобы память не росла,
+# а журнал выполненных файлов позволяет продолжить прерванный запуск.
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+import engine
+import tiles
+
+JOB_LOG_NAME = '.batch_log.jsonl'
+
+
+def recipe_key(recipe, extension=None):
+    # Отпечаток рецепта и формата результата: при смене любого из них старый журнал не засчитывается
+    text = json.dumps([engine.normalize_recipe(recipe), extension], sort_keys=True)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+class JobLog:
+    # Журнал выполненных файлов: одна JSON-строка на файл, дописывается сразу
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+        self.done = {}  # Входной файл -> результат
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Недописанная строка после аварийной остановки
+                    if entry.get('recipe') == key:
+                        self.done[entry['input']] = entry['output']
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def record(self, input_path, output_path):
+        entry = {'input': os.path.abspath(input_path), 'output': os.path.abspath(output_path),
+                 'recipe': self.key}
+        self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self._file.flush()
+        self.done[entry['input']] = entry['output']
+
+    def is_done(self, input_path):
+        # Файл засчитывается, только если его результат еще на месте
+        output_path = self.done.get(os.path.abspath(input_path))
+        return output_path is not None and os.path.exists(output_path)
+
+    def close(self):
+        self._file.close()
+
+
+class OutputCollision(ValueError):
+    # Два входных файла дали бы один и тот же результат
+    pass
+
+
+def output_collisions(files, output_dir, extension=None):
+    # {путь: первый файл с тем же результатом} для всех файлов, кроме первого такого;
+    # одинаковые имена из разных папок иначе молча перезаписали бы друг друга
+    owners = {}
+    collisions = {}
+    for path in files:
+        target = os.path.normcase(os.path.abspath(engine.output_path(path, output_dir, extension)))
+        owner = owners.setdefault(target, path)
+        if owner != path:
+            collisions[path] = owner
+    return collisions
+
+
+def _process_one(input_path, recipe, output_dir, extension, tiled):
+    # Выполняется в дочернем процессе. tiled: 'auto' | 'always' | 'never'
+    size = os.path.getsize(input_path)
+    if tiled == 'always' or (tiled == 'auto' and tiles.probe_pixels(input_path) >= tiles.TILED_MIN_PIXELS):
+        # Огромные сканы обрабатываются полосами с ограниченной памятью
+        target = tiles.process_file_tiled(input_path, recipe, output_dir, extension)
+    else:
+        target = engine.process_file(input_path, recipe, output_dir, extension)
+    return input_path, target, size
+
+
+class BatchStats:
+    def __init__(self, total, skipped):
+        self.total = total
+        self.skipped = skipped
+        self.done = 0
+        self.failed = 0
+        self.bytes = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def images_per_second(self):
+        return self.done / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def mb_per_second(self):
+        return self.bytes / (1024 * 1024) / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        return (f"Готово: {self.done} из {self.total - self.skipped} "
+                f"(пропущено по журналу: {self.skipped}), ошибок: {self.failed}, "
+                f"{self.elapsed:.1f} с, {self.images_per_second:.2f} изобр/с, {self.mb_per_second:.2f} МБ/с")
+
+
+def run_batch(files, recipe, output_dir, workers=None, max_in_flight=None, extension=None,
+              resume=True, on_progress=None, tiled='auto'):
+    # files — список путей; recipe — рецепт engine; on_progress(stats, путь, результат или исключение)
+    recipe = engine.normalize_recipe(recipe)
+    workers = workers or os.cpu_count() or 1
+    # Ограничиваем число отправленных задач: декодированных изображений в памяти не больше,
+    # чем процессов, а небольшой запас задач не дает процессам простаивать
+    max_in_flight = max_in_flight or workers * 2
+    os.makedirs(output_dir, exist_ok=True)
+
+    log = JobLog(os.path.join(output_dir, JOB_LOG_NAME), recipe_key(recipe, extension))
+    if not resume:
+        log.done.clear()
+    collisions = output_collisions(files, output_dir, extension)
+    todo = [path for path in files if not log.is_done(path)]
+    stats = BatchStats(len(files), len(files) - len(todo))
+
+    def failed(path, error):
+        stats.failed += 1
+        if on_progress:
+            on_progress(stats, path, error)
+
+    pool = ProcessPoolExecutor(max_workers=workers)
+
+    def restart(broken):
+        # Процесс упал (например, нехватка памяти на огромном скане): его задачи уже
+        # получили BrokenProcessPool, остальные файлы идут в новый пул
+        nonlocal pool
+        if pool is broken:
+            pool.shutdown(wait=False)
+            pool = ProcessPoolExecutor(max_workers=workers)
+
+    try:
+        queue = iter(todo)
+        running = {}  # Future -> (путь, пул)
+
+        def fill():
+            while len(running) < max_in_flight:
+                path = next(queue, None)
+                if path is None:
+                    return
+                if path in collisions:
+                    failed(path, OutputCollision(
+                        f"Результат совпадает с результатом {collisions[path]}: "
+                        f"{engine.output_path(path, output_dir, extension)}"))
+                    continue
+                try:
+                    future = pool.submit(_process_one, path, recipe, output_dir, extension, tiled)
+                except BrokenProcessPool:
+                    restart(pool)
+                    future = pool.submit(_process_one, path, recipe, output_dir, extension, tiled)
+                running[future] = (path, pool)
+
+        fill()
+        while running:
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                path, owner = running.pop(future)
+                try:
+                    _, target, size = future.result()
+                except BrokenProcessPool as e:
+                    restart(owner)
+                    failed(path, e)
+                    continue
+                except Exception as e:
+                    failed(path, e)
+                    continue
+                log.record(path, target)
+                stats.done += 1
+                stats.bytes += size
+                if on_progress:
+                    on_progress(stats, path, target)
+            fill()
+    finally:
+        pool.shutdown()
+        log.close()
+    return stats
@@ -0,0 +1,248 @@
+# Замеры скорости операций на синтетических изображениях.
+# Для каждого размера (мегапиксели) и режима (L/RGB/RGBA) засекается каждая
+# операция: время (медиана и минимум из нескольких повторов), пропускная
+# способность и пиковый прирост памяти. Результаты пишутся в JSON и
+# сравниваются с сохраненной базой, чтобы замечать регрессии.
+#   python processor.py bench --sizes 1,12 -o bench.json --baseline base.json
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import numpy as np
+import PIL
+from PIL import Image
+import engine
+import export
+from instrument import rss
+import kernels
+import preview
+import tone
+
+DEFAULT_SIZES = (1, 12)
+ALL_SIZES = (1, 4, 12, 24, 50, 100)
+MODES = ('L', 'RGB', 'RGBA')
+DEFAULT_REPEAT = 3
+# Замедление относительно базы, начиная с которого результат считается регрессией
+DEFAULT_THRESHOLD = 0.15
+# Размер панели предпросмотра, как в GUI
+DISPLAY_BOX = (380, 600)
+
+
+def synthetic_image(megapixels, mode, seed=0):
+    # Градиенты + шум в пропорциях 4:3: есть и плавные участки, и детали (как у фото)
+    width = int(round((megapixels * 1_000_000 * 4 / 3) ** 0.5))
+    height = int(round(megapixels * 1_000_000 / width))
+    rng = np.random.default_rng(seed)
+    bands = len(mode)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)
+    array = np.empty((height, width, bands), dtype=np.uint8)
+    # Полосами, чтобы генерация 100 Мп не требовала промежуточных float-копий всего кадра
+    for y0 in range(0, height, 1024):
+        rows = y[y0:y0 + 1024, None]
+        for band in range(bands):
+            noise = rng.integers(-24, 24, size=(rows.shape[0], width), dtype=np.int16)
+            base = (x[None, :] * (band + 1) / bands + rows) / 2
+            array[y0:y0 + 1024, :, band] = np.clip(base + noise, 0, 255)
+    if mode == 'L':
+        return Image.fromarray(array[:, :, 0], 'L')
+    return Image.fromarray(array, mode)
+
+
+def _display(image):
+    # Путь display_image: пирамида при загрузке + уменьшение уровня до размера панели
+    levels = preview.build_pyramid(image)
+    thumb = preview.level_for(levels, DISPLAY_BOX).copy()
+    thumb.thumbnail(DISPLAY_BOX, Image.Resampling.LANCZOS)
+    return thumb
+
+
+def _save_settings(mode):
+    return export.PRESETS['png' if mode == 'RGBA' else 'jpeg']
+
+
+# Операция: (функция(изображение, файл) -> результат, для каких режимов имеет смысл)
+OPERATIONS = {
+    'load': (lambda image, path: engine.open_image(path).load(), MODES),
+    'load_preview': (lambda image, path: engine.open_preview(path, preview.PROXY_MAX_SIZE), MODES),
+    'display': (lambda image, path: _display(image), MODES),
+    'brightness': (lambda image, path: engine.brightness(image, 1.2), MODES),
+    'contrast': (lambda image, path: engine.contrast(image, 1.3), MODES),
+    'saturation': (lambda image, path: engine.saturation(image, 1.4), ('RGB', 'RGBA')),
+    'linear_correction': (lambda image, path: engine.linear_correction(image, 1.2), MODES),
+    'nonlinear_correction': (lambda image, path: engine.nonlinear_correction(image, 1.5), ('L',)),
+    'rotate': (lambda image, path: engine.rotate(image, 90), MODES),
+    'histogram': (lambda image, path: tone.channel_histograms(image), MODES),
+    'save': (lambda image, path: export.encode(image, _save_settings(image.mode)), MODES),
+}
+
+
+class PeakMemory:
+    # Пиковый прирост памяти за время блока. Буферы PIL не видны tracemalloc,
+    # поэтому на Linux RSS опрашивается фоновым потоком; иначе — только tracemalloc.
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.peak = 0
+
+    def __enter__(self):
+        self._start = rss()
+        self._max = self._start
+        self._stop = threading.Event()
+        tracemalloc.start()
+        if self._start is not None:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self._max = max(self._max, rss() or 0)
+
+    def __exit__(self, *exc):
+        _, traced = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self._stop.set()
+        if self._start is not None:
+            self._thread.join()
+            self._max = max(self._max, rss() or 0)
+            self.peak = max(self._max - self._start, traced)
+        else:
+            self.peak = traced
+        return False
+
+
+def measure(func, image, path, repeat=DEFAULT_REPEAT):
+    # Время каждого повтора (с) и пиковый прирост памяти (байт).
+    # Память меряется отдельным прогревочным запуском: tracemalloc замедляет выполнение
+    with PeakMemory() as memory:
+        func(image, path)
+    times = []
+    for _ in range(repeat):
+        # Холодные кэши: иначе после прогрева контраст и автоуровни меряют только LUT,
+        # а насыщенность — без копирования пикселей источника
+        tone.reset_caches()
+        kernels.reset_caches()
+        start = time.perf_counter()
+        func(image, path)
+        times.append(time.perf_counter() - start)
+    return times, memory.peak
+
+
+def result_key(result):
+    return f"{result['op']}/{result['mode']}/{result['megapixels']}"
+
+
+def run(sizes=DEFAULT_SIZES, modes=MODES, operations=None, repeat=DEFAULT_REPEAT, on_result=None):
+    # Все замеры; возвращает словарь для JSON
+    operations = operations or list(OPERATIONS)
+    results = []
+    with tempfile.TemporaryDirectory(prefix='bench_') as temp:
+        for megapixels in sizes:
+            for mode in modes:
+                image = synthetic_image(megapixels, mode)
+                # Файл для замеров загрузки, в формате, который выбрал бы save
+                path = os.path.join(temp, f'{megapixels}_{mode}{_save_settings(mode).extension}')
+                with open(path, 'wb') as f:
+                    f.write(export.encode(image, _save_settings(mode)))
+                for name in operations:
+                    func, op_modes = OPERATIONS[name]
+                    if mode not in op_modes:
+                        continue
+                    times, peak = measure(func, image, path, repeat)
+                    median = statistics.median(times)
+                    result = {
+                        'op': name,
+                        'mode': mode,
+                        'megapixels': megapixels,
+                        'size': list(image.size),
+                        'median_s': median,
+                        'min_s': min(times),
+                        'mp_per_s': image.width * image.height / 1e6 / median if median else None,
+                        'peak_mb': peak / 2 ** 20,
+                    }
+                    results.append(result)
+                    if on_result:
+                        on_result(result)
+                del image
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+
+def compare(current, baseline, threshold=DEFAULT_THRESHOLD):
+    # [(ключ, медиана базы, текущая медиана, отношение)] для замедлившихся операций
+    base = {result_key(result): result for result in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        old = base.get(result_key(result))
+        if old is None or not old['median_s']:
+            continue
+        ratio = result['median_s'] / old['median_s']
+        if ratio > 1 + threshold:
+            regressions.append((result_key(result), old['median_s'], result['median_s'], ratio))
+    return regressions
+
+
+def _format(result):
+    return (f"{result['op']:<22}{result['mode']:<6}{result['megapixels']:>5} Мп"
+            f"{result['median_s'] * 1000:>11.1f} мс{result['mp_per_s'] or 0:>10.1f} Мп/с"
+            f"{result['peak_mb']:>10.1f} МБ")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='processor.py bench',
+                                     description='Замеры скорости операций на синтетических изображениях')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help=f"размеры в мегапикселях через запятую (полный набор: {','.join(map(str, ALL_SIZES))})")
+    parser.add_argument('--modes', default=','.join(MODES), help='режимы через запятую')
+    parser.add_argument('--ops', default=None, help=f"операции через запятую: {', '.join(OPERATIONS)}")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='повторов каждого замера')
+    parser.add_argument('-o', '--output', default=None, help='файл для результатов (JSON)')
+    parser.add_argument('--baseline', default=None, help='JSON предыдущего запуска для сравнения')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='допустимое замедление относительно базы (0.15 = 15%%)')
+    args = parser.parse_args(argv)
+
+    sizes = [float(size) if '.' in size else int(size) for size in args.sizes.split(',')]
+    modes = args.modes.split(',')
+    operations = args.ops.split(',') if args.ops else None
+    for mode in modes:
+        if mode not in MODES:
+            parser.error(f"Неизвестный режим: {mode}")
+    for name in operations or []:
+        if name not in OPERATIONS:
+            parser.error(f"Неизвестная операция: {name}")
+
+    print(f"{'операция':<22}{'режим':<6}{'размер':>8}{'медиана':>14}{'скорость':>15}{'память':>13}")
+    report = run(sizes, modes, operations, args.repeat, on_result=lambda result: print(_format(result)))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        for key, old, new, ratio in regressions:
+            print(f"РЕГРЕССИЯ {key}: {old * 1000:.1f} мс -> {new * 1000:.1f} мс (x{ratio:.2f})",
+                  file=sys.stderr)
+        if regressions:
+            return 1
+        print(f"Регрессий нет (порог {args.threshold:.0%})")
+    return 0
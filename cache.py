@@ -0,0 +1,124 @@
+# Дисковый кэш предпросмотра между сеансами.
+# Для каждого файла (ключ — путь, время изменения и размер) хранится прокси
+# с учетом EXIF-ориентации, его гистограммы и сведения из заголовка, поэтому
+# повторное открытие известного файла не декодирует его заново.
+# Общий объем ограничен; при переполнении удаляются давно не открывавшиеся записи.
+import hashlib
+import json
+import os
+import threading
+import numpy as np
+from PIL import Image
+import engine
+from instrument import span
+import tone
+from preview import PROXY_MAX_SIZE
+
+# Меняется при изменении формата записи или способа построения прокси
+CACHE_VERSION = 2
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+ENTRY_SUFFIX = '.npz'
+
+
+def default_directory():
+    # Каталог кэша пользователя (Windows — LOCALAPPDATA, иначе XDG_CACHE_HOME или ~/.cache)
+    base = (os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME')
+            or os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'ImageProcessor', 'previews')
+
+
+def cache_key(path):
+    # Путь + mtime + размер: изменившийся файл получает новый ключ, а старая запись вытесняется
+    st = os.stat(path)
+    ident = json.dumps([os.path.abspath(path), st.st_mtime_ns, st.st_size,
+                        CACHE_VERSION, list(PROXY_MAX_SIZE)])
+    return hashlib.sha1(ident.encode('utf-8')).hexdigest()
+
+
+class PreviewCache:
+    # Одна запись = один .npz (без сжатия: чтение — это почти memcpy)
+
+    def __init__(self, directory=None, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory or default_directory()
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key + ENTRY_SUFFIX)
+
+    def get(self, path):
+        # (ImageInfo, прокси) или None; гистограммы прокси сразу попадают в кэш tone
+        try:
+            entry = self._entry_path(cache_key(path))
+        except OSError:
+            return None
+        try:
+            with span('cache_read'), np.load(entry, allow_pickle=False) as data:
+                meta = json.loads(str(data['meta']))
+                proxy = Image.fromarray(data['proxy'], meta['proxy_mode'])
+                stats = tone.ImageStats(proxy, channels=data['channels'], luma=data['luma'])
+                exif = Image.Exif()
+                exif.load(data['exif'].tobytes())
+            os.utime(entry)  # Время изменения записи — время последнего использования (LRU)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError):
+            # Поврежденная или устаревшая запись: проще построить заново
+            self._remove(entry)
+            return None
+        tone.remember_stats(proxy, stats)
+        info = engine.ImageInfo(path, meta['file_size'], meta['format'], tuple(meta['size']),
+                                meta['mode'], exif, meta['orientation'])
+        return info, proxy
+
+    def put(self, path, info, proxy):
+        # Сохранить прокси после загрузки; ошибки записи не мешают работе
+        if not tone.supports(proxy):
+            return
+        stats = tone.image_stats(proxy)
+        meta = {'file_size': info.file_size, 'format': info.format, 'size': list(info.size),
+                'mode': info.mode, 'orientation': info.orientation, 'proxy_mode': proxy.mode}
+        try:
+            entry = self._entry_path(cache_key(path))
+        except OSError:
+            return
+        temp = f'{entry}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(temp, 'wb') as f:
+                np.savez(f, proxy=np.asarray(proxy), channels=stats.channels, luma=stats.luma,
+                         exif=np.frombuffer(info.exif.tobytes(), dtype=np.uint8),
+                         meta=np.array(json.dumps(meta)))
+            os.replace(temp, entry)  # Запись появляется целиком или не появляется вовсе
+        except OSError:
+            self._remove(temp)
+            return
+        self.evict()
+
+    def evict(self):
+        # Удалить самые давно использованные записи, пока кэш не уложится в лимит
+        with self._lock:
+            try:
+                names = [name for name in os.listdir(self.directory) if name.endswith(ENTRY_SUFFIX)]
+            except OSError:
+                return
+            entries = []
+            for name in names:
+                try:
+                    st = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, name))
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self._remove(os.path.join(self.directory, name))
+                total -= size
+
+    @staticmethod
+    def _remove(entry):
+        try:
+            os.remove(entry)
+        except OSError:
+            pass
@@ -0,0 +1,457 @@
+# Обработка изображений без графического интерфейса.
+# Все операции — чистые функции: принимают PIL-изображение и параметры,
+# возвращают новое изображение и ничего не знают про Tk и messagebox.
+import json
+import os
+from PIL import Image, ImageOps, ImageEnhance
+import geometry
+from instrument import span
+import kernels
+import tone
+
+# Те же расширения, что принимает диалог load_image
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif')
+JPEG_EXTENSIONS = ('.jpg', '.jpeg')
+
+# Тег EXIF Orientation
+ORIENTATION_TAG = 0x0112
+
+
+def open_image(path):
+    # Загрузка с учетом EXIF-ориентации (как в load_image)
+    return ImageOps.exif_transpose(Image.open(path))
+
+
+def orientation_steps(orientation):
+    # EXIF-ориентация как шаг рецепта: сворачивается с поворотами пользователя
+    # и применяется к пикселям вместе с ними, один раз
+    if geometry.Transform.from_orientation(orientation).is_identity:
+        return []
+    return [('orient', {'orientation': orientation})]
+
+
+def pending_orientation(image):
+    # EXIF-ориентация, которую еще нужно применить к пикселям открытого файла.
+    # TIFF-плагин PIL сам поворачивает пиксели при загрузке (и size уже повернут),
+    # хотя до load() тег еще читается — exif_transpose по этой же причине смотрит на тег после load()
+    if image.format == 'TIFF':
+        return 1
+    return image.getexif().get(ORIENTATION_TAG, 1)
+
+
+def open_oriented(path):
+    # Файл без поворота пикселей + шаги, которые приводят его к нужной ориентации
+    image = Image.open(path)
+    return image, orientation_steps(pending_orientation(image))
+
+
+# EXIF-ориентации, при которых ширина и высота меняются местами
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+class ImageInfo:
+    # Сведения о файле из заголовка: формат, размер, режим и EXIF без декодирования пикселей
+
+    def __init__(self, path, file_size, format, size, mode, exif, orientation=1):
+        self.path = path
+        self.file_size = file_size
+        self.format = format
+        self.size = size  # Размер открытого файла до поворота по orientation
+        self.mode = mode
+        self.exif = exif
+        self.orientation = orientation  # Ориентация, которую еще нужно применить (pending_orientation)
+
+    @property
+    def width(self):
+        return self.size[0]
+
+    @property
+    def height(self):
+        return self.size[1]
+
+    @property
+    def oriented_size(self):
+        # Размер после поворота по EXIF-ориентации (как у open_image)
+        if self.orientation in TRANSPOSED_ORIENTATIONS:
+            return self.size[::-1]
+        return self.size
+
+
+def _image_info(path, image):
+    return ImageInfo(path, os.path.getsize(path), image.format, image.size, image.mode, image.getexif(),
+                     pending_orientation(image))
+
+
+def probe_image(path):
+    # Только заголовок: Image.open не декодирует пиксели
+    with Image.open(path) as image:
+        return _image_info(path, image)
+
+
+def open_preview(path, max_size):
+    # Одно открытие файла: сведения из заголовка и декодирование не крупнее,
+    # чем нужно для max_size. JPEG декодируется с DCT-масштабированием (draft)
+    # в 1/2..1/8 разрешения; остальные форматы — целиком.
+    # Возвращает (ImageInfo, изображение с учетом EXIF-ориентации).
+    with span('decode', path=os.path.basename(path)), Image.open(path) as image:
+        info = _image_info(path, image)
+        box = max_size[::-1] if info.orientation in TRANSPOSED_ORIENTATIONS else max_size
+        # draft берет масштаб по худшей стороне, поэтому просим ровно вписанный размер
+        scale = min(box[0] / image.width, box[1] / image.height, 1.0)
+        image.draft(None, (max(1, int(image.width * scale)), max(1, int(image.height * scale))))
+        return info, ImageOps.exif_transpose(image)
+
+
+def list_images(folder):
+    # Все поддерживаемые изображения в папке, в стабильном порядке
+    names = sorted(os.listdir(folder))
+    return [os.path.join(folder, name) for name in names
+            if name.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(os.path.join(folder, name))]
+
+
+def grayscale(image):
+    # Преобразование в оттенки серого
+    if image.mode != 'L':
+        return image.convert('L')
+    return image
+
+
+def _tone_steps(image, steps):
+    # Тоновые шаги для изображения любого режима: палитровые и прочие режимы сначала
+    # приводятся к L/RGB/RGBA; у серого с альфой кривые идут по L, а альфа
+    # возвращается без изменений (как у RGBA внутри LUT)
+    if image.mode in tone.GRAY_ALPHA_MODES:
+        image = image.convert('LA')
+        return Image.merge('LA', (tone.apply_tone_chain(image.getchannel('L'), steps), image.getchannel('A')))
+    return tone.apply_tone_chain(_tone_mode(image), steps)
+
+
+def brightness(image, value=1.0):
+    # Коррекция яркости (value от 0.1 до 2.0, 1.0 — без изменений)
+    return _tone_steps(image, [('brightness', {'value': value})])
+
+
+def contrast(image, value=1.0, mean=None):
+    # Коррекция контрастности; mean — средняя яркость, зафиксированная при правке (см. freeze_statistics)
+    return _tone_steps(image, [('contrast', {'value': value, 'mean': mean})])
+
+
+def saturation(image, value=1.0):
+    # Коррекция насыщенности (только для цветных изображений).
+    # RGB — одним проходом матрицей цвета (kernels), без серой копии и смешения
+    if tone.working_mode(image.mode) == 'L':
+        return image
+    image = _tone_mode(image)
+    if image.mode == 'L':
+        return image
+    if image.mode == 'RGB':
+        return kernels.saturation(image, value)
+    # Матрица цвета в PIL есть только для RGB; прочие режимы (RGBA) — как раньше
+    return ImageEnhance.Color(image).enhance(float(value))
+
+
+def rotate(image, angle=90):
+    # Поворот против часовой стрелки. Кратные 90° — перестановка пикселей без интерполяции,
+    # остальные углы — через rotate, expand=True автоматически меняет размер canvas
+    if float(angle) % 90 == 0:
+        return geometry.Transform.rotation(float(angle)).apply(image)
+    return image.rotate(float(angle), expand=True)
+
+
+def flip(image, direction='horizontal'):
+    # Зеркальное отражение: horizontal — слева направо, vertical — сверху вниз
+    return geometry.Transform.mirror(direction).apply(image)
+
+
+def orient(image, orientation=1):
+    # Привести пиксели к EXIF-ориентации (как exif_transpose, но как шаг рецепта)
+    return geometry.Transform.from_orientation(orientation).apply(image)
+
+
+def _tone_mode(image):
+    # Приводит изображение к режиму, с которым работают тоновые кривые
+    return tone.to_working_mode(image)
+
+
+# Операции, которым нужна статистика входа, и параметр, в котором ее можно зафиксировать
+STATS_OPERATIONS = {'contrast': 'mean', 'linear_correction': 'ranges'}
+
+
+def needs_stats(name, params):
+    # Шагу нужна гистограмма входа (статистика не зафиксирована в параметрах)
+    return name in STATS_OPERATIONS and params.get(STATS_OPERATIONS[name]) is None
+
+
+def freeze_statistics(image, name, params):
+    # Параметры шага со статистикой входа image, записанной в них явно. Предпросмотр
+    # фиксирует так среднее и перцентили прокси, и сохранение в полном разрешении
+    # дает ровно то, что было на экране (а не пересчитывает их по другим пикселям)
+    if not needs_stats(name, params):
+        return params
+    if name == 'contrast':
+        curves = tone.ToneCurves(tone.working_mode(image.mode), lambda: tone.image_stats(_tone_mode(image)))
+        return dict(params, mean=curves.contrast_mean())
+    return dict(params, ranges=levels_ranges(image, params.get('link', tone.LINK_LUMINANCE)))
+
+
+def levels_ranges(image, link=tone.LINK_LUMINANCE):
+    # Перцентили 1/99 для автоуровней по 256-корзинным гистограммам (кэшируются):
+    # [(p_low, p_high) или None для плоского канала]; для растяжения по яркости — одна пара.
+    curves = tone.ToneCurves(tone.working_mode(image.mode), lambda: tone.image_stats(_tone_mode(image)))
+    curves.linear_correction(link=link)
+    if image.mode == 'L' or link == tone.LINK_LUMINANCE:
+        return curves.last_stretch[:1]
+    return curves.last_stretch
+
+
+def linear_correction(image, gamma=1.0, link=tone.LINK_LUMINANCE, ranges=None):
+    # Автоуровни: линейное растяжение по перцентилям 1/99 (+ гамма, если не 1.0).
+    # Цвет сохраняется: растяжение по яркости или по каждому каналу (link);
+    # для однородного изображения изменений нет. ranges — перцентили, зафиксированные при правке
+    return _tone_steps(image, [('linear_correction', {'gamma': gamma, 'link': link, 'ranges': ranges})])
+
+
+def nonlinear_correction(image, gamma=1.5):
+    # Нелинейная (гамма) коррекция, только для grayscale
+    if tone.working_mode(image.mode) != 'L':
+        return image
+    return _tone_steps(image, [('nonlinear_correction', {'gamma': gamma})])
+
+
+# Реестр операций: имя в рецепте -> функция
+OPERATIONS = {
+    'grayscale': grayscale,
+    'brightness': brightness,
+    'contrast': contrast,
+    'saturation': saturation,
+    'rotate': rotate,
+    'flip': flip,
+    'orient': orient,
+    'linear_correction': linear_correction,
+    'nonlinear_correction': nonlinear_correction,
+}
+
+# Операции над значениями пикселей без учета их положения (статистика — по всему кадру).
+# Они перестановочны с поворотами на 90° и отражениями, поэтому геометрию можно отложить.
+PIXEL_OPERATIONS = ('grayscale', 'brightness', 'contrast', 'saturation',
+                    'linear_correction', 'nonlinear_correction')
+
+
+def step_transform(name, params):
+    # Шаг как преобразование без потерь (geometry.Transform) или None
+    if name == 'rotate':
+        angle = float(params.get('angle', 90))
+        return geometry.Transform.rotation(angle) if angle % 90 == 0 else None
+    if name == 'flip':
+        return geometry.Transform.mirror(params.get('direction', 'horizontal'))
+    if name == 'orient':
+        return geometry.Transform.from_orientation(params.get('orientation', 1))
+    return None
+
+
+def recipe_transform(recipe):
+    # Суммарное преобразование рецепта, состоящего только из поворотов и отражений, иначе None
+    total = geometry.IDENTITY
+    for name, params in normalize_recipe(recipe):
+        step = step_transform(name, params)
+        if step is None:
+            return None
+        total = total.then(step)
+    return total
+
+
+def normalize_recipe(recipe):
+    # Рецепт — упорядоченный список шагов. Шаг задается строкой ("grayscale")
+    # или словарем {"op": "brightness", "value": 1.2}. Возвращает [(имя, параметры)].
+    steps = []
+    for step in recipe:
+        if isinstance(step, tuple) and len(step) == 2:
+            name, params = step[0], dict(step[1])
+        elif isinstance(step, str):
+            name, params = step, {}
+        elif isinstance(step, dict) and 'op' in step:
+            params = dict(step)
+            name = params.pop('op')
+        else:
+            raise ValueError(f"Некорректный шаг рецепта: {step!r}")
+        if name not in OPERATIONS:
+            raise ValueError(f"Неизвестная операция: {name}")
+        steps.append((name, params))
+    return steps
+
+
+def load_recipe(source):
+    # Рецепт из JSON-файла или JSON-строки
+    if os.path.isfile(source):
+        with open(source, encoding='utf-8') as f:
+            recipe = json.load(f)
+    else:
+        recipe = json.loads(source)
+    if not isinstance(recipe, list):
+        raise ValueError("Рецепт должен быть JSON-списком операций")
+    return normalize_recipe(recipe)
+
+
+def apply_recipe(image, recipe):
+    # Последовательно применяет шаги рецепта и возвращает результат.
+    # Подряд идущие тоновые шаги сворачиваются в одну LUT и проходят за один проход.
+    # Повороты на 90° и отражения копятся в одном преобразовании и применяются
+    # один раз в конце (или перед операцией, которой важно положение пикселей).
+    result = image
+    pending = []
+    transform = geometry.IDENTITY
+    for name, params in normalize_recipe(recipe):
+        step = step_transform(name, params)
+        if step is not None:
+            transform = transform.then(step)
+            continue
+        if name in tone.TONE_OPERATIONS and tone.supports(result):
+            pending.append((name, params))
+            continue
+        if pending:
+            result = _apply_tone_chain(result, pending)
+            pending = []
+        if name not in PIXEL_OPERATIONS:
+            result = _apply_transform(result, transform)
+            transform = geometry.IDENTITY
+        with span(name):
+            result = OPERATIONS[name](result, **params)
+    if pending:
+        result = _apply_tone_chain(result, pending)
+    return _apply_transform(result, transform)
+
+
+def is_fusion_boundary(recipe, index):
+    # Совпадает ли повтор recipe[index:] от готового кадра recipe[:index] с полным
+    # apply_recipe: граница не должна разрезать цепочку тоновых шагов, которая иначе
+    # свернулась бы в одну LUT (повороты и отражения внутри цепочки ее не прерывают)
+    steps = normalize_recipe(recipe)
+    pixel = [name for name, params in steps if step_transform(name, params) is None]
+    before = len([name for name, params in steps[:index] if step_transform(name, params) is None])
+    return not (0 < before < len(pixel) and pixel[before - 1] in tone.TONE_OPERATIONS
+                and pixel[before] in tone.TONE_OPERATIONS)
+
+
+def _apply_tone_chain(image, steps):
+    with span('tone_lut', steps=len(steps)):
+        return tone.apply_tone_chain(image, steps)
+
+
+def _apply_transform(image, transform):
+    if transform.is_identity:
+        return image
+    with span('transpose'):
+        return transform.apply(image)
+
+
+def output_path(input_path, output_dir, extension=None):
+    # Путь результата: то же имя файла в output_dir (опционально с другим расширением)
+    name = os.path.basename(input_path)
+    if extension:
+        name = os.path.splitext(name)[0] + '.' + extension.lstrip('.')
+    return os.path.join(output_dir, name)
+
+
+def process_file(input_path, recipe, output_dir, extension=None):
+    # Полный цикл для одного файла: загрузка, рецепт, сохранение
+    target = output_path(input_path, output_dir, extension)
+    if save_lossless(input_path, recipe, target):
+        return target
+    # EXIF-ориентация применяется вместе с поворотами рецепта, одним transpose
+    image, lead = open_oriented(input_path)
+    result = apply_recipe(image, lead + normalize_recipe(recipe))
+    if target.lower().endswith(JPEG_EXTENSIONS) and result.mode not in ('L', 'RGB'):
+        result = result.convert('RGB')  # JPEG не поддерживает альфа-канал
+    result.save(target)
+    return target
+
+
+# --- Смена ориентации JPEG без перекодирования
+
+EXIF_HEADER = b'Exif\x00\x00'
+
+
+def save_lossless(input_path, recipe, target):
+    # Если рецепт только поворачивает/отражает, а источник и результат — JPEG,
+    # копирует файл с новым тегом EXIF Orientation: скан-данные не перекодируются.
+    # True, если файл записан; иначе результат нужно рендерить обычным путем.
+    transform = recipe_transform(recipe)
+    if transform is None or not target.lower().endswith(JPEG_EXTENSIONS):
+        return False
+    with Image.open(input_path) as image:
+        if image.format != 'JPEG':
+            return False
+        orientation = image.getexif().get(ORIENTATION_TAG, 1)
+    total = geometry.Transform.from_orientation(orientation).then(transform)
+    with open(input_path, 'rb') as f:
+        data = f.read()
+    try:
+        data = set_jpeg_orientation(data, total.orientation)
+    except ValueError:
+        return False
+    with open(target, 'wb') as f:
+        f.write(data)
+    return True
+
+
+def set_jpeg_orientation(data, orientation):
+    # Байты JPEG с новым значением Orientation. Если тег уже есть — меняются
+    # два байта на месте, иначе сегмент EXIF пересобирается или добавляется.
+    if data[:2] != b'\xff\xd8':
+        raise ValueError("Не JPEG")
+    pos = 2
+    insert_at = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            raise ValueError("Поврежденная структура JPEG")
+        marker = data[pos + 1]
+        if marker == 0xFF:  # Байты-заполнители
+            pos += 1
+            continue
+        if marker in (0xDA, 0xD9):  # Начало скана / конец файла: дальше метаданных нет
+            break
+        end = pos + 2 + int.from_bytes(data[pos + 2:pos + 4], 'big')
+        if marker == 0xE1 and data[pos + 4:pos + 10] == EXIF_HEADER:
+            patched = _patch_orientation(data, pos + 10, end, orientation)
+            if patched is not None:
+                return patched
+            exif = Image.Exif()
+            exif.load(data[pos + 4:end])
+            exif[ORIENTATION_TAG] = orientation
+            return data[:pos] + _app1_segment(exif) + data[end:]
+        if marker == 0xE0 and pos == 2:
+            insert_at = end  # Новый EXIF — после JFIF APP0, который должен идти первым
+        pos = end
+    exif = Image.Exif()
+    exif[ORIENTATION_TAG] = orientation
+    return data[:insert_at] + _app1_segment(exif) + data[insert_at:]
+
+
+def _patch_orientation(data, tiff, end, orientation):
+    # Заменить значение тега Orientation в IFD0; None, если тега нет
+    byteorder = {b'II': 'little', b'MM': 'big'}.get(data[tiff:tiff + 2])
+    if byteorder is None:
+        raise ValueError("Некорректный заголовок TIFF в EXIF")
+    ifd = tiff + int.from_bytes(data[tiff + 4:tiff + 8], byteorder)
+    if ifd + 2 > end:
+        raise ValueError("Некорректное смещение IFD0 в EXIF")
+    count = int.from_bytes(data[ifd:ifd + 2], byteorder)
+    for i in range(count):
+        entry = ifd + 2 + 12 * i
+        if entry + 12 > end:
+            raise ValueError("IFD0 выходит за пределы сегмента EXIF")
+        if int.from_bytes(data[entry:entry + 2], byteorder) != ORIENTATION_TAG:
+            continue
+        if int.from_bytes(data[entry + 2:entry + 4], byteorder) != 3:  # Ожидается SHORT
+            return None
+        patched = bytearray(data)
+        patched[entry + 8:entry + 10] = orientation.to_bytes(2, byteorder)
+        return bytes(patched)
+    return None
+
+
+def _app1_segment(exif):
+    payload = exif.tobytes()  # Уже начинается с b'Exif\0\0'
+    if len(payload) + 2 > 0xFFFF:
+        raise ValueError("EXIF не помещается в сегмент APP1")
+    return b'\xff\xe1' + (len(payload) + 2).to_bytes(2, 'big') + payload
@@ -0,0 +1,111 @@
+# Геометрия без потерь: повороты на 90° и отражения.
+# Любая цепочка таких шагов (вместе с EXIF-ориентацией) сворачивается в одно
+# преобразование и применяется к пикселям один раз через Image.transpose —
+# без аффинной интерполяции и промежуточных копий.
+from PIL import Image
+
+T = Image.Transpose
+
+# EXIF Orientation -> преобразование (как в ImageOps.exif_transpose)
+ORIENTATION_TRANSPOSE = {
+    2: T.FLIP_LEFT_RIGHT,
+    3: T.ROTATE_180,
+    4: T.FLIP_TOP_BOTTOM,
+    5: T.TRANSPOSE,
+    6: T.ROTATE_270,
+    7: T.TRANSVERSE,
+    8: T.ROTATE_90,
+}
+
+# (отражение, число четвертьоборотов) -> метод transpose
+_METHODS = {
+    (False, 1): T.ROTATE_90,
+    (False, 2): T.ROTATE_180,
+    (False, 3): T.ROTATE_270,
+    (True, 0): T.FLIP_LEFT_RIGHT,
+    (True, 1): T.TRANSPOSE,
+    (True, 2): T.FLIP_TOP_BOTTOM,
+    (True, 3): T.TRANSVERSE,
+}
+_ELEMENTS = {method: key for key, method in _METHODS.items()}
+_ORIENTATIONS = {_ELEMENTS[method]: code for code, method in ORIENTATION_TRANSPOSE.items()}
+
+FLIP_DIRECTIONS = ('horizontal', 'vertical')
+
+
+class Transform:
+    # Сначала отражение слева направо (flip), затем поворот на 90°·turns против часовой стрелки.
+    # Неизменяемый объект; композиция — метод then.
+
+    __slots__ = ('flip', 'turns')
+
+    def __init__(self, flip=False, turns=0):
+        self.flip = bool(flip)
+        self.turns = turns % 4
+
+    @classmethod
+    def from_method(cls, method):
+        return cls(*_ELEMENTS[method])
+
+    @classmethod
+    def from_orientation(cls, orientation):
+        # Неизвестные значения тега, как и в exif_transpose, игнорируются
+        method = ORIENTATION_TRANSPOSE.get(orientation)
+        return cls.from_method(method) if method is not None else IDENTITY
+
+    @classmethod
+    def rotation(cls, angle):
+        # Поворот против часовой стрелки (как Image.rotate); только кратно 90°
+        if angle % 90:
+            raise ValueError(f"Поворот без потерь возможен только на угол, кратный 90°: {angle}")
+        return cls(False, int(angle) // 90)
+
+    @classmethod
+    def mirror(cls, direction='horizontal'):
+        if direction not in FLIP_DIRECTIONS:
+            raise ValueError(f"Неизвестное направление отражения: {direction}")
+        return cls(True, 0 if direction == 'horizontal' else 2)
+
+    def then(self, other):
+        # Сначала self, затем other. Поворот после отражения меняет направление:
+        # R^k · F = F · R^-k
+        turns = other.turns + (-self.turns if other.flip else self.turns)
+        return Transform(self.flip != other.flip, turns)
+
+    @property
+    def is_identity(self):
+        return not self.flip and self.turns == 0
+
+    @property
+    def swaps_axes(self):
+        return self.turns % 2 == 1
+
+    @property
+    def method(self):
+        # Метод Image.transpose или None для тождественного преобразования
+        return _METHODS.get((self.flip, self.turns))
+
+    @property
+    def orientation(self):
+        # Значение EXIF Orientation, которое описывает это преобразование
+        return _ORIENTATIONS.get((self.flip, self.turns), 1)
+
+    def size(self, size):
+        return (size[1], size[0]) if self.swaps_axes else tuple(size)
+
+    def apply(self, image):
+        if self.is_identity:
+            return image
+        return image.transpose(self.method)
+
+    def __eq__(self, other):
+        return isinstance(other, Transform) and (self.flip, self.turns) == (other.flip, other.turns)
+
+    def __hash__(self):
+        return hash((self.flip, self.turns))
+
+    def __repr__(self):
+        return f'Transform(flip={self.flip}, turns={self.turns})'
+
+
+IDENTITY = Transform()
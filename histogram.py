@@ -0,0 +1,130 @@
+# Гистограммы для GUI: одно постоянное окно, которое обновляется на месте.
+# Все каналы считаются за один проход (Image.histogram) и кэшируются
+# по объекту изображения (tone.image_stats), поэтому гистограмма исходника
+# считается один раз на загрузку, а после правки — только для нового кадра.
+# matplotlib (около половины времени запуска) импортируется при первом открытии окна
+# или заранее, фоновым прогревом после появления главного окна.
+import functools
+import tkinter as tk
+import numpy as np
+import tone
+
+# Подписи и цвета каналов (в порядке Image.histogram)
+CHANNEL_STYLES = {
+    1: [('Grayscale', 'black')],
+    3: [('Red', 'r'), ('Green', 'g'), ('Blue', 'b')],
+}
+
+
+@functools.lru_cache(maxsize=None)
+def matplotlib_classes():
+    # (Figure, FigureCanvasTkAgg); импорт — при первом обращении
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+    return Figure, FigureCanvasTkAgg
+
+
+def channel_series(image, scale=1.0):
+    # [(гистограмма, цвет, подпись)] для каждого канала; scale пересчитывает
+    # счетчики прокси в пиксели полноразмерного изображения
+    if not tone.supports(image):
+        image = tone.to_working_mode(image)
+    hists = tone.image_stats(image).channels
+    return [(hist * scale, color, label)
+            for hist, (label, color) in zip(hists, CHANNEL_STYLES[len(hists)])]
+
+
+def prefetch(image):
+    # Посчитать гистограммы заранее (в фоновом потоке), чтобы окно обновилось мгновенно
+    if tone.supports(image):
+        tone.image_stats(image).channels
+
+
+class HistogramWindow:
+    # Окно с двумя графиками: сверху исходное, снизу обработанное
+
+    def __init__(self, root):
+        self.root = root
+        self.window = None
+        self.figure = None
+        self.canvas = None
+        self.axes = {}
+        self._shown = {}  # Ось -> объект изображения, гистограмма которого нарисована
+
+    @property
+    def is_open(self):
+        return self.window is not None
+
+    def show(self, original, processed, scale=1.0):
+        # Открыть окно (или поднять уже открытое) и обновить данные
+        if self.window is None:
+            self._create()
+        else:
+            self.window.deiconify()
+            self.window.lift()
+        self.update(original, processed, scale)
+
+    def _create(self):
+        self.window = tk.Toplevel(self.root)  # Toplevel - дочернее окно
+        self.window.title("Гистограмма: исходное (сверху) и обработанное (снизу)")
+        self.window.geometry("900x700")
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+
+        # Figure без pyplot: фигура не попадает в глобальный реестр и освобождается вместе с окном
+        Figure, FigureCanvasTkAgg = matplotlib_classes()
+        self.figure = Figure(figsize=(9, 7))
+        ax_top = self.figure.add_subplot(2, 1, 1)
+        ax_bottom = self.figure.add_subplot(2, 1, 2, sharex=ax_top)
+        ax_top.set_title('Исходное изображение')
+        ax_top.set_ylabel('Пиксели')
+        ax_bottom.set_title('Обработанное изображение')
+        ax_bottom.set_xlabel('Уровень интенсивности')
+        ax_bottom.set_ylabel('Пиксели')
+        for ax in (ax_top, ax_bottom):
+            ax.grid(True)
+        self.axes = {'original': ax_top, 'processed': ax_bottom}
+        self._shown = {}
+        self.figure.tight_layout()
+
+        # Встраиваем график в Tkinter окно
+        self.canvas = FigureCanvasTkAgg(self.figure, master=self.window)
+        self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)  # Растягиваем на все окно
+
+    def update(self, original, processed, scale=1.0):
+        # Обновить графики; неизменившиеся изображения не перерисовываются
+        if self.window is None:
+            return
+        changed = False
+        for key, image in (('original', original), ('processed', processed)):
+            if image is None or self._shown.get(key) is image:
+                continue
+            self._plot(self.axes[key], channel_series(image, scale))
+            self._shown[key] = image
+            changed = True
+        if changed:
+            self.canvas.draw_idle()
+
+    def _plot(self, ax, series):
+        lines = ax.get_lines()
+        if len(lines) == len(series):
+            # Тот же набор каналов: меняем только данные линий
+            for line, (hist, color, label) in zip(lines, series):
+                line.set_ydata(hist)
+        else:
+            for line in lines:
+                line.remove()
+            for hist, color, label in series:
+                ax.plot(np.arange(256), hist, color=color, label=label)
+            ax.legend()
+        ax.relim()
+        ax.autoscale_view()
+
+    def close(self):
+        if self.window is not None:
+            self.window.destroy()
+            self.figure.clear()
+        self.window = None
+        self.figure = None
+        self.canvas = None
+        self.axes = {}
+        self._shown = {}
@@ -0,0 +1,173 @@
+# История правок с отменой и повтором.
+# Журнал хранит только имена операций и параметры. Готовые кадры лежат
+# в кэше контрольных точек с ограничением по памяти (LRU), а любой кадр
+# восстанавливается повтором шагов от ближайшей сохраненной точки.
+from collections import OrderedDict
+import engine
+
+# Бюджеты памяти на контрольные точки
+PREVIEW_BUDGET_BYTES = 256 * 1024 * 1024  # Кадры прокси
+FULL_BUDGET_BYTES = 512 * 1024 * 1024  # Кадры полного разрешения (для сохранения)
+
+
+def image_bytes(image):
+    # Примерный объем изображения в памяти PIL (многоканальные режимы — 4 байта на пиксель)
+    per_pixel = 1 if image.mode in ('1', 'L', 'P') else 2 if image.mode.startswith('I;16') else 4
+    return image.width * image.height * per_pixel
+
+
+class CheckpointCache:
+    # Кадры "после первых N шагов" для одного базового изображения.
+    # Без lead N = 0 — само базовое изображение, оно всегда доступно и в бюджет не входит.
+    # lead — шаги, которые предшествуют журналу (например, EXIF-ориентация исходника):
+    # они выполняются вместе с первыми шагами журнала, а не отдельным проходом; если же
+    # кадр с одним lead уже построен (сохранение без правок), он хранится под ключом 0
+    # и служит контрольной точкой, как остальные.
+
+    def __init__(self, base, budget_bytes, lead=()):
+        self.base = base
+        self.lead = list(lead)
+        self.budget = budget_bytes
+        self.used = 0
+        self._frames = OrderedDict()
+
+    def invalidate_after(self, index):
+        # Шаг index изменился: все кадры, которые от него зависят, устарели
+        for key in [key for key in self._frames if key > index]:
+            self.used -= image_bytes(self._frames.pop(key))
+
+    def render(self, steps, index):
+        # Кадр после steps[:index]: от ближайшей контрольной точки, не дальше index.
+        # Сохраненный ключ 0 — базовое изображение с уже примененными шагами lead.
+        # Точка внутри цепочки тоновых шагов пропускается: полный повтор свернул бы эту
+        # цепочку в одну LUT, а округление на промежуточном кадре дало бы другой результат.
+        # Так любой кадр побитно равен engine.apply_recipe(base, lead + steps[:index]),
+        # и стоит это не больше одного прохода LUT (и перестановки пикселей)
+        recipe = self.lead + list(steps[:index])
+        start = max((key for key in self._frames
+                     if key <= index and engine.is_fusion_boundary(recipe, len(self.lead) + key)),
+                    default=None)
+        if start is not None:
+            self._frames.move_to_end(start)
+            image = self._frames[start]
+            todo = list(steps[start:index])
+        else:
+            image = self.base
+            todo = self.lead + list(steps[:index])
+        if not todo:
+            return image
+        image = engine.apply_recipe(image, todo)
+        self._store(index, image)
+        return image
+
+    def _store(self, index, image):
+        size = image_bytes(image)
+        if size > self.budget:
+            return
+        old = self._frames.pop(index, None)
+        if old is not None:
+            self.used -= image_bytes(old)
+        self._frames[index] = image
+        self.used += size
+        # Вытесняем давно не использованные точки
+        while self.used > self.budget:
+            _, evicted = self._frames.popitem(last=False)
+            self.used -= image_bytes(evicted)
+
+
+class HistorySnapshot:
+    # Неизменяемый снимок журнала для чтения из другого потока (UI),
+    # пока сам журнал меняет поток обработки
+
+    def __init__(self, steps, can_undo, can_redo):
+        self.steps = tuple(steps)
+        self.can_undo = can_undo
+        self.can_redo = can_redo
+
+    def top(self, name):
+        # Параметры последнего шага, если это шаг name, иначе None
+        return self.steps[-1][1] if self.steps and self.steps[-1][0] == name else None
+
+
+class EditHistory:
+    # Состояния журнала: каждое — список шагов [(имя, параметры)]. Соседние состояния
+    # отличаются только последним шагом (добавлен или заменен), отмена и повтор
+    # переходят между ними.
+
+    def __init__(self):
+        self._states = [[]]
+        self._index = 0  # Текущее состояние
+        self._last_group = None
+
+    @property
+    def steps(self):
+        # Активные шаги текущего состояния
+        return self._states[self._index]
+
+    @property
+    def all_steps(self):
+        return self.steps
+
+    @property
+    def position(self):
+        # Сколько шагов сейчас применено
+        return len(self.steps)
+
+    @property
+    def can_undo(self):
+        return self._index > 0
+
+    @property
+    def can_redo(self):
+        return self._index < len(self._states) - 1
+
+    def snapshot(self):
+        return HistorySnapshot(self.steps, self.can_undo, self.can_redo)
+
+    def replaces(self, name, group):
+        # Шаг той же группы (одно перетаскивание ползунка, повтор коррекции)
+        # заменяет последний шаг, а не добавляет новый
+        return group is not None and group == self._last_group and self.top(name) is not None
+
+    def top(self, name):
+        # Параметры последнего шага, если это шаг name, иначе None
+        steps = self.steps
+        return steps[-1][1] if steps and steps[-1][0] == name else None
+
+    def push(self, name, params, group=None, absolute=False):
+        # Добавить шаг (отмененные состояния отбрасываются); возвращает индекс измененного шага.
+        # absolute — значение задано относительно входа последнего шага name (ползунок):
+        # такой шаг на вершине заменяется, но замена — отдельное состояние для отмены
+        steps = self.steps
+        if self.replaces(name, group):
+            steps[-1] = (name, params)
+            del self._states[self._index + 1:]
+        else:
+            base = steps[:-1] if absolute and self.top(name) is not None else steps
+            del self._states[self._index + 1:]
+            self._states.append(base + [(name, params)])
+            self._index += 1
+        self._last_group = group
+        return self.position - 1
+
+    def _move(self, index):
+        # Переход к состоянию index; возвращает индекс первого шага, который отличается
+        # от прежнего состояния, или None, если одно состояние — начало другого
+        old, new = self.steps, self._states[index]
+        self._index = index
+        self._last_group = None
+        for i, (a, b) in enumerate(zip(old, new)):
+            if a is not b:
+                return i
+        return None
+
+    def undo(self):
+        return self._move(self._index - 1) if self.can_undo else None
+
+    def redo(self):
+        return self._move(self._index + 1) if self.can_redo else None
+
+    def clear(self):
+        self._states = [[]]
+        self._index = 0
+        self._last_group = None
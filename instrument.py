@@ -0,0 +1,148 @@
+# Замеры этапов работы без профилировщика.
+# Этапы (декодирование, коррекции, LUT, уменьшение, PhotoImage, гистограмма,
+# кодирование) оборачиваются в span: длительность, поток и изменение памяти
+# процесса. Вложенные span образуют разбивку операции верхнего уровня —
+# последняя такая разбивка показывается в статус-баре. События копятся
+# в кольцевом буфере и выгружаются в формат Chrome trace (chrome://tracing,
+# Perfetto), а по каждому этапу ведется скользящая статистика p50/p95.
+from collections import deque
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+
+MAX_EVENTS = 20000  # Событий в буфере трассировки
+STATS_WINDOW = 500  # Последних замеров каждого этапа для p50/p95
+
+
+def rss():
+    # Резидентная память процесса в байтах (Linux); None, если недоступно
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def percentile(values, q):
+    # Перцентиль с линейной интерполяцией (как np.percentile) для короткого списка
+    values = sorted(values)
+    if not values:
+        return None
+    position = (len(values) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+class Breakdown:
+    # Операция верхнего уровня и время ее этапов (мс), в порядке завершения
+
+    def __init__(self, name, total_ms, stages):
+        self.name = name
+        self.total_ms = total_ms
+        self.stages = stages
+
+    def summary(self, limit=4):
+        # "edit:brightness 12.3 мс: tone_lut 5.1 · thumbnail 4.0" — самые долгие этапы
+        totals = {}
+        for stage, ms in self.stages:
+            totals[stage] = totals.get(stage, 0.0) + ms
+        top = sorted(totals.items(), key=lambda item: item[1], reverse=True)[:limit]
+        parts = ' · '.join(f"{stage} {ms:.1f}" for stage, ms in top)
+        return f"{self.name} {self.total_ms:.1f} мс" + (f": {parts}" if parts else "")
+
+
+class Recorder:
+
+    def __init__(self, max_events=MAX_EVENTS, window=STATS_WINDOW, memory=True):
+        self.enabled = True
+        self.memory = memory and rss() is not None
+        self._origin = time.perf_counter()
+        self._events = deque(maxlen=max_events)
+        self._durations = {}  # Этап -> deque длительностей (мс)
+        self._window = window
+        self._last = {}  # Имя операции верхнего уровня -> Breakdown
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def span(self, name, **args):
+        if not self.enabled:
+            yield
+            return
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        stages = []
+        stack.append(stages)
+        memory = rss() if self.memory else None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            stack.pop()
+            duration = (end - start) * 1000
+            if memory is not None:
+                args['rss_delta_kb'] = (rss() - memory) // 1024
+            if stack:
+                # Этап операции: вложенные этапы уже учтены в своих родителях
+                stack[-1].append((name, duration))
+            self._record(name, start, duration, args, stages if not stack else None)
+
+    def _record(self, name, start, duration, args, stages):
+        event = {
+            'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': threading.get_ident(),
+            'ts': (start - self._origin) * 1e6, 'dur': duration * 1000, 'args': args,
+        }
+        with self._lock:
+            self._events.append(event)
+            durations = self._durations.get(name)
+            if durations is None:
+                durations = self._durations[name] = deque(maxlen=self._window)
+            durations.append(duration)
+            if stages is not None:
+                self._last[name] = Breakdown(name, duration, stages)
+
+    def last(self, name):
+        # Последняя разбивка операции верхнего уровня name или None
+        with self._lock:
+            return self._last.get(name)
+
+    def stats(self):
+        # Этап -> {count, mean, p50, p95, max} (мс) по скользящему окну
+        with self._lock:
+            snapshot = {name: list(values) for name, values in self._durations.items()}
+        return {name: {'count': len(values), 'mean': sum(values) / len(values),
+                       'p50': percentile(values, 50), 'p95': percentile(values, 95), 'max': max(values)}
+                for name, values in snapshot.items() if values}
+
+    def stats_table(self):
+        rows = sorted(self.stats().items(), key=lambda item: item[1]['p95'], reverse=True)
+        lines = [f"{'этап':<22}{'n':>6}{'p50, мс':>10}{'p95, мс':>10}{'max, мс':>10}"]
+        for name, row in rows:
+            lines.append(f"{name:<22}{row['count']:>6}{row['p50']:>10.1f}{row['p95']:>10.1f}{row['max']:>10.1f}")
+        return '\n'.join(lines)
+
+    def export_chrome_trace(self, path):
+        # JSON в формате Trace Event (открывается в chrome://tracing и ui.perfetto.dev)
+        with self._lock:
+            events = list(self._events)
+        names = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': thread.ident,
+                  'args': {'name': thread.name}} for thread in threading.enumerate()]
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': names + events, 'displayTimeUnit': 'ms',
+                       'otherData': {'stats': self.stats()}}, f, ensure_ascii=False)
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+            self._durations.clear()
+            self._last.clear()
+
+
+# Общий регистратор приложения
+RECORDER = Recorder()
+span = RECORDER.span
@@ -0,0 +1,75 @@
+# Быстрые ядра цветовых коррекций для интерактивных правок.
+# Насыщенность — одна матрица 3x3 на пиксель (смешение с яркостью, как в ImageEnhance.Color),
+# без промежуточного серого изображения и смешения двух копий.
+# С OpenCV (необязательная зависимость) матрица применяется через cv2.transform,
+# иначе — Image.convert с матрицей средствами PIL.
+import functools
+import threading
+import weakref
+import numpy as np
+from PIL import Image
+import tone
+
+_local = threading.local()
+
+# Больше этого (прокси предпросмотра 1600x1600) буфер результата не переиспользуется
+REUSE_MAX_PIXELS = 1600 * 1600
+
+
+@functools.lru_cache(maxsize=None)
+def cv2_module():
+    # OpenCV — необязательная зависимость: None, если не установлен (проверяется один раз)
+    try:
+        import cv2
+    except ImportError:
+        return None
+    return cv2
+
+
+def saturation_matrix(value):
+    # out = L + value * (c - L) = value * c + (1 - value) * L для каждого канала c
+    value = float(value)
+    matrix = np.outer(np.ones(3), (1.0 - value) * tone.LUMA_WEIGHTS) + value * np.eye(3)
+    return matrix.astype(np.float32)
+
+
+def source_array(image):
+    # Пиксели image как массив. Запоминается последний источник потока:
+    # тики одного перетаскивания ползунка применяются к одному и тому же кадру.
+    # Копия освобождается вместе с изображением (колбэк weakref), а не держится до следующего вызова
+    cached = getattr(_local, 'source', None)
+    if cached and cached[0]() is image:
+        return cached[1]
+    array = np.asarray(image)
+    entry = []
+    entry.extend((weakref.ref(image, lambda _: entry.clear()), array))
+    _local.source = entry
+    return array
+
+
+def output_buffer(shape):
+    # Буфер результата ядра, общий для вызовов потока: Image.fromarray копирует
+    # пиксели, поэтому буфер свободен сразу после создания кадра.
+    # Держится только буфер размера прокси; полное разрешение получает разовый массив
+    if shape[0] * shape[1] > REUSE_MAX_PIXELS:
+        return None
+    buffer = getattr(_local, 'output', None)
+    if buffer is None or buffer.shape != shape:
+        buffer = _local.output = np.empty(shape, np.uint8)
+    return buffer
+
+
+def reset_caches():
+    # Забыть запомненные массивы потока (замеры "с холодного старта")
+    _local.__dict__.clear()
+
+
+def saturation(image, value):
+    # Насыщенность RGB-изображения; результат — новый кадр (кадры неизменяемы)
+    cv2 = cv2_module()
+    matrix = saturation_matrix(value)
+    if cv2 is None:
+        return image.convert('RGB', tuple(np.hstack([matrix, np.zeros((3, 1))]).ravel()))
+    # cv2.transform считает в float с насыщением до uint8, как и матрица PIL
+    source = source_array(image)
+    return Image.fromarray(cv2.transform(source, matrix, dst=output_buffer(source.shape)))
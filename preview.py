@@ -0,0 +1,176 @@
+# Предпросмотр на уменьшенной копии (прокси).
+# При загрузке один раз строится пирамида уменьшенных копий исходника,
+# интерактивные правки выполняются на прокси, а журнал шагов позволяет
+# повторить всю цепочку на полном разрешении только при сохранении.
+# Если файл декодирован в уменьшенном виде, полное разрешение загружается
+# только тогда, когда оно действительно понадобилось.
+from collections import OrderedDict
+import threading
+import weakref
+from PIL import Image
+import engine
+from instrument import span
+from history import EditHistory, CheckpointCache, PREVIEW_BUDGET_BYTES, FULL_BUDGET_BYTES
+
+# Размер прокси, на котором идут интерактивные правки (с запасом для HiDPI и зума)
+PROXY_MAX_SIZE = (1600, 1600)
+# Самый маленький уровень пирамиды — не меньше области предпросмотра
+PYRAMID_MIN_SIZE = (380, 600)
+# Фильтры для показа: быстрый — пока ползунок тянут, качественный — после отпускания
+DISPLAY_FAST = Image.Resampling.BILINEAR
+DISPLAY_QUALITY = Image.Resampling.LANCZOS
+
+
+def build_pyramid(image, max_size=PROXY_MAX_SIZE, min_size=PYRAMID_MIN_SIZE):
+    # Уровни от крупного к мелкому; каждый следующий вдвое меньше предыдущего
+    base = image.copy()
+    # reducing_gap: сначала быстрое целочисленное уменьшение, затем LANCZOS
+    base.thumbnail(max_size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+    levels = [base]
+    while (levels[-1].width // 2 >= min_size[0] or levels[-1].height // 2 >= min_size[1]) \
+            and min(levels[-1].size) >= 2:
+        levels.append(levels[-1].reduce(2))
+    return levels
+
+
+def level_for(levels, box):
+    # Наименьший уровень, который не меньше области box (для отображения/зума)
+    for level in reversed(levels):
+        if level.width >= box[0] or level.height >= box[1]:
+            return level
+    return levels[0]
+
+
+class PreviewDocument:
+    # Исходник в полном разрешении + пирамида прокси + история операций.
+    # Кадры прокси и полного разрешения восстанавливаются из журнала через кэши контрольных точек.
+
+    def __init__(self, image, budget_bytes=PREVIEW_BUDGET_BYTES, full_budget_bytes=FULL_BUDGET_BYTES,
+                 load_full=None, size=None, pyramid=None, full_lead=()):
+        # image — исходник или его уменьшенная при декодировании копия;
+        # во втором случае size — полный размер, а load_full загружает исходник,
+        # к которому перед журналом применяются шаги full_lead (EXIF-ориентация).
+        # pyramid — уже построенная пирамида image (уровни неизменяемы и могут быть общими)
+        self.size = tuple(size or image.size)
+        self._source = image if image.size == self.size else None
+        self._load_full = load_full
+        self._full_lead = full_lead if self._source is None else ()
+        self._source_lock = threading.Lock()
+        self.pyramid = pyramid or build_pyramid(image)
+        self.history = EditHistory()
+        # Снимок журнала для UI-потока: history меняет только поток обработки,
+        # он же публикует новый снимок после каждого изменения
+        self.published = self.history.snapshot()
+        self._proxy_frames = CheckpointCache(self.proxy, budget_bytes)
+        self._full_frames = None  # Создается при первом рендере полного разрешения
+        self._full_budget = full_budget_bytes
+
+    @property
+    def source(self):
+        # Полноразмерный исходник (не меняется); загружается при первом обращении.
+        # Если он загружен без поворота, ориентацию задают шаги full_lead
+        with self._source_lock:
+            if self._source is None:
+                with span('decode_full'):
+                    self._source = self._load_full()
+            return self._source
+
+    @property
+    def proxy(self):
+        # Уровень пирамиды, на котором идут правки
+        return self.pyramid[0]
+
+    @property
+    def is_proxy(self):
+        # True, если предпросмотр действительно меньше исходника
+        return self.proxy.size != self.size
+
+    @property
+    def steps(self):
+        return self.history.steps
+
+    @property
+    def processed(self):
+        # Обработанный прокси для текущей позиции истории
+        return self._proxy_frames.render(self.history.all_steps, self.history.position)
+
+    def original_for(self, box):
+        return level_for(self.pyramid, box)
+
+    def base_for(self, name, group=None, absolute=False):
+        # Кадр, к которому будет применена операция name
+        position = self.history.position
+        if self.history.replaces(name, group) or (absolute and self.history.top(name) is not None):
+            position -= 1
+        return self._proxy_frames.render(self.history.all_steps, position)
+
+    def _invalidate_after(self, index):
+        self._proxy_frames.invalidate_after(index)
+        if self._full_frames is not None:
+            self._full_frames.invalidate_after(index)
+        self.published = self.history.snapshot()
+
+    def apply(self, name, group=None, absolute=False, **params):
+        # Операция поверх текущего результата. Шаги одной группы group
+        # (одно перетаскивание ползунка) заменяют друг друга; absolute — см. EditHistory.push.
+        # Статистика входа (среднее контраста, перцентили автоуровней) берется с прокси
+        # и записывается в шаг: полное разрешение рендерится с теми же числами
+        if engine.needs_stats(name, params):
+            params = engine.freeze_statistics(self.base_for(name, group, absolute), name, params)
+        self._invalidate_after(self.history.push(name, params, group, absolute))
+        return self.processed
+
+    def _moved(self, changed):
+        if changed is not None:
+            self._invalidate_after(changed)
+        else:
+            self.published = self.history.snapshot()
+        return self.processed
+
+    def undo(self):
+        return self._moved(self.history.undo())
+
+    def redo(self):
+        return self._moved(self.history.redo())
+
+    def reset(self):
+        self.history.clear()
+        self._invalidate_after(0)
+        return self.processed
+
+    def render_full(self):
+        # Журнал на полном разрешении (для сохранения/экспорта) от ближайшей контрольной точки
+        if self._full_frames is None:
+            self._full_frames = CheckpointCache(self.source, self._full_budget, self._full_lead)
+        return self._full_frames.render(self.history.all_steps, self.history.position)
+
+
+class DisplayCache:
+    # Уменьшенные копии для показа: (изображение, рамка, фильтр) -> копия.
+    # Кадры неизменяемы, поэтому объект изображения и есть его версия;
+    # запись живет, пока жив сам кадр (weakref), и не больше max_entries.
+    # Заполняется и из фонового потока, поэтому доступ под блокировкой.
+
+    def __init__(self, max_entries=16):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def thumbnail(self, image, box, resample=DISPLAY_QUALITY):
+        key = (id(image), box, resample)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0]() is image:
+                self._entries.move_to_end(key)
+                return entry[1]
+        # Быстрый фильтр допускает более грубое предварительное уменьшение
+        gap = 2.0 if resample == DISPLAY_FAST else 3.0
+        with span('thumbnail'):
+            thumb = image.copy()
+            thumb.thumbnail(box, resample, reducing_gap=gap)
+        with self._lock:
+            self._entries[key] = (weakref.ref(image), thumb)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return thumb
@@ -1,11 +1,22 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-from PIL import Image, ImageTk, ImageOps, ImageEnhance
-import cv2
-import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from PIL import ImageTk
 import os
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+import sys
+import argparse
+import engine
+from preview import DisplayCache, DISPLAY_FAST, DISPLAY_QUALITY, level_for
+from render import RenderScheduler
+from cache import PreviewCache
+from session import FolderSession, load_decoded
+import histogram
+import export
+from instrument import RECORDER, span
+import startup
+
+# Область предпросмотра для каждой из двух панелей
+DISPLAY_BOX = (380, 600)
 
 class ImageProcessorApp:
     def __init__(self, root):
@@ -14,13 +25,27 @@ class ImageProcessorApp:
         self.root.geometry("1200x800")  # Размер окна (ширина x высота)
 
         # Переменные для хранения изображений
-        self.original_image = None  # Исходное изображение
-        self.processed_image = None  # Обработанное изображение
+        self.image_info = None  # Сведения из заголовка файла (формат, размер, EXIF)
+        self.processed_image = None  # Обработанное изображение (уменьшенный прокси для предпросмотра)
+        self.preview = None  # Пирамида прокси и журнал операций для повтора на полном разрешении
         self.image_path = None  # Путь к файлу изображения
         self.photo_exif = None
+        self.slider_gesture = 0  # Номер текущего перетаскивания ползунка: его тики — один шаг истории
+        self.dragging = False  # Ползунок тянут: кадры показываются с быстрым фильтром
+        self.display_cache = DisplayCache()  # Уменьшенные копии для панелей предпросмотра
+        self.preview_cache = PreviewCache()  # Прокси, гистограммы и EXIF уже открывавшихся файлов
+        # Запись в дисковый кэш — в своем потоке, чтобы не занимать поток обработки правок
+        self.cache_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='preview-cache')
+        self.session = None  # Просмотр папки (следующий/предыдущий файл)
 
         self.setup_ui()  # Создаем интерфейс
 
+        # Фоновая обработка: UI не блокируется на больших файлах
+        self.status_message = 'Готово'
+        self.latency_text = ''  # Разбивка времени последней операции по этапам
+        self.scheduler = RenderScheduler(self.root, on_status=self.update_status)
+        self.histogram_window = histogram.HistogramWindow(self.root)
+
     def setup_ui(self):
         # Настройка темы и стилей (только визуальные изменения)
         style = ttk.Style()
@@ -69,11 +94,19 @@ class ImageProcessorApp:
         ttk.Label(preview_frame, text='Обработанное', style='Header.TLabel').grid(row=0, column=1, padx=5, pady=(5, 0), sticky=tk.W)
 
         # Все твои элементы — в left_panel, как раньше
-        ttk.Button(left_panel, text="Загрузить изображение",
-                   command=self.load_image).grid(row=0, column=0, pady=5, sticky=tk.W)
-
-        ttk.Button(left_panel, text="Сохранить изображение",
-                   command=self.save_image).grid(row=1, column=0, pady=5, sticky=tk.W)
+        open_frame = ttk.Frame(left_panel)
+        open_frame.grid(row=0, column=0, pady=5, sticky=tk.W)
+        ttk.Button(open_frame, text="Загрузить изображение",
+                   command=self.load_image).grid(row=0, column=0, padx=(0, 5))
+        ttk.Button(open_frame, text="Открыть папку",
+                   command=self.open_folder).grid(row=0, column=1)
+
+        save_frame = ttk.Frame(left_panel)
+        save_frame.grid(row=1, column=0, pady=5, sticky=tk.W)
+        ttk.Button(save_frame, text="Сохранить изображение",
+                   command=self.save_image).grid(row=0, column=0, padx=(0, 5))
+        ttk.Button(save_frame, text="Экспорт для публикации",
+                   command=self.export_image).grid(row=0, column=1)
 
         self.info_text = tk.Text(left_panel, height=15, width=35)
         self.info_text.grid(row=2, column=0, pady=10, sticky=tk.W)
@@ -88,24 +121,37 @@ class ImageProcessorApp:
 
         ttk.Label(left_panel, text="Яркость:").grid(row=6, column=0, pady=5, sticky=tk.W)
         self.brightness_var = tk.DoubleVar(value=1.0)
-        ttk.Scale(left_panel, from_=0.1, to=2.0, variable=self.brightness_var,
-                  command=self.adjust_brightness).grid(row=7, column=0, pady=5, sticky=tk.W + tk.E)
+        brightness_scale = ttk.Scale(left_panel, from_=0.1, to=2.0, variable=self.brightness_var,
+                  command=self.adjust_brightness)
+        brightness_scale.grid(row=7, column=0, pady=5, sticky=tk.W + tk.E)
+        brightness_scale.bind('<ButtonPress-1>', self.begin_slider_gesture)
+        brightness_scale.bind('<ButtonRelease-1>', self.end_slider_gesture)
 
         ttk.Label(left_panel, text="Насыщенность:").grid(row=8, column=0, pady=5, sticky=tk.W)
         self.saturation_var = tk.DoubleVar(value=1.0)
-        ttk.Scale(left_panel, from_=0.1, to=2.0, variable=self.saturation_var,
-                  command=self.adjust_saturation).grid(row=9, column=0, pady=5, sticky=tk.W + tk.E)
+        saturation_scale = ttk.Scale(left_panel, from_=0.1, to=2.0, variable=self.saturation_var,
+                  command=self.adjust_saturation)
+        saturation_scale.grid(row=9, column=0, pady=5, sticky=tk.W + tk.E)
+        saturation_scale.bind('<ButtonPress-1>', self.begin_slider_gesture)
+        saturation_scale.bind('<ButtonRelease-1>', self.end_slider_gesture)
 
         ttk.Label(left_panel, text="Контрастность:").grid(row=10, column=0, pady=5, sticky=tk.W)
         self.contrast_var = tk.DoubleVar(value=1.0)
-        ttk.Scale(left_panel, from_=0.1, to=2.0, variable=self.contrast_var,
-                  command=self.adjust_contrast).grid(row=11, column=0, pady=5, sticky=tk.W + tk.E)
+        contrast_scale = ttk.Scale(left_panel, from_=0.1, to=2.0, variable=self.contrast_var,
+                  command=self.adjust_contrast)
+        contrast_scale.grid(row=11, column=0, pady=5, sticky=tk.W + tk.E)
+        contrast_scale.bind('<ButtonPress-1>', self.begin_slider_gesture)
+        contrast_scale.bind('<ButtonRelease-1>', self.end_slider_gesture)
 
         ttk.Button(left_panel, text="Показать гистограмму",
                    command=self.show_histogram).grid(row=12, column=0, pady=5, sticky=tk.W)
 
-        ttk.Button(left_panel, text="Поворот на 90°",
-                   command=self.rotate_image).grid(row=13, column=0, pady=5, sticky=tk.W)
+        geometry_frame = ttk.Frame(left_panel)
+        geometry_frame.grid(row=13, column=0, pady=5, sticky=tk.W)
+        ttk.Button(geometry_frame, text="Поворот на 90°",
+                   command=self.rotate_image).grid(row=0, column=0, padx=(0, 5))
+        ttk.Button(geometry_frame, text="Отразить",
+                   command=self.flip_image).grid(row=0, column=1)
 
         ttk.Button(left_panel, text="Линейная коррекция",
                    command=self.linear_correction).grid(row=14, column=0, pady=5, sticky=tk.W)
@@ -116,6 +162,30 @@ class ImageProcessorApp:
         ttk.Button(left_panel, text="Сбросить изменения",
                    command=self.reset_changes).grid(row=18, column=0, pady=5, sticky=tk.W)
 
+        # Линейная коррекция цветного изображения: по яркости или по каждому каналу
+        self.levels_per_channel_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(left_panel, text="Лин. коррекция по каналам",
+                        variable=self.levels_per_channel_var).grid(row=19, column=0, pady=5, sticky=tk.W)
+
+        # Отмена и повтор правок
+        history_frame = ttk.Frame(left_panel)
+        history_frame.grid(row=20, column=0, pady=5, sticky=tk.W)
+        ttk.Button(history_frame, text="Отменить",
+                   command=self.undo).grid(row=0, column=0, padx=(0, 5))
+        ttk.Button(history_frame, text="Повторить",
+                   command=self.redo).grid(row=0, column=1)
+        self.root.bind('<Control-z>', lambda event: self.undo())
+        self.root.bind('<Control-y>', lambda event: self.redo())
+        self.root.bind('<Control-Z>', lambda event: self.redo())
+
+        # Замеры этапов: трассировка для chrome://tracing и таблица p50/p95
+        trace_frame = ttk.Frame(left_panel)
+        trace_frame.grid(row=21, column=0, pady=5, sticky=tk.W)
+        ttk.Button(trace_frame, text="Экспорт трассировки",
+                   command=self.export_trace).grid(row=0, column=0, padx=(0, 5))
+        ttk.Button(trace_frame, text="Статистика этапов",
+                   command=self.show_stats).grid(row=0, column=1)
+
         # Ползунок гамма-коррекции (используется линейной и нелинейной коррекцией)
         ttk.Separator(left_panel, orient='horizontal').grid(row=17, column=0, pady=8, sticky=tk.W + tk.E)
         ttk.Label(left_panel, text="Гамма:").grid(row=16, column=0, pady=5, sticky=tk.W)
@@ -130,6 +200,18 @@ class ImageProcessorApp:
         self.image_label = ttk.Label(preview_frame)
         self.image_label.grid(row=1, column=1, sticky=(tk.W, tk.E, tk.N, tk.S), padx=5, pady=5)
 
+        # Навигация по папке (PageUp / PageDown)
+        nav_frame = ttk.Frame(preview_frame)
+        nav_frame.grid(row=2, column=0, columnspan=2, pady=5)
+        ttk.Button(nav_frame, text="◀ Предыдущее",
+                   command=lambda: self.step_folder(-1)).grid(row=0, column=0)
+        self.nav_label = ttk.Label(nav_frame, text='', width=40, anchor='center')
+        self.nav_label.grid(row=0, column=1, padx=10)
+        ttk.Button(nav_frame, text="Следующее ▶",
+                   command=lambda: self.step_folder(1)).grid(row=0, column=2)
+        self.root.bind('<Prior>', lambda event: self.step_folder(-1))
+        self.root.bind('<Next>', lambda event: self.step_folder(1))
+
         # Статус-бар
         self.status_label = ttk.Label(self.root, text='Готово', anchor='w', relief='sunken', padding=(10, 2))
         self.status_label.grid(row=1, column=0, sticky=(tk.W, tk.E))
@@ -141,51 +223,127 @@ class ImageProcessorApp:
         )
 
         if file_path:
-            try:
-                self.image_path = file_path # Сохраняем путь к файлу
-                self.original_image = ImageOps.exif_transpose(Image.open(file_path))
-                self.processed_image = self.original_image.copy()  # Создаем копию для обработки
-                self.display_image()  # Отображаем изображение
-                self.update_image_info()  # Обновляем информацию
-                # Сбрасываем слайдеры в исходное положение
-                self.brightness_var.set(1.0)
-                self.saturation_var.set(1.0)
-                self.contrast_var.set(1.0)
-            except Exception as e:
-                messagebox.showerror("Ошибка", f"Не удалось загрузить изображение: {str(e)}")
+            self.close_session()
+
+            def done(decoded):
+                self.show_decoded(decoded)
+                if not decoded.cached:
+                    # Запись в кэш — уже после показа, чтобы не задерживать первый кадр
+                    info, proxy = decoded.info, decoded.pyramid[0]
+                    self.cache_writer.submit(self.preview_cache.put, file_path, info, proxy)
+
+            # Декодирование и построение прокси — в фоновом потоке
+            self.run_in_background(lambda: load_decoded(file_path, self.preview_cache), done,
+                                   "Не удалось загрузить изображение", operation='load')
+
+    def show_decoded(self, decoded):
+        # Показать загруженный файл; правки идут на уменьшенной копии,
+        # полное разрешение загружается только при сохранении
+        self.image_path = decoded.info.path # Сохраняем путь к файлу
+        self.image_info, self.preview = decoded.info, decoded.document()
+        self.processed_image = self.preview.processed
+        self.display_image()  # Отображаем изображение
+        self.histogram_window.update(self.preview.proxy, self.processed_image, self.histogram_scale())
+        self.update_image_info()  # Обновляем информацию
+        self.update_navigation()
+        # Сбрасываем слайдеры в исходное положение
+        self.brightness_var.set(1.0)
+        self.saturation_var.set(1.0)
+        self.contrast_var.set(1.0)
+
+    def open_folder(self):
+        # Просмотр всех изображений папки; соседние файлы загружаются заранее
+        folder = filedialog.askdirectory()
+        if not folder:
+            return
+        session = FolderSession(folder, self.preview_cache, prepare=self.prepare_decoded)
+        if not len(session):
+            session.close()
+            messagebox.showinfo("Папка", "В папке нет поддерживаемых изображений")
+            return
+        self.close_session()
+        self.session = session
+        self.go_to(0)
+
+    def prepare_decoded(self, decoded):
+        # Фоновая подготовка соседнего файла: уменьшенная копия для левой панели
+        self.display_cache.thumbnail(level_for(decoded.pyramid, DISPLAY_BOX), DISPLAY_BOX)
+
+    def step_folder(self, delta):
+        if self.session is not None:
+            self.go_to(self.session.index + delta)
+
+    def go_to(self, index):
+        session = self.session
+        index = session.clamp(index)
+        if index == session.index and session.path == self.image_path:
+            return
+        session.index = index  # Быстрые нажатия отсчитываются от цели, а не от показанного файла
+        self.update_navigation()
+
+        def done(decoded):
+            if session is self.session:
+                self.show_decoded(decoded)
+
+        # Промежуточные файлы при быстром листании пропускаются (coalesce)
+        self.run_in_background(lambda: session.load(index), done, "Не удалось загрузить изображение",
+                               coalesce='navigate', channel='navigate', operation='load')
+
+    def update_navigation(self):
+        session = self.session
+        if session is None:
+            self.nav_label.configure(text='')
+            return
+        self.nav_label.configure(text=f"{session.index + 1} / {len(session)}: {os.path.basename(session.path)}")
+
+    def close_session(self):
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+            self.update_navigation()
 
     def display_image(self):
         # Отображение изображения в интерфейсе
-        if self.original_image:
-            # Отображаем неизменяемое исходное изображение слева
-            left_max_size = (380, 600)
-            left_image = self.original_image.copy()
-            left_image.thumbnail(left_max_size, Image.Resampling.LANCZOS)
-            left_photo = ImageTk.PhotoImage(left_image)
-            self.original_image_label.configure(image=left_photo)
-            self.original_image_label.image = left_photo
+        if self.preview:
+            # Неизменяемое исходное изображение слева: уменьшается один раз на загрузку
+            left_image = self.display_cache.thumbnail(self.preview.original_for(DISPLAY_BOX), DISPLAY_BOX)
+            self.set_label_image(self.original_image_label, left_image)
 
         if self.processed_image:
-            # Отображаем текущее обработанное изображение справа
-            right_max_size = (380, 600)
-            right_image = self.processed_image.copy()
-            right_image.thumbnail(right_max_size, Image.Resampling.LANCZOS)
-            right_photo = ImageTk.PhotoImage(right_image)
-            self.image_label.configure(image=right_photo)
-            self.image_label.image = right_photo
+            # Текущее обработанное изображение справа
+            self.set_label_image(self.image_label, self.display_thumbnail(self.processed_image))
+
+    def display_filter(self):
+        return DISPLAY_FAST if self.dragging else DISPLAY_QUALITY
+
+    def display_thumbnail(self, image):
+        # Без правок справа тот же кадр, что и слева — берем готовую копию
+        if image is self.preview.proxy:
+            return self.display_cache.thumbnail(self.preview.original_for(DISPLAY_BOX), DISPLAY_BOX)
+        return self.display_cache.thumbnail(image, DISPLAY_BOX, self.display_filter())
+
+    def set_label_image(self, label, thumb):
+        # PhotoImage создается только для новой уменьшенной копии
+        if getattr(label, 'thumb', None) is thumb:
+            return
+        with span('photoimage'):
+            photo = ImageTk.PhotoImage(thumb)
+        label.configure(image=photo)
+        label.image = photo
+        label.thumb = thumb
 
     def update_image_info(self):
         # Обновление информации об изображении
-        if not self.image_path:
+        if not self.image_info:
             return
+        img = self.image_info  # Все сведения уже прочитаны из заголовка при загрузке
 
         try:
             info = ""
-            file_size = os.path.getsize(self.image_path)
+            file_size = img.file_size
             info += f"Размер файла: {file_size} байт ({file_size / 1024:.2f} KB)\n"
 
             # Свойства изображения
-            img = Image.open(self.image_path)
             info += f"Разрешение: {img.width} x {img.height}\n"
             info += f"Формат: {img.format}\n"
             info += f"Цветовая модель: {img.mode}\n"
@@ -200,7 +358,7 @@ class ImageProcessorApp:
             else:
                 info += f"Глубина цвета: информация о режиме {img.mode}\n"
 
-            if self.original_image.getexif():
+            if img.exif:
                 info += "\nEXIF информация:\n"
 
                 target_tags = {
@@ -261,7 +419,7 @@ class ImageProcessorApp:
                     42022: 'LensSerialNumber',  # Серийный номер объектива
                 }
 
-                all_exif = self.original_image.getexif()
+                all_exif = img.exif
 
                 displayed_count = 0
                 for tag_id, value in all_exif.items():
@@ -299,177 +457,243 @@ class ImageProcessorApp:
             messagebox.showerror("Ошибка", f"Не удалось скопировать текст: {str(e)}")
 
 
+    def run_in_background(self, func, on_done, error_text, coalesce=None, channel=None, operation=None):
+        # Выполнить func в фоновом потоке; on_done и сообщение об ошибке — в главном потоке.
+        # channel — только для кадров правок: устаревший кадр канала может быть пропущен,
+        # поэтому загрузка, сброс и отмена (меняют документ и ползунки) идут без канала.
+        # operation — имя для замеров: время по этапам попадает в статус-бар
+        def on_error(e):
+            messagebox.showerror("Ошибка", f"{error_text}: {str(e)}")
+        if operation is not None:
+            func, on_done = self.timed_operation(operation, func, on_done)
+        self.scheduler.submit(func, on_done=on_done, on_error=on_error, coalesce=coalesce, channel=channel)
+
+    def timed_operation(self, name, func, on_done):
+        # Фоновая часть операции и ее показ в UI-потоке замеряются отдельно
+        def timed_func():
+            with span(name):
+                return func()
+
+        def timed_done(result):
+            with span('display', operation=name):
+                on_done(result)
+            self.show_latency(name)
+
+        return timed_func, timed_done
+
+    def show_latency(self, name, display=True):
+        # Статус-бар: "edit:brightness 12.3 мс: tone_lut 5.1 · thumbnail 4.0  |  display 3.2 мс: photoimage 2.9"
+        breakdowns = [RECORDER.last(name), RECORDER.last('display') if display else None]
+        self.latency_text = '  |  '.join(breakdown.summary() for breakdown in breakdowns if breakdown)
+        self.update_status(*self.scheduler.counts())
+
+    def export_trace(self):
+        # Трассировка последних операций для chrome://tracing или ui.perfetto.dev
+        file_path = filedialog.asksaveasfilename(defaultextension=".json", initialfile="trace.json",
+                                                 filetypes=[("Chrome trace", "*.json")])
+        if file_path:
+            try:
+                RECORDER.export_chrome_trace(file_path)
+            except OSError as e:
+                messagebox.showerror("Ошибка", f"Не удалось сохранить трассировку: {str(e)}")
+
+    def show_stats(self):
+        # Скользящая статистика по этапам: где тратится время на файлах пользователя
+        window = tk.Toplevel(self.root)
+        window.title("Статистика этапов")
+        text = tk.Text(window, width=60, height=24, font=('Courier New', 10))
+        text.pack(fill=tk.BOTH, expand=True)
+        text.insert(1.0, RECORDER.stats_table())
+        text.configure(state='disabled')
+
+    def edit_in_background(self, name, error_text, group=None, coalesce=None, absolute=False, **params):
+        # Правка прокси в фоне; результат показывается, только если документ не сменился
+        doc = self.preview
+
+        def edit():
+            return self.prepare_frame(doc, doc.apply(name, group=group, absolute=absolute, **params))
+
+        self.run_in_background(edit, lambda image: self.show_frame(doc, image),
+                               error_text, coalesce=coalesce, channel='frame', operation=f'edit:{name}')
+
+    def prepare_frame(self, doc, image):
+        # Фоновая подготовка кадра к показу: в UI-потоке остается только PhotoImage
+        if self.histogram_window.is_open:
+            histogram.prefetch(image)  # Открытое окно гистограммы обновится без пересчета в UI
+        if doc is self.preview:
+            self.display_thumbnail(image)
+        return image
+
+    def show_frame(self, doc, image):
+        # Готовый кадр от фонового потока
+        if doc is self.preview:
+            self.processed_image = image
+            self.display_image()
+            self.histogram_window.update(doc.proxy, image, self.histogram_scale())
+
+    def set_status(self, message):
+        self.status_message = message
+        self.update_status(*self.scheduler.counts())
+
+    def update_status(self, running, queued):
+        # Статус-бар: последнее сообщение + объем фоновой работы + время последней операции
+        text = self.status_message
+        if running or queued:
+            text += f"  |  в работе: {running}, в очереди: {queued}"
+        if self.latency_text:
+            text += f"  |  {self.latency_text}"
+        self.status_label.configure(text=text)
+
     def convert_to_grayscale(self):
         # Преобразование изображения в оттенки серого
         if self.processed_image:
-            try:
-                if self.processed_image.mode != 'L':  # Если еще не в grayscale
-                    self.processed_image = self.processed_image.convert('L')  # Конвертируем
-                self.display_image()  # Обновляем отображение
-            except Exception as e:
-                messagebox.showerror("Ошибка", f"Не удалось преобразовать в серый: {str(e)}")
+            self.edit_in_background('grayscale', "Не удалось преобразовать в серый")
 
     def adjust_brightness(self, value):
         # Коррекция яркости изображения
         if self.processed_image:
-            try:
-                # Создаем усилитель яркости на основе оригинального изображения
-                enhancer = ImageEnhance.Brightness(self.original_image)
-                # Применяем коррекцию (value от 0.1 до 2.0)
-                self.processed_image = enhancer.enhance(float(value))
-                self.display_image()
-            except Exception as e:
-                messagebox.showerror("Ошибка", f"Не удалось изменить яркость: {str(e)}")
+            # value от 0.1 до 2.0; одно перетаскивание ползунка — один шаг истории
+            self.edit_in_background('brightness', "Не удалось изменить яркость",
+                                    group=('brightness', self.slider_gesture),
+                                    coalesce='brightness', absolute=True, value=float(value))
 
     def adjust_contrast(self, value):
         # Коррекция контрастности
         if self.processed_image:
-            try:
-                enhancer = ImageEnhance.Contrast(self.processed_image)
-                self.processed_image = enhancer.enhance(float(value))
-                self.display_image()
-            except Exception as e:
-                messagebox.showerror("Ошибка", f"Не удалось изменить контрастность: {str(e)}")
+            self.edit_in_background('contrast', "Не удалось изменить контрастность",
+                                    group=('contrast', self.slider_gesture),
+                                    coalesce='contrast', absolute=True, value=float(value))
 
     def adjust_saturation(self, value):
         # Коррекция насыщенности (только для цветных изображений)
         if self.processed_image and self.processed_image.mode != 'L':
-            try:
-                enhancer = ImageEnhance.Color(self.processed_image)
-                self.processed_image = enhancer.enhance(float(value))
-                self.display_image()
-            except Exception as e:
-                messagebox.showerror("Ошибка", f"Не удалось изменить насыщенность: {str(e)}")
+            self.edit_in_background('saturation', "Не удалось изменить насыщенность",
+                                    group=('saturation', self.slider_gesture),
+                                    coalesce='saturation', absolute=True, value=float(value))
 
     def show_histogram(self):
-        # Показать гистограмму изображения (распределение яркостей пикселей)
+        # Показать гистограмму изображения (распределение яркостей пикселей).
+        # Окно одно: при правках оно обновляется на месте
         if not self.processed_image:
             return
+        doc, processed_image = self.preview, self.processed_image
 
-        # Подготовка данных: исходное и обработанное изображения
-        def to_cv(img: Image.Image):
-            if img.mode == 'L':
-                return np.array(img), ['Grayscale'], ['black']
-            arr = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
-            return arr, ['Blue', 'Green', 'Red'], ['b', 'g', 'r']
-
-        orig_cv, orig_channels, orig_colors = to_cv(self.original_image) if self.original_image else (None, [], [])
-        proc_cv, proc_channels, proc_colors = to_cv(self.processed_image)
-
-        # Создаем новое окно для гистограммы
-        hist_window = tk.Toplevel(self.root)  # Toplevel - дочернее окно
-        hist_window.title("Гистограмма: исходное (сверху) и обработанное (снизу)")
-        hist_window.geometry("900x700")
-
-        # Создаем 2 подграфика: сверху исходное, снизу обработанное
-        fig, (ax_top, ax_bottom) = plt.subplots(2, 1, figsize=(9, 7), sharex=True)
-
-        # Верх: исходное
-        if orig_cv is not None:
-            if self.original_image.mode == 'L':
-                hist = cv2.calcHist([orig_cv], [0], None, [256], [0, 256])
-                ax_top.plot(hist, color=orig_colors[0], label=orig_channels[0])
-            else:
-                for i, col in enumerate(orig_colors):
-                    hist = cv2.calcHist([orig_cv], [i], None, [256], [0, 256])
-                    ax_top.plot(hist, color=col, label=orig_channels[i])
-            ax_top.set_title('Исходное изображение')
-            ax_top.set_ylabel('Пиксели')
-            ax_top.legend()
-            ax_top.grid(True)
-
-        # Низ: обработанное
-        if self.processed_image.mode == 'L':
-            hist = cv2.calcHist([proc_cv], [0], None, [256], [0, 256])
-            ax_bottom.plot(hist, color=proc_colors[0], label=proc_channels[0])
-        else:
-            for i, col in enumerate(proc_colors):
-                hist = cv2.calcHist([proc_cv], [i], None, [256], [0, 256])
-                ax_bottom.plot(hist, color=col, label=proc_channels[i])
-        ax_bottom.set_title('Обработанное изображение')
-        ax_bottom.set_xlabel('Уровень интенсивности')
-        ax_bottom.set_ylabel('Пиксели')
-        ax_bottom.legend()
-        ax_bottom.grid(True)
-
-        fig.tight_layout()
-
-        # Встраиваем график в Tkinter окно
-        canvas = FigureCanvasTkAgg(fig, master=hist_window)
-        canvas.draw()  # Рисуем график
-        canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)  # Растягиваем на все окно
+        def compute():
+            # Подсчет гистограмм (по прокси) — в фоне, построение графика — в главном потоке
+            histogram.prefetch(doc.proxy)
+            histogram.prefetch(processed_image)
+
+        self.run_in_background(compute, lambda _: self.histogram_window.show(
+                                   doc.proxy, processed_image, self.histogram_scale()),
+                               "Не удалось построить гистограмму")
+
+    def histogram_scale(self):
+        # Гистограммы считаются по прокси; пересчитываем их в пиксели полного разрешения
+        proxy, (width, height) = self.preview.proxy, self.preview.size
+        return (width * height) / (proxy.width * proxy.height)
 
     def rotate_image(self):
         # Поворот изображения на 90 градусов
         if self.processed_image:
-            try:
-                # rotate(угол, expand=True - автоматически меняет размер canvas)
-                self.processed_image = self.processed_image.rotate(90, expand=True)
-                self.display_image()
-            except Exception as e:
-                messagebox.showerror("Ошибка", f"Не удалось повернуть изображение: {str(e)}")
+            self.edit_in_background('rotate', "Не удалось повернуть изображение", angle=90)
+
+    def flip_image(self):
+        # Зеркальное отражение слева направо
+        if self.processed_image:
+            self.edit_in_background('flip', "Не удалось отразить изображение", direction='horizontal')
 
     def linear_correction(self):
         # Линейное растяжение гистограммы (улучшение контраста)
         if self.processed_image:
-            try:
-                # Приводим к оттенкам серого на время коррекции (работает и для RGB-фото)
-                gray_img = self.processed_image.convert('L')
-                # ВАЖНО: работаем в float, чтобы избежать переполнений uint8 при (x - min)
-                img_array = np.array(gray_img).astype('float32')
+            # Доп. гамма-коррекция поверх линейного растяжения, если ползунок не 1.0
+            gamma = float(self.gamma_var.get()) if hasattr(self, 'gamma_var') else 1.0
+            link = 'channels' if self.levels_per_channel_var.get() else 'luminance'
+            doc = self.preview
+
+            def compute():
                 # Растяжение по перцентилям (устойчивее, даёт видимый эффект)
-                p_low, p_high = np.percentile(img_array, (1, 99))
-                if p_high == p_low:
+                # Повторная коррекция заменяет предыдущую (подбор гаммы без накопления)
+                ranges = engine.levels_ranges(doc.base_for('linear_correction', group='levels'), link)
+                if not any(ranges):
+                    return None, None
+                # Те же перцентили, что в статусе, записываются в шаг и используются при сохранении
+                return ranges, doc.apply('linear_correction', group='levels', gamma=gamma, link=link,
+                                         ranges=ranges)
+
+            def done(result):
+                ranges, image = result
+                if ranges is None:
                     # Плоская гистограмма — изменений не будет
                     messagebox.showinfo("Информация", "Линейная коррекция: нет диапазона яркостей (изображение однородное).")
                     return
-                corrected = (img_array - p_low) * (255.0 / (p_high - p_low))
-                # Доп. гамма-коррекция поверх линейного растяжения, если ползунок не 1.0
-                gamma = float(self.gamma_var.get()) if hasattr(self, 'gamma_var') else 1.0
-                if abs(gamma - 1.0) > 1e-3:
-                    safe_gamma = max(1e-6, gamma)
-                    base = np.clip(corrected, 0.0, 255.0) / 255.0
-                    base = np.maximum(base, 1e-12)
-                    corrected = 255.0 * (base ** (1.0 / safe_gamma))
-                corrected = np.clip(corrected, 0, 255)
-                corrected = np.nan_to_num(corrected, nan=0.0, posinf=255.0, neginf=0.0)
-                self.processed_image = Image.fromarray(corrected.astype('uint8'))
-                self.display_image()
-                try:
-                    self.status_label.configure(text=f"Линейная коррекция: p1={p_low:.1f}, p99={p_high:.1f}, gamma={gamma:.2f}")
-                except Exception:
-                    pass
-            except Exception as e:
-                messagebox.showerror("Ошибка", f"Не удалось применить линейную коррекцию: {str(e)}")
+                self.show_frame(doc, image)
+                stretch = ", ".join("—" if r is None else f"{r[0]:.1f}..{r[1]:.1f}" for r in ranges)
+                self.set_status(f"Линейная коррекция: p1..p99={stretch}, gamma={gamma:.2f}")
+
+            self.run_in_background(compute, done, "Не удалось применить линейную коррекцию",
+                                   operation='edit:linear_correction')
 
     def nonlinear_correction(self):
         # Нелинейная коррекция (гамма-коррекция)
         if self.processed_image and self.processed_image.mode == 'L':  # Только для grayscale
-            try:
-                img_array = np.array(self.processed_image).astype('float32')  # Конвертируем в float
-                # Гамма-коррекция: 255 * (x/255)^(1/гамма)
-                gamma = float(self.gamma_var.get()) if hasattr(self, 'gamma_var') else 1.5
-                safe_gamma = max(1e-6, gamma)
-                base = np.clip(img_array / 255.0, 0.0, 1.0)
-                base = np.maximum(base, 1e-12)
-                corrected = 255.0 * (base ** (1.0 / safe_gamma))
-                corrected = np.clip(corrected, 0.0, 255.0)
-                corrected = np.nan_to_num(corrected, nan=0.0, posinf=255.0, neginf=0.0)
-                # Конвертируем обратно в 8-битное изображение
-                self.processed_image = Image.fromarray(corrected.astype('uint8'))
-                self.display_image()
-            except Exception as e:
-                messagebox.showerror("Ошибка", f"Не удалось применить нелинейную коррекцию: {str(e)}")
+            # Гамма-коррекция: 255 * (x/255)^(1/гамма)
+            gamma = float(self.gamma_var.get()) if hasattr(self, 'gamma_var') else 1.5
+            self.edit_in_background('nonlinear_correction', "Не удалось применить нелинейную коррекцию",
+                                    gamma=gamma)
+
+    def begin_slider_gesture(self, event=None):
+        # Ползунок задает значение своего шага на вершине истории; если сверху другой
+        # шаг, ползунок начинает с 1.0 и добавляет новый шаг поверх результата
+        if self.preview:
+            self.sync_sliders()
+        self.dragging = True
+
+    def end_slider_gesture(self, event=None):
+        # Отпускание ползунка завершает шаг истории: следующее перетаскивание — новый шаг
+        self.slider_gesture += 1
+        self.dragging = False
+        # Последний кадр перетаскивания перерисовывается качественным фильтром
+        if self.processed_image:
+            self.display_image()
+
+    def undo(self):
+        # Отмена последней правки: кадр восстанавливается от ближайшей контрольной точки
+        if self.preview and self.preview.published.can_undo:
+            self.history_in_background(self.preview.undo, "Не удалось отменить изменение")
+
+    def redo(self):
+        if self.preview and self.preview.published.can_redo:
+            self.history_in_background(self.preview.redo, "Не удалось повторить изменение")
+
+    def history_in_background(self, func, error_text):
+        doc = self.preview
+
+        def done(image):
+            self.show_frame(doc, image)
+            self.sync_sliders()
+
+        self.run_in_background(lambda: self.prepare_frame(doc, func()), done, error_text,
+                               operation=func.__name__)
+
+    def sync_sliders(self):
+        # Ползунок показывает значение шага на вершине истории, если это его шаг, иначе 1.0.
+        # Читается снимок, опубликованный потоком обработки: сам журнал он меняет в это время
+        history = self.preview.published
+        for name, var in (('brightness', self.brightness_var), ('saturation', self.saturation_var),
+                          ('contrast', self.contrast_var)):
+            params = history.top(name)
+            var.set(params.get('value', 1.0) if params is not None else 1.0)
 
     def reset_changes(self):
         # Сброс всех изменений к исходному изображению
-        if self.original_image:
-            self.processed_image = self.original_image.copy()  # Восстанавливаем копию оригинала
+        if self.preview:
+            doc = self.preview
             # Сбрасываем слайдеры
             self.brightness_var.set(1.0)
             self.saturation_var.set(1.0)
             self.contrast_var.set(1.0)
-            self.display_image()  # Обновляем отображение
+            self.run_in_background(doc.reset, lambda image: self.show_frame(doc, image),
+                                   "Не удалось сбросить изменения", operation='reset')
 
     def save_image(self):
         # Сохранение обработанного изображения
@@ -477,14 +701,50 @@ class ImageProcessorApp:
             # Диалог выбора места сохранения
             file_path = filedialog.asksaveasfilename(
                 defaultextension=".png",  # Расширение по умолчанию
-                filetypes=[("PNG files", "*.png"), ("JPEG files", "*.jpg"), ("All files", "*.*")]
+                filetypes=[("PNG files", "*.png"), ("JPEG files", "*.jpg"), ("WebP files", "*.webp"),
+                           ("All files", "*.*")]
             )
             if file_path:
-                try:
-                    self.processed_image.save(file_path)  # Сохраняем изображение
+                doc, source_path, exif = self.preview, self.image_path, self.image_info.exif
+
+                def save():
+                    with span('save'):
+                        # Только повороты/отражения JPEG -> JPEG: меняется тег ориентации, без перекодирования
+                        if engine.save_lossless(source_path, doc.steps, file_path):
+                            return
+                        # Иначе повторяем журнал операций на полном разрешении и кодируем
+                        # с настройками формата, сохраняя EXIF исходника
+                        export.save(doc.render_full(), file_path, exif)
+
+                def done(_):
+                    # Время показывается до диалога: показ кадра здесь не замеряется
+                    self.show_latency('save', display=False)
                     messagebox.showinfo("Успех", "Изображение успешно сохранено!")
-                except Exception as e:
-                    messagebox.showerror("Ошибка", f"Не удалось сохранить изображение: {str(e)}")
+
+                self.run_in_background(save, done, "Не удалось сохранить изображение")
+
+    def export_image(self):
+        # Один рендер полного разрешения -> JPEG, WebP и уменьшенные веб-версии (параллельно)
+        if self.processed_image:
+            file_path = filedialog.asksaveasfilename(
+                title="Базовое имя файлов для экспорта",
+                initialfile=os.path.splitext(os.path.basename(self.image_path))[0]
+            )
+            if file_path:
+                doc, exif = self.preview, self.image_info.exif
+                base_path = os.path.splitext(file_path)[0]
+                settings = [export.PRESETS[name] for name in export.PUBLISH_PRESETS]
+
+                def run():
+                    with span('export'):
+                        return export.export(doc.render_full(), base_path, settings, exif)
+
+                def done(paths):
+                    self.show_latency('export', display=False)
+                    names = "\n".join(os.path.basename(path) for path in paths)
+                    messagebox.showinfo("Успех", f"Экспортировано:\n{names}")
+
+                self.run_in_background(run, done, "Не удалось экспортировать изображение")
 
 class VerticalScrolledFrame(ttk.Frame):
     def __init__(self, parent, *args, **kw):
@@ -526,10 +786,69 @@ class VerticalScrolledFrame(ttk.Frame):
                 canvas.itemconfigure(interior_id, width=canvas.winfo_width())
         canvas.bind('<Configure>', _configure_canvas)
 
-def main():
+def main(warm_up=True):
     root = tk.Tk()
     app = ImageProcessorApp(root)
+    if warm_up:
+        # matplotlib и OpenCV подгружаются в фоне, когда окно уже показано
+        startup.schedule_warm_up(root)
     root.mainloop()
 
+def cli_main(argv=None):
+    # Пакетная обработка без GUI: python processor.py batch -r recipe.json -o out/ input_dir
+    import batch  # Пул процессов и полосовая обработка GUI не нужны
+    parser = argparse.ArgumentParser(prog='processor.py batch',
+                                     description='Применить рецепт операций к набору изображений без GUI')
+    parser.add_argument('inputs', nargs='+', help='файлы или папки с изображениями')
+    parser.add_argument('-r', '--recipe', required=True,
+                        help='JSON-файл или JSON-строка, например \'[{"op": "brightness", "value": 1.2}, "grayscale"]\'')
+    parser.add_argument('-o', '--output', required=True, help='папка для результатов')
+    parser.add_argument('--format', default=None, help='расширение результата (по умолчанию как у исходного файла)')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='число процессов (по умолчанию — число ядер)')
+    parser.add_argument('--max-in-flight', type=int, default=None,
+                        help='сколько файлов одновременно отдано процессам (по умолчанию 2 x процессов)')
+    parser.add_argument('--tiled', choices=('auto', 'always', 'never'), default='auto',
+                        help='обработка полосами с ограниченной памятью (auto — для файлов от 100 Мп)')
+    parser.add_argument('--restart', action='store_true',
+                        help='игнорировать журнал и обработать все файлы заново')
+    args = parser.parse_args(argv)
+
+    try:
+        recipe = engine.load_recipe(args.recipe)
+    except (OSError, ValueError) as e:
+        parser.error(f"Не удалось прочитать рецепт: {e}")
+
+    files = []
+    for item in args.inputs:
+        files.extend(engine.list_images(item) if os.path.isdir(item) else [item])
+
+    def progress(stats, path, result):
+        index = stats.done + stats.failed
+        total = stats.total - stats.skipped
+        if isinstance(result, Exception):
+            print(f"[{index}/{total}] Ошибка {path}: {result}", file=sys.stderr)
+        else:
+            print(f"[{index}/{total}] {path} -> {result}  "
+                  f"({stats.images_per_second:.2f} изобр/с, {stats.mb_per_second:.2f} МБ/с)")
+
+    stats = batch.run_batch(files, recipe, args.output, workers=args.workers, max_in_flight=args.max_in_flight,
+                            extension=args.format, resume=not args.restart, on_progress=progress,
+                            tiled=args.tiled)
+    print(stats.summary())
+    return 1 if stats.failed else 0
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        sys.exit(cli_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'bench':
+        import bench  # Замеры нужны только из командной строки
+        sys.exit(bench.main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'serve':
+        import service  # HTTP-сервис без GUI
+        sys.exit(service.main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'video':
+        import video  # Потоковая обработка видео без GUI
+        sys.exit(video.main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'startup':
+        sys.exit(startup.main(sys.argv[2:]))
+    main(warm_up='--no-warmup' not in sys.argv[1:])
\ No newline at end of file
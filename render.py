@@ -0,0 +1,122 @@
+# Фоновый планировщик обработки для GUI.
+# Тяжелая работа выполняется в отдельном потоке, а результаты возвращаются
+# в главный поток Tk через опрос очереди по root.after (~60 Гц), потому что
+# виджеты Tk можно трогать только из главного потока.
+# Задачи выполняются строго по очереди (правки накладываются друг на друга),
+# новые значения ползунка заменяют еще не начатую задачу того же ползунка,
+# а кадр, более старый, чем уже показанный в том же канале, не передается
+# в display_image.
+import collections
+import itertools
+import queue
+import threading
+
+POLL_INTERVAL_MS = 16  # ~60 Гц
+
+
+class RenderJob:
+    def __init__(self, seq, func, on_done, on_error, coalesce, channel):
+        self.seq = seq
+        self.func = func
+        self.on_done = on_done
+        self.on_error = on_error
+        self.coalesce = coalesce  # Ключ слияния: новая задача с тем же ключом заменяет ожидающую
+        self.channel = channel  # Канал результата: кадры старше уже показанного отбрасываются
+        self.cancelled = False
+
+
+class RenderScheduler:
+    def __init__(self, root, on_status=None):
+        self.root = root
+        self.on_status = on_status  # on_status(в работе, в очереди) — вызывается в главном потоке
+        self._lock = threading.Condition()
+        self._pending = collections.deque()
+        self._running = None
+        self._results = queue.Queue()
+        self._seq = itertools.count()
+        self._closed = False
+        self._last_status = None
+        self._delivered = {}  # Канал -> seq последнего показанного кадра
+        self._worker = threading.Thread(target=self._run, name='render-worker', daemon=True)
+        self._worker.start()
+        self.root.after(POLL_INTERVAL_MS, self._poll)
+
+    def submit(self, func, on_done=None, on_error=None, coalesce=None, channel=None):
+        # Поставить задачу в очередь. Если последняя ожидающая задача имеет тот же
+        # ключ coalesce, она отменяется: важно только последнее значение ползунка.
+        with self._lock:
+            if coalesce is not None and self._pending and self._pending[-1].coalesce == coalesce:
+                self._pending.pop().cancelled = True
+            job = RenderJob(next(self._seq), func, on_done, on_error, coalesce, channel)
+            self._pending.append(job)
+            self._lock.notify()
+        return job
+
+    def cancel(self, coalesce):
+        # Отменить все ожидающие задачи с данным ключом
+        with self._lock:
+            for job in self._pending:
+                if job.coalesce == coalesce:
+                    job.cancelled = True
+            self._pending = collections.deque(job for job in self._pending if not job.cancelled)
+
+    def counts(self):
+        with self._lock:
+            return (1 if self._running is not None else 0), len(self._pending)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._pending.clear()
+            self._lock.notify()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._pending and not self._closed:
+                    self._lock.wait()
+                if self._closed:
+                    return
+                job = self._pending.popleft()
+                self._running = job
+            try:
+                result, error = job.func(), None
+            except Exception as e:
+                result, error = None, e
+            with self._lock:
+                self._running = None
+                self._results.put((job, result, error))
+
+    def _poll(self):
+        completed = []
+        while True:
+            try:
+                completed.append(self._results.get_nowait())
+            except queue.Empty:
+                break
+
+        if completed:
+            # Из кадров одного канала, завершившихся за один опрос, показывается последний.
+            # Задачи без канала (загрузка, сброс, сохранение) доставляются всегда
+            latest = {job.channel: job.seq for job, _, error in completed
+                      if job.channel is not None and error is None}
+            for job, result, error in completed:
+                if error is not None:
+                    if job.on_error:
+                        job.on_error(error)
+                    continue
+                if job.channel is not None:
+                    if job.seq < max(latest[job.channel], self._delivered.get(job.channel, -1)):
+                        continue  # Кадр устарел: уже показан или показывается более свежий
+                    self._delivered[job.channel] = job.seq
+                if job.on_done:
+                    job.on_done(result)
+
+        status = self.counts()
+        if status != self._last_status:
+            self._last_status = status
+            if self.on_status:
+                self.on_status(*status)
+
+        if not self._closed:
+            self.root.after(POLL_INTERVAL_MS, self._poll)
@@ -0,0 +1,477 @@
+# Локальный HTTP-сервис обработки: те же операции и рецепты, что у GUI и batch,
+# для других внутренних инструментов. Только stdlib, слушает 127.0.0.1.
+#   POST /process?recipe=[...]&format=png&quality=90  (тело — файл изображения)
+#        -> закодированный результат; X-Source-Cache: hit|miss, X-Processing-Ms
+#   GET  /stats       -> счетчики пропускной способности и задержек (JSON)
+#   GET  /operations  -> список операций рецепта
+#   GET  /health      -> ok
+# Работа идет в процессах: каждый процесс — отдельная "полоса" с одним
+# воркером, а запросы с одинаковым изображением всегда попадают в одну полосу,
+# где декодированный исходник уже лежит в LRU-кэше (по SHA-1 файла).
+# Очередь ограничена (переполнение — 503), а мелкие запросы, накопившиеся
+# за время работы воркера, отправляются ему одной пачкой.
+#   python processor.py serve --port 8765 -j 4
+import argparse
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import json
+import os
+import queue
+import threading
+import time
+from urllib.parse import urlsplit, parse_qs, urlencode
+import urllib.error
+import urllib.request
+import engine
+import export
+from history import image_bytes
+from instrument import percentile
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+MAX_QUEUE = 64  # Принятых, но не выполненных запросов; больше — 503
+MAX_BODY_BYTES = 256 * 1024 * 1024
+REQUEST_TIMEOUT = 120.0  # Секунд на ответ воркера
+# Пачки: мелкие запросы (до SMALL_REQUEST_BYTES), скопившиеся в очереди полосы, уходят воркеру вместе
+SMALL_REQUEST_BYTES = 512 * 1024
+BATCH_MAX = 8
+LANE_DEPTH = 2  # Пачек, отданных процессу полосы одновременно: пока одна считается, другая уже передана
+SOURCE_CACHE_BYTES = 256 * 1024 * 1024  # Декодированные исходники в каждом процессе
+STATS_WINDOW = 1000  # Последних запросов для p50/p95
+THROUGHPUT_WINDOW = 60.0  # Секунд для текущей пропускной способности
+
+CONTENT_TYPES = {'jpeg': 'image/jpeg', 'png': 'image/png', 'webp': 'image/webp'}
+SOURCE_FORMATS = {'JPEG': 'jpeg', 'PNG': 'png', 'WEBP': 'webp'}
+
+
+_STOP = object()  # Сигнал потоку полосы завершиться
+
+
+class QueueFull(Exception):
+    pass
+
+
+class BadRequest(ValueError):
+    pass
+
+
+# --- Дочерний процесс
+
+_sources = OrderedDict()  # SHA-1 файла -> (изображение без поворота, шаги ориентации)
+_sources_bytes = 0
+
+
+def _decoded(digest, data, cache_bytes):
+    # Декодированный исходник из кэша процесса или из data; (изображение, шаги, попадание)
+    global _sources_bytes
+    entry = _sources.get(digest)
+    if entry is not None:
+        _sources.move_to_end(digest)
+        return entry + (True,)
+    image, lead = engine.open_oriented(io.BytesIO(data))
+    image.load()
+    _sources[digest] = (image, lead)
+    _sources_bytes += image_bytes(image)
+    while _sources_bytes > cache_bytes and len(_sources) > 1:
+        _, (old, _) = _sources.popitem(last=False)
+        _sources_bytes -= image_bytes(old)
+    return image, lead, False
+
+
+def _settings(format, quality, source_format):
+    # Без format — формат исходника (если его можно закодировать), иначе PNG
+    format = format or SOURCE_FORMATS.get(source_format, 'png')
+    preset = export.PRESETS[format]
+    if quality is None:
+        return preset
+    return export.ExportSettings(format, quality=quality, optimize=preset.optimize,
+                                 compress_level=preset.compress_level)
+
+
+def _run_job(digest, data, recipe, format, quality, cache_bytes):
+    start = time.perf_counter()
+    image, lead, hit = _decoded(digest, data, cache_bytes)
+    settings = _settings(format, quality, image.format)
+    result = engine.apply_recipe(image, lead + recipe)
+    body = export.encode(result, settings)
+    return body, settings.format, hit, (time.perf_counter() - start) * 1000
+
+
+def _run_batch(jobs, cache_bytes):
+    # Выполняется в дочернем процессе: ошибка одного запроса не роняет остальные
+    results = []
+    for job in jobs:
+        try:
+            results.append(('ok', _run_job(*job, cache_bytes)))
+        except (ValueError, TypeError, OSError) as e:
+            results.append(('bad', f"{type(e).__name__}: {e}"))  # Битый файл или параметры
+        except Exception as e:
+            results.append(('error', f"{type(e).__name__}: {e}"))
+    return results
+
+
+# --- Процесс сервера
+
+class Job:
+    __slots__ = ('digest', 'data', 'recipe', 'format', 'quality', 'future')
+
+    def __init__(self, digest, data, recipe, format, quality):
+        self.digest = digest
+        self.data = data
+        self.recipe = recipe
+        self.format = format
+        self.quality = quality
+        self.future = Future()
+
+    @property
+    def small(self):
+        return len(self.data) <= SMALL_REQUEST_BYTES
+
+    def args(self):
+        return self.digest, self.data, self.recipe, self.format, self.quality
+
+
+class Lane:
+    # Один процесс-воркер со своим кэшем исходников и очередью запросов
+
+    def __init__(self, index, stats, cache_bytes):
+        self.index = index
+        self.stats = stats
+        self.cache_bytes = cache_bytes
+        self.queue = queue.Queue()
+        self._slots = threading.Semaphore(LANE_DEPTH)
+        self._pool = ProcessPoolExecutor(max_workers=1)
+        self._pool_lock = threading.Lock()
+        self._held = None  # Запрос, вынутый из очереди, но не вошедший в пачку
+        self._thread = threading.Thread(target=self._dispatch, name=f'service-lane-{index}', daemon=True)
+
+    def start(self):
+        # Процесс создается сразу, а не при первом запросе: первый клиент не ждет его запуска
+        self._pool.submit(os.getpid).result()
+        self._thread.start()
+
+    def _dispatch(self):
+        while True:
+            job = self._held if self._held is not None else self.queue.get()
+            self._held = None
+            if job is _STOP:
+                return
+            batch = [job]
+            self._gather(batch)
+            # Пока воркер занят, в очереди копятся попутчики: свободный воркер
+            # получает запрос сразу, без ожидания пачки
+            self._slots.acquire()
+            self._gather(batch)
+            self.stats.batch(len(batch))
+            pool = self._pool
+            try:
+                future = pool.submit(_run_batch, [job.args() for job in batch], self.cache_bytes)
+            except BrokenProcessPool as e:
+                self._finish(batch, e, pool)
+                continue
+            future.add_done_callback(lambda done, batch=batch, pool=pool: self._finish(batch, done, pool))
+
+    def _gather(self, batch):
+        # Добрать в пачку мелкие запросы, которые уже ждут в очереди
+        while batch[0].small and len(batch) < BATCH_MAX and self._held is None:
+            try:
+                extra = self.queue.get_nowait()
+            except queue.Empty:
+                return
+            if extra is _STOP or not extra.small:
+                self._held = extra  # Крупный запрос — отдельной задачей, следующим
+                return
+            batch.append(extra)
+
+    def _finish(self, batch, done, pool):
+        self._slots.release()
+        if isinstance(done, Exception):
+            error = done
+        else:
+            error = done.exception()
+        if error is not None:
+            if isinstance(error, BrokenProcessPool):
+                self._restart(pool)  # Процесс упал (например, нехватка памяти): следующие запросы — в новый
+            for job in batch:
+                job.future.set_exception(error)
+            return
+        for job, (status, payload) in zip(batch, done.result()):
+            if status == 'ok':
+                job.future.set_result(payload)
+            elif status == 'bad':
+                job.future.set_exception(BadRequest(payload))
+            else:
+                job.future.set_exception(RuntimeError(payload))
+
+    def _restart(self, pool):
+        # Об одном упавшем процессе сообщают все его незавершенные пачки: пересоздается он один раз
+        with self._pool_lock:
+            if self._pool is not pool:
+                return
+            self._pool = ProcessPoolExecutor(max_workers=1)
+        pool.shutdown(wait=False)
+
+    def close(self):
+        self.queue.put(_STOP)
+        self._thread.join()
+        self._pool.shutdown()
+
+
+class ServiceStats:
+    # Счетчики сервиса; все методы потокобезопасны
+
+    def __init__(self):
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._counts = {'requests': 0, 'completed': 0, 'failed': 0, 'rejected': 0,
+                        'cache_hits': 0, 'cache_misses': 0, 'batches': 0, 'batched_requests': 0,
+                        'bytes_in': 0, 'bytes_out': 0}
+        self._latency = deque(maxlen=STATS_WINDOW)  # Полное время запроса, мс
+        self._worker = deque(maxlen=STATS_WINDOW)  # Время в воркере, мс
+        self._finished = deque()  # Моменты завершения за THROUGHPUT_WINDOW
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                self._counts[name] += value
+
+    def batch(self, size):
+        self.add(batches=1, batched_requests=size)
+
+    def completed(self, latency_ms, worker_ms, hit, bytes_out):
+        now = time.time()
+        with self._lock:
+            self._counts['completed'] += 1
+            self._counts['cache_hits' if hit else 'cache_misses'] += 1
+            self._counts['bytes_out'] += bytes_out
+            self._latency.append(latency_ms)
+            self._worker.append(worker_ms)
+            self._finished.append(now)
+
+    def snapshot(self, queued=0):
+        now = time.time()
+        with self._lock:
+            while self._finished and self._finished[0] < now - THROUGHPUT_WINDOW:
+                self._finished.popleft()
+            result = dict(self._counts)
+            latency, worker, recent = list(self._latency), list(self._worker), len(self._finished)
+        uptime = now - self.started
+        result.update({
+            'uptime_s': uptime,
+            'queued': queued,
+            'requests_per_s': result['completed'] / uptime if uptime else 0.0,
+            'recent_requests_per_s': recent / min(uptime, THROUGHPUT_WINDOW) if uptime else 0.0,
+            'mean_batch': result['batched_requests'] / result['batches'] if result['batches'] else 0.0,
+            'latency_ms': {'p50': percentile(latency, 50), 'p95': percentile(latency, 95)},
+            'worker_ms': {'p50': percentile(worker, 50), 'p95': percentile(worker, 95)},
+        })
+        return result
+
+
+class ProcessingService:
+    # Очередь с ограничением + полосы-процессы. submit -> Future с (байты, формат, попадание, мс)
+
+    def __init__(self, workers=None, max_queue=MAX_QUEUE, cache_bytes=SOURCE_CACHE_BYTES):
+        self.stats = ServiceStats()
+        self._slots = threading.BoundedSemaphore(max_queue)
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._lanes = [Lane(index, self.stats, cache_bytes) for index in range(workers or os.cpu_count() or 1)]
+        for lane in self._lanes:
+            lane.start()
+
+    @property
+    def workers(self):
+        return len(self._lanes)
+
+    @property
+    def queued(self):
+        with self._lock:
+            return self._pending
+
+    def submit(self, data, recipe, format=None, quality=None):
+        recipe = engine.normalize_recipe(recipe)
+        if format is not None and format not in export.FORMATS:
+            raise BadRequest(f"Неизвестный формат: {format}")
+        if not self._slots.acquire(blocking=False):
+            self.stats.add(rejected=1)
+            raise QueueFull("Очередь заполнена")
+        with self._lock:
+            self._pending += 1
+        digest = hashlib.sha1(data).hexdigest()
+        job = Job(digest, data, recipe, format, quality)
+        job.future.add_done_callback(self._release)
+        # Один и тот же файл — всегда в одну полосу, где его декодированная копия уже в кэше
+        self._lanes[int(digest[:8], 16) % len(self._lanes)].queue.put(job)
+        return job.future
+
+    def _release(self, future):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def close(self):
+        for lane in self._lanes:
+            lane.close()
+
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = 'ImageProcessor'
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, body, content_type='application/json; charset=utf-8', headers=()):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, status, value, headers=()):
+        self._send(status, json.dumps(value, ensure_ascii=False).encode('utf-8'), headers=headers)
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == '/health':
+            self._send(200, b'ok', 'text/plain')
+        elif path == '/stats':
+            self._json(200, self.service.stats.snapshot(self.service.queued))
+        elif path == '/operations':
+            self._json(200, sorted(engine.OPERATIONS))
+        else:
+            self._json(404, {'error': f"Нет такого адреса: {path}"})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != '/process':
+            self.close_connection = True  # Тело не прочитано
+            return self._json(404, {'error': f"Нет такого адреса: {url.path}"})
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True
+            return self._json(400, {'error': "Неверный заголовок Content-Length"})
+        if length > MAX_BODY_BYTES:
+            self.close_connection = True
+            return self._json(413, {'error': f"Файл больше {MAX_BODY_BYTES} байт"})
+        data = self.rfile.read(length)
+        start = time.perf_counter()
+        stats = self.service.stats
+        stats.add(requests=1, bytes_in=len(data))
+        try:
+            query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            if not data:
+                raise BadRequest("Пустое тело запроса: нужен файл изображения")
+            recipe = json.loads(query.get('recipe') or self.headers.get('X-Recipe') or '[]')
+            if not isinstance(recipe, list):
+                raise BadRequest("Рецепт должен быть JSON-списком операций")
+            quality = int(query['quality']) if 'quality' in query else None
+            future = self.service.submit(data, recipe, query.get('format'), quality)
+            body, format, hit, worker_ms = future.result(REQUEST_TIMEOUT)
+        except QueueFull as e:
+            return self._json(503, {'error': str(e)}, headers=[('Retry-After', '1')])
+        except ValueError as e:  # BadRequest, неверный JSON, неизвестная операция
+            stats.add(failed=1)
+            return self._json(400, {'error': str(e)})
+        except FutureTimeout:
+            stats.add(failed=1)
+            return self._json(504, {'error': "Истекло время обработки"})
+        except Exception as e:
+            stats.add(failed=1)
+            return self._json(500, {'error': f"{type(e).__name__}: {e}"})
+        latency = (time.perf_counter() - start) * 1000
+        stats.completed(latency, worker_ms, hit, len(body))
+        self._send(200, body, CONTENT_TYPES[format], headers=[
+            ('X-Source-Cache', 'hit' if hit else 'miss'),
+            ('X-Processing-Ms', f'{worker_ms:.1f}'),
+        ])
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # Очередь соединений; по умолчанию 5 — мало для пачки параллельных клиентов
+
+    def __init__(self, address, service, verbose=False):
+        self.service = service
+        self.verbose = verbose
+        super().__init__(address, Handler)
+
+
+def start_server(port=0, host=DEFAULT_HOST, workers=None, max_queue=MAX_QUEUE, verbose=False):
+    # Сервер в фоновом потоке (port=0 — любой свободный порт); для встраивания и проверки
+    service = ProcessingService(workers, max_queue)
+    server = Server((host, port), service, verbose)
+    thread = threading.Thread(target=server.serve_forever, name='service-http', daemon=True)
+    thread.start()
+    return server
+
+
+def stop_server(server):
+    server.shutdown()
+    server.server_close()
+    server.service.close()
+
+
+class ServiceClient:
+    # Клиент без внешних зависимостей: ServiceClient('http://127.0.0.1:8765').process(data, recipe)
+
+    def __init__(self, url, timeout=REQUEST_TIMEOUT):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def process(self, data, recipe=(), format=None, quality=None):
+        # (байты результата, заголовки ответа); ошибка сервиса — RuntimeError с его сообщением
+        query = {'recipe': json.dumps(list(recipe))}
+        if format:
+            query['format'] = format
+        if quality is not None:
+            query['quality'] = quality
+        request = urllib.request.Request(f"{self.url}/process?{urlencode(query)}", data=data, method='POST',
+                                         headers={'Content-Type': 'application/octet-stream'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.read(), dict(response.headers)
+        except urllib.error.HTTPError as e:
+            raise RuntimeError(f"{e.code}: {json.loads(e.read() or b'{}').get('error', e.reason)}") from None
+
+    def stats(self):
+        with urllib.request.urlopen(f"{self.url}/stats", timeout=self.timeout) as response:
+            return json.load(response)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='processor.py serve',
+                                     description='Локальный HTTP-сервис обработки изображений')
+    parser.add_argument('--host', default=DEFAULT_HOST, help='адрес (по умолчанию только локальный)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('-j', '--workers', type=int, default=None, help='число процессов (по умолчанию — число ядер)')
+    parser.add_argument('--max-queue', type=int, default=MAX_QUEUE, help='предел принятых запросов')
+    parser.add_argument('-v', '--verbose', action='store_true', help='журнал запросов')
+    args = parser.parse_args(argv)
+
+    service = ProcessingService(args.workers, args.max_queue)
+    server = Server((args.host, args.port), service, args.verbose)
+    print(f"Сервис слушает http://{args.host}:{server.server_port} (процессов: {service.workers})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
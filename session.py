@@ -0,0 +1,143 @@
+# Просмотр папки: переход к следующему/предыдущему файлу без ожидания.
+# Соседи текущего файла декодируются заранее в фоновых потоках и держатся
+# в LRU, ограниченном суммарным объемом декодированных данных, а не числом файлов.
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import engine
+from history import image_bytes
+from preview import PreviewDocument, build_pyramid, PROXY_MAX_SIZE
+
+# Сколько файлов вперед и назад декодировать заранее
+PREFETCH_DISTANCE = 2
+PREFETCH_WORKERS = 2
+SESSION_BUDGET_BYTES = 384 * 1024 * 1024
+
+
+class Decoded:
+    # Сведения о файле и пирамида прокси; из нее создается документ для правок
+
+    def __init__(self, info, pyramid, cached=False):
+        self.info = info
+        self.pyramid = pyramid
+        self.cached = cached  # Прочитан из дискового кэша
+        self.nbytes = sum(image_bytes(level) for level in pyramid)
+
+    def document(self):
+        # Новый документ без правок; уровни пирамиды общие, поэтому это дешево
+        # Полное разрешение загружается без поворота: EXIF-ориентация
+        # сворачивается с поворотами пользователя в один transpose при сохранении.
+        # info.orientation и open_oriented решают, что уже повернуто, одинаково (pending_orientation)
+        path = self.info.path
+        return PreviewDocument(self.pyramid[0], load_full=lambda: engine.open_oriented(path)[0],
+                               size=self.info.oriented_size, pyramid=self.pyramid,
+                               full_lead=engine.orientation_steps(self.info.orientation))
+
+
+def load_decoded(path, preview_cache=None):
+    # Известный файл берется из дискового кэша без декодирования,
+    # иначе один проход по файлу: заголовок + декодирование в размере прокси (JPEG)
+    cached = preview_cache.get(path) if preview_cache is not None else None
+    info, image = cached or engine.open_preview(path, PROXY_MAX_SIZE)
+    return Decoded(info, build_pyramid(image), cached is not None)
+
+
+class FolderSession:
+    # Список изображений папки, текущая позиция и кэш декодированных соседей.
+    # prepare(decoded) выполняется в фоновом потоке после декодирования
+    # (например, уменьшенная копия для панели предпросмотра).
+
+    def __init__(self, folder, preview_cache=None, prepare=None, distance=PREFETCH_DISTANCE,
+                 workers=PREFETCH_WORKERS, budget_bytes=SESSION_BUDGET_BYTES):
+        self.folder = folder
+        self.files = engine.list_images(folder)
+        self.index = 0
+        self.preview_cache = preview_cache
+        self.prepare = prepare
+        self.distance = distance
+        self.budget = budget_bytes
+        self.used = 0
+        self._decoded = OrderedDict()  # Путь -> Decoded, от давно использованных к недавним
+        self._pending = {}  # Путь -> Future фоновой загрузки
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+
+    def __len__(self):
+        return len(self.files)
+
+    @property
+    def path(self):
+        return self.files[self.index] if self.files else None
+
+    def clamp(self, index):
+        return max(0, min(index, len(self.files) - 1))
+
+    def load(self, index):
+        # Декодированный файл с номером index (блокирует, пока он не будет готов),
+        # после чего заранее загружаются его соседи
+        self.index = self.clamp(index)
+        path = self.files[self.index]
+        with self._lock:
+            decoded = self._decoded.get(path)
+            if decoded is not None:
+                self._decoded.move_to_end(path)
+            future = self._pending.get(path)
+        if decoded is None:
+            decoded = future.result() if future is not None else self._decode(path)
+        self.prefetch(self.index)
+        return decoded
+
+    def prefetch(self, index):
+        # Сначала ближайшие соседи, чередуя направления: index+1, index-1, index+2, ...
+        for offset in range(1, self.distance + 1):
+            for neighbour in (index + offset, index - offset):
+                if 0 <= neighbour < len(self.files):
+                    self._submit(self.files[neighbour])
+
+    def _submit(self, path):
+        with self._lock:
+            if path in self._decoded or path in self._pending:
+                return
+            try:
+                self._pending[path] = self._executor.submit(self._decode, path)
+            except RuntimeError:
+                pass  # Сессия уже закрыта
+
+    def _decode(self, path):
+        try:
+            decoded = load_decoded(path, self.preview_cache)
+            if self.prepare is not None:
+                self.prepare(decoded)
+            self._store(path, decoded)
+        finally:
+            with self._lock:
+                self._pending.pop(path, None)
+        if self.preview_cache is not None and not decoded.cached:
+            # Запись в дисковый кэш не задерживает показ
+            try:
+                self._executor.submit(self.preview_cache.put, path, decoded.info, decoded.pyramid[0])
+            except RuntimeError:
+                pass
+        return decoded
+
+    def _store(self, path, decoded):
+        with self._lock:
+            old = self._decoded.pop(path, None)
+            if old is not None:
+                self.used -= old.nbytes
+            self._decoded[path] = decoded
+            self.used += decoded.nbytes
+            # Вытесняем давно не открывавшиеся файлы; текущий остается всегда
+            current = self.path
+            for victim in list(self._decoded):
+                if self.used <= self.budget:
+                    break
+                if victim in (path, current):
+                    continue
+                self.used -= self._decoded.pop(victim).nbytes
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            self._decoded.clear()
+            self.used = 0
@@ -0,0 +1,158 @@
+# Запуск GUI: фоновый прогрев тяжелых подсистем и замер времени старта.
+# matplotlib и OpenCV импортируются при первом использовании. Чтобы первое
+# открытие гистограммы не ждало импорта, после появления окна они
+# подгружаются в фоновом потоке (отключается флагом --no-warmup).
+# Режим замера запускает GUI в отдельном интерпретаторе с -X importtime и
+# печатает время до появления окна и стоимость импорта модулей:
+#   python processor.py startup --repeat 3 -o startup.json
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+# Прогрев начинается, когда окно уже отрисовано и отвечает
+WARM_UP_DELAY_MS = 500
+DEFAULT_REPEAT = 3
+DEFAULT_TOP = 12
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Запуск окна так же, как processor.main, но без mainloop; отметки времени — в stdout
+PROBE = '''
+import json, time
+import processor
+print(json.dumps({'imported': time.time()}), flush=True)
+root = processor.tk.Tk()
+app = processor.ImageProcessorApp(root)
+root.update()
+print(json.dumps({'window': time.time()}), flush=True)
+root.destroy()
+'''
+
+
+def warm_up():
+    # Импорт необязательных подсистем заранее; ошибки не мешают работе —
+    # тогда модуль просто загрузится (или сообщит об ошибке) при первом использовании
+    import histogram
+    import kernels
+    for load in (histogram.matplotlib_classes, kernels.cv2_module):
+        try:
+            load()
+        except Exception:
+            pass
+
+
+def schedule_warm_up(root, delay_ms=WARM_UP_DELAY_MS):
+    # Отдельный поток, а не RenderScheduler: первая правка не должна ждать импорта
+    root.after(delay_ms, lambda: threading.Thread(target=warm_up, name='warm-up', daemon=True).start())
+
+
+def parse_importtime(text):
+    # Строки -X importtime -> [(модуль, собственное время мкс, суммарное мкс, глубина)]
+    modules = []
+    for line in text.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # Заголовок таблицы
+        field = parts[2].rstrip()
+        name = field.lstrip()
+        depth = (len(field) - len(name) - 1) // 2
+        modules.append((name, int(parts[0]), int(parts[1]), depth))
+    return modules
+
+
+def import_costs(modules, root='processor'):
+    # ({пакет: собственное время всех его модулей, мс}, {прямой импорт root: суммарное время, мс})
+    packages = {}
+    direct = {}
+    children = {}
+    for name, own, cumulative, depth in modules:
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0.0) + own / 1000
+        # Вложенные импорты печатаются раньше родителя
+        if depth == 1:
+            children[name] = cumulative / 1000
+        elif depth == 0:
+            if name == root:
+                direct = children
+            children = {}
+    return packages, direct
+
+
+def probe():
+    # Один запуск в новом интерпретаторе: время от старта процесса (мс) и импорты
+    start = time.time()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', PROBE],
+                            cwd=APP_DIR, capture_output=True, text=True)
+    end = time.time()
+    packages, direct = import_costs(parse_importtime(result.stderr))
+    run = {'process_ms': (end - start) * 1000, 'packages': packages, 'modules': direct}
+    for line in result.stdout.splitlines():
+        for mark, moment in json.loads(line).items():
+            run[f'{mark}_ms'] = (moment - start) * 1000
+    if 'window_ms' not in run:
+        # Например, нет дисплея: импорты все равно замерены
+        errors = [line for line in result.stderr.splitlines() if not line.startswith('import time:')]
+        run['error'] = errors[-1] if errors else f"код возврата {result.returncode}"
+    return run
+
+
+def _median(runs, key):
+    values = [run[key] for run in runs if key in run]
+    return statistics.median(values) if values else None
+
+
+def _median_costs(runs, key):
+    names = {name for run in runs for name in run[key]}
+    return {name: statistics.median(run[key].get(name, 0.0) for run in runs) for name in names}
+
+
+def summarize(runs):
+    return {
+        'repeat': len(runs),
+        'python': sys.version.split()[0],
+        'imported_ms': _median(runs, 'imported_ms'),
+        'window_ms': _median(runs, 'window_ms'),
+        'process_ms': _median(runs, 'process_ms'),
+        'packages': _median_costs(runs, 'packages'),
+        'modules': _median_costs(runs, 'modules'),
+        'errors': sorted({run['error'] for run in runs if 'error' in run}),
+    }
+
+
+def _table(title, costs, top):
+    lines = [title]
+    for name, ms in sorted(costs.items(), key=lambda item: item[1], reverse=True)[:top]:
+        lines.append(f"  {name:<28}{ms:>9.1f} мс")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='processor.py startup',
+                                     description='Время запуска GUI и стоимость импорта модулей')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='число запусков (медиана)')
+    parser.add_argument('--top', type=int, default=DEFAULT_TOP, help='сколько самых дорогих модулей показать')
+    parser.add_argument('-o', '--output', default=None, help='файл для результатов (JSON)')
+    args = parser.parse_args(argv)
+
+    report = summarize([probe() for _ in range(max(1, args.repeat))])
+
+    def ms(value):
+        return f"{value:.0f} мс" if value is not None else "—"
+
+    print(f"Импорт приложения: {ms(report['imported_ms'])}, окно: {ms(report['window_ms'])}, "
+          f"процесс целиком: {ms(report['process_ms'])} (медиана из {report['repeat']})")
+    for error in report['errors']:
+        print(f"Окно не открылось: {error}", file=sys.stderr)
+    print(_table("Модули приложения (вместе с зависимостями):", report['modules'], args.top))
+    print(_table("Пакеты (собственное время импорта):", report['packages'], args.top))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 1 if report['window_ms'] is None else 0
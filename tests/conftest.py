@@ -0,0 +1,6 @@
+# Модули приложения лежат в корне репозитория, а не в пакете: добавляем корень в sys.path,
+# чтобы тесты запускались и просто "pytest" из любого каталога
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
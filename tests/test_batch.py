@@ -0,0 +1,48 @@
+# Пакетная обработка: журнал выполненных файлов и совпадающие имена результатов
+import os
+import shutil
+import tempfile
+import unittest
+from PIL import Image
+import batch
+
+
+class RunBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='batch-test-')
+        self.output = os.path.join(self.dir, 'out')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def image(self, folder, name, color='red'):
+        os.makedirs(os.path.join(self.dir, folder), exist_ok=True)
+        path = os.path.join(self.dir, folder, name)
+        Image.new('RGB', (30, 20), color).save(path)
+        return path
+
+    def test_same_name_from_two_folders_fails_instead_of_overwriting(self):
+        first, second = self.image('a', 'x.png', 'red'), self.image('b', 'x.png', 'blue')
+        errors = {}
+
+        def progress(stats, path, result):
+            if isinstance(result, Exception):
+                errors[path] = result
+
+        stats = batch.run_batch([first, second], [], self.output, workers=1, on_progress=progress)
+        self.assertEqual((stats.done, stats.failed), (1, 1))
+        self.assertIsInstance(errors[second], batch.OutputCollision)
+        self.assertEqual(Image.open(os.path.join(self.output, 'x.png')).getpixel((0, 0)), (255, 0, 0))
+
+    def test_resume_depends_on_format_and_existing_output(self):
+        path = self.image('a', 'x.png')
+        self.assertEqual(batch.run_batch([path], [], self.output, workers=1).done, 1)
+        self.assertEqual(batch.run_batch([path], [], self.output, workers=1).skipped, 1)
+        self.assertEqual(batch.run_batch([path], [], self.output, workers=1, extension='jpg').done, 1)
+        os.remove(os.path.join(self.output, 'x.jpg'))
+        self.assertEqual(batch.run_batch([path], [], self.output, workers=1, extension='jpg').done, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
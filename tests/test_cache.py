@@ -0,0 +1,122 @@
+# Дисковый кэш предпросмотра (cache.PreviewCache) и LRU декодированных файлов папки (session.FolderSession)
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from PIL import Image
+import engine
+import cache
+import session
+import tone
+
+MAKE_TAG = 0x010F
+
+
+def save_jpeg(path, width=64, height=48, orientation=6, seed=0):
+    rng = np.random.default_rng(seed)
+    exif = Image.Exif()
+    exif[engine.ORIENTATION_TAG] = orientation
+    exif[MAKE_TAG] = 'Camera'
+    Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8)).save(path, exif=exif)
+    return path
+
+
+class PreviewCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='cache-test-')
+        self.cache = cache.PreviewCache(os.path.join(self.dir, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def entries(self):
+        return sorted(os.listdir(self.cache.directory))
+
+    def test_round_trip(self):
+        path = save_jpeg(os.path.join(self.dir, 'a.jpg'))
+        self.assertIsNone(self.cache.get(path))
+        info, proxy = engine.open_preview(path, (1600, 1600))
+        self.cache.put(path, info, proxy)
+
+        cached_info, cached = self.cache.get(path)
+        self.assertTrue(np.array_equal(np.asarray(cached), np.asarray(proxy)))
+        self.assertEqual(cached.mode, proxy.mode)
+        for name in ('path', 'file_size', 'format', 'size', 'mode', 'orientation', 'oriented_size'):
+            self.assertEqual(getattr(cached_info, name), getattr(info, name), name)
+        self.assertEqual(cached_info.orientation, 6)
+        self.assertEqual(dict(cached_info.exif), dict(info.exif))
+        self.assertEqual(cached_info.exif[MAKE_TAG], 'Camera')
+        # Гистограммы прокси прочитаны с диска и уже лежат в кэше tone
+        expected = tone.channel_histograms(proxy)
+        self.assertTrue(np.array_equal(tone.image_stats(cached).channels, expected))
+
+    def test_changed_file_misses(self):
+        path = save_jpeg(os.path.join(self.dir, 'a.jpg'))
+        self.cache.put(path, *engine.open_preview(path, (1600, 1600)))
+        save_jpeg(path, width=80, seed=1)
+        self.assertIsNone(self.cache.get(path))
+
+    def test_corrupt_entry_is_removed(self):
+        path = save_jpeg(os.path.join(self.dir, 'a.jpg'))
+        self.cache.put(path, *engine.open_preview(path, (1600, 1600)))
+        [name] = self.entries()
+        with open(os.path.join(self.cache.directory, name), 'wb') as f:
+            f.write(b'garbage')
+        self.assertIsNone(self.cache.get(path))
+        self.assertEqual(self.entries(), [])
+
+    def test_eviction_keeps_recently_used(self):
+        paths = [save_jpeg(os.path.join(self.dir, f'{i}.jpg'), seed=i) for i in range(3)]
+        for path in paths:
+            self.cache.put(path, *engine.open_preview(path, (1600, 1600)))
+        entries = [self.cache._entry_path(cache.cache_key(path)) for path in paths]
+        for i, entry in enumerate(entries):
+            os.utime(entry, (1_000_000 + i, 1_000_000 + i))
+        self.assertIsNotNone(self.cache.get(paths[0]))  # Чтение обновляет время использования
+        self.cache.max_bytes = sum(os.path.getsize(entry) for entry in entries[1:])
+        self.cache.evict()
+        self.assertEqual([os.path.exists(entry) for entry in entries], [True, False, True])
+
+
+class FolderSessionTest(unittest.TestCase):
+    # Без упреждающей загрузки (distance=0), чтобы набор декодированных файлов был предсказуем
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='session-test-')
+        for i in range(4):
+            save_jpeg(os.path.join(self.dir, f'{i}.jpg'), seed=i)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_byte_budget_evicts_least_recently_used(self):
+        probe = session.FolderSession(self.dir, distance=0)
+        size = probe.load(0).nbytes
+        probe.close()
+        folder = session.FolderSession(self.dir, distance=0, budget_bytes=2 * size)
+        try:
+            folder.load(0)
+            folder.load(1)
+            folder.load(0)  # 0 снова недавний
+            folder.load(2)
+            self.assertEqual(list(folder._decoded), [folder.files[0], folder.files[2]])
+            self.assertEqual(folder.used, 2 * size)
+        finally:
+            folder.close()
+
+    def test_current_file_is_kept_over_budget(self):
+        folder = session.FolderSession(self.dir, distance=0, budget_bytes=1)
+        try:
+            decoded = folder.load(1)
+            self.assertEqual(list(folder._decoded), [folder.files[1]])
+            self.assertEqual(folder.used, decoded.nbytes)
+            folder.load(3)
+            self.assertEqual(list(folder._decoded), [folder.files[3]])
+        finally:
+            folder.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+# Журнал правок и кэш контрольных точек
+import unittest
+import numpy as np
+from PIL import Image
+import engine
+from history import CheckpointCache, EditHistory, image_bytes
+
+
+def noise(width=120, height=90, mode='RGB'):
+    rng = np.random.default_rng(0)
+    shape = (height, width) if mode == 'L' else (height, width, len(mode))
+    return Image.fromarray(rng.integers(0, 256, shape, dtype=np.uint8), mode)
+
+
+class CheckpointReplayTest(unittest.TestCase):
+    # Кадр из контрольных точек должен побитно совпадать с повтором рецепта с нуля,
+    # хотя повтор сворачивает соседние тоновые шаги в одну LUT
+
+    RECIPES = [
+        [('brightness', {'value': 1.3}), ('rotate', {'angle': 90}), ('contrast', {'value': 1.4, 'mean': 110.0})],
+        [('contrast', {'value': 0.7, 'mean': 100.0}), ('brightness', {'value': 1.2}), ('grayscale', {}),
+         ('flip', {'direction': 'horizontal'}), ('brightness', {'value': 0.8}),
+         ('linear_correction', {'gamma': 1.3, 'ranges': [(20, 230)]}), ('rotate', {'angle': 30}),
+         ('nonlinear_correction', {'gamma': 1.4})],
+    ]
+
+    def assertSameAsReplay(self, cache, steps, index):
+        expected = engine.apply_recipe(cache.base, cache.lead + steps[:index])
+        self.assertTrue(np.array_equal(np.asarray(cache.render(steps, index)), np.asarray(expected)), index)
+
+    def test_every_prefix_matches_full_replay(self):
+        for recipe in self.RECIPES:
+            steps = engine.normalize_recipe(recipe)
+            for lead in ([], [('orient', {'orientation': 6})]):
+                cache = CheckpointCache(noise(), 1 << 30, lead)
+                for index in range(len(steps) + 1):
+                    self.assertSameAsReplay(cache, steps, index)
+                # Назад по уже сохраненным точкам и снова вперед
+                for index in reversed(range(len(steps) + 1)):
+                    self.assertSameAsReplay(cache, steps, index)
+
+    def test_boundaries_inside_tone_chain(self):
+        steps = engine.normalize_recipe(self.RECIPES[0])
+        self.assertEqual([engine.is_fusion_boundary(steps, index) for index in range(4)],
+                         [True, False, False, True])
+
+
+class EditHistoryTest(unittest.TestCase):
+
+    def test_undo_redo(self):
+        history = EditHistory()
+        self.assertEqual(history.push('brightness', {'value': 1.2}), 0)
+        self.assertEqual(history.push('contrast', {'value': 1.5}), 1)
+        self.assertEqual(history.undo(), None)  # Прежнее состояние — начало нового
+        self.assertEqual((history.steps, history.can_undo, history.can_redo),
+                         ([('brightness', {'value': 1.2})], True, True))
+        self.assertEqual(history.redo(), None)
+        self.assertEqual(history.position, 2)
+        self.assertEqual((history.redo(), history.position), (None, 2))
+        history.undo()
+        history.undo()
+        self.assertEqual((history.steps, history.can_undo), ([], False))
+        self.assertEqual(history.undo(), None)
+
+    def test_push_after_undo_truncates_branch(self):
+        history = EditHistory()
+        history.push('brightness', {'value': 1.2})
+        history.push('contrast', {'value': 1.5})
+        history.undo()
+        self.assertEqual(history.push('flip', {'direction': 'vertical'}), 1)
+        self.assertFalse(history.can_redo)
+        self.assertEqual([name for name, _ in history.steps], ['brightness', 'flip'])
+        history.undo()
+        history.redo()
+        self.assertEqual([name for name, _ in history.steps], ['brightness', 'flip'])
+
+    def test_group_replaces_top_step(self):
+        history = EditHistory()
+        history.push('brightness', {'value': 1.1}, group=1)
+        history.push('brightness', {'value': 1.3}, group=1)
+        self.assertEqual(history.steps, [('brightness', {'value': 1.3})])
+        history.push('brightness', {'value': 1.5}, group=2)
+        self.assertEqual(history.position, 2)
+
+    def test_absolute_replacement_is_undoable(self):
+        # Ползунок: новое значение заменяет шаг на вершине, а отмена возвращает прежнее
+        history = EditHistory()
+        history.push('flip', {'direction': 'vertical'})
+        history.push('brightness', {'value': 1.2}, absolute=True)
+        self.assertEqual(history.push('brightness', {'value': 1.4}, absolute=True), 1)
+        self.assertEqual(history.steps, [('flip', {'direction': 'vertical'}), ('brightness', {'value': 1.4})])
+        self.assertEqual(history.undo(), 1)  # Отличается шаг 1
+        self.assertEqual(history.top('brightness'), {'value': 1.2})
+        self.assertEqual(history.redo(), 1)
+        self.assertEqual(history.top('brightness'), {'value': 1.4})
+        self.assertIsNone(history.top('flip'))
+
+
+class CheckpointCacheTest(unittest.TestCase):
+
+    STEPS = [('grayscale', {}), ('rotate', {'angle': 30}), ('rotate', {'angle': 45}), ('grayscale', {})]
+
+    def test_invalidate_after(self):
+        cache = CheckpointCache(noise(), 1 << 30)
+        steps = engine.normalize_recipe(self.STEPS)
+        for index in range(1, 5):
+            cache.render(steps, index)
+        self.assertEqual(list(cache._frames), [1, 2, 3, 4])
+        cache.invalidate_after(2)
+        self.assertEqual(list(cache._frames), [1, 2])
+        self.assertEqual(cache.used, sum(image_bytes(frame) for frame in cache._frames.values()))
+        # Шаг 2 изменился: кадр строится от точки 2, а не из устаревшего кадра 3
+        steps[2] = ('rotate', {'angle': 60})
+        expected = engine.apply_recipe(cache.base, steps[:3])
+        self.assertTrue(np.array_equal(np.asarray(cache.render(steps, 3)), np.asarray(expected)))
+
+    def test_lru_budget(self):
+        base = noise()
+        frame = image_bytes(base.convert('L'))
+        cache = CheckpointCache(base, 2 * frame)
+        steps = engine.normalize_recipe([('grayscale', {}), ('nonlinear_correction', {'gamma': 1.2}),
+                                         ('nonlinear_correction', {'gamma': 0.8})])
+        cache.render(steps, 1)
+        cache.render(steps, 2)
+        cache.render(steps, 1)  # Точка 1 использована последней
+        cache.render(steps, 3)
+        self.assertEqual(list(cache._frames), [1, 3])
+        self.assertEqual(cache.used, 2 * frame)
+        # Кадр больше всего бюджета не сохраняется
+        small = CheckpointCache(base, frame - 1)
+        small.render(steps, 1)
+        self.assertEqual((list(small._frames), small.used), ([], 0))
+
+    def test_lead_frame_is_reused(self):
+        # Кадр с одним lead сохраняется под ключом 0, и правки считаются от него
+        cache = CheckpointCache(noise(), 1 << 30, [('orient', {'orientation': 6})])
+        lead_frame = cache.render([], 0)
+        self.assertEqual(lead_frame.size, (90, 120))
+        self.assertEqual(list(cache._frames), [0])
+        steps = engine.normalize_recipe([('rotate', {'angle': 30})])
+        expected = engine.apply_recipe(lead_frame, steps)
+        self.assertTrue(np.array_equal(np.asarray(cache.render(steps, 1)), np.asarray(expected)))
+        self.assertIs(cache.render([], 0), lead_frame)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+# EXIF-ориентация: смена тега JPEG без перекодирования (engine.set_jpeg_orientation)
+# и поворот TIFF, который PIL выполняет сам при загрузке
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from PIL import Image
+import engine
+import service
+import session
+
+MAKE_TAG = 0x010F
+
+
+def jpeg(exif=None):
+    rng = np.random.default_rng(0)
+    image = Image.fromarray(rng.integers(0, 256, (48, 64, 3), dtype=np.uint8))
+    buffer = io.BytesIO()
+    if exif is None:
+        image.save(buffer, 'JPEG', quality=90)
+    else:
+        image.save(buffer, 'JPEG', quality=90, exif=exif)
+    return buffer.getvalue()
+
+
+def segments(data):
+    # Маркеры сегментов до начала скана
+    markers = []
+    pos = 2
+    while data[pos + 1] != 0xDA:
+        markers.append(data[pos + 1])
+        pos += 2 + int.from_bytes(data[pos + 2:pos + 4], 'big')
+    return markers
+
+
+def pixels(data):
+    return np.asarray(Image.open(io.BytesIO(data)))
+
+
+class SetJpegOrientationTest(unittest.TestCase):
+
+    def test_patches_existing_tag_in_place(self):
+        exif = Image.Exif()
+        exif[engine.ORIENTATION_TAG] = 1
+        data = jpeg(exif)
+        patched = engine.set_jpeg_orientation(data, 6)
+        self.assertEqual(len(patched), len(data))
+        self.assertEqual(sum(a != b for a, b in zip(data, patched)), 1)
+        self.assertEqual(Image.open(io.BytesIO(patched)).getexif()[engine.ORIENTATION_TAG], 6)
+
+    def test_inserts_app1_after_jfif(self):
+        data = jpeg()
+        patched = engine.set_jpeg_orientation(data, 8)
+        self.assertEqual(segments(patched)[:2], [0xE0, 0xE1])
+        self.assertEqual(Image.open(io.BytesIO(patched)).getexif()[engine.ORIENTATION_TAG], 8)
+        self.assertTrue(np.array_equal(pixels(patched), pixels(data)))
+
+    def test_rebuilds_exif_without_orientation(self):
+        exif = Image.Exif()
+        exif[MAKE_TAG] = 'Camera'
+        data = jpeg(exif)
+        patched = engine.set_jpeg_orientation(data, 3)
+        self.assertEqual(segments(patched).count(0xE1), 1)
+        result = Image.open(io.BytesIO(patched)).getexif()
+        self.assertEqual(result[engine.ORIENTATION_TAG], 3)
+        self.assertEqual(result[MAKE_TAG], 'Camera')
+        self.assertTrue(np.array_equal(pixels(patched), pixels(data)))
+
+    def test_rejects_other_formats(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (4, 4)).save(buffer, 'PNG')
+        with self.assertRaises(ValueError):
+            engine.set_jpeg_orientation(buffer.getvalue(), 6)
+
+
+class TiffOrientationTest(unittest.TestCase):
+    # Ориентация 6 на исходнике 257x301: верный результат — поворот на 270° (301x257)
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='orientation-test-')
+        rng = np.random.default_rng(0)
+        self.source = Image.fromarray(rng.integers(0, 256, (301, 257, 3), dtype=np.uint8))
+        self.expected = np.asarray(self.source.transpose(Image.Transpose.ROTATE_270))
+        exif = Image.Exif()
+        exif[engine.ORIENTATION_TAG] = 6
+        self.path = os.path.join(self.dir, 'oriented.tif')
+        self.source.save(self.path, exif=exif)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_probe_image(self):
+        info = engine.probe_image(self.path)
+        self.assertEqual(info.orientation, 1)
+        self.assertEqual(info.oriented_size, (301, 257))
+
+    def test_process_file(self):
+        target = engine.process_file(self.path, [], self.dir, '.png')
+        self.assertTrue(np.array_equal(np.asarray(Image.open(target)), self.expected))
+
+    def test_service_decode(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        image, lead, _ = service._decoded('oriented', data, service.SOURCE_CACHE_BYTES)
+        self.assertTrue(np.array_equal(np.asarray(engine.apply_recipe(image, lead)), self.expected))
+
+    def test_document_render_full(self):
+        document = session.load_decoded(self.path).document()
+        self.assertEqual(document.size, (301, 257))
+        self.assertTrue(np.array_equal(np.asarray(document.render_full()), self.expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+# Документ предпросмотра: сохранение в полном разрешении повторяет то, что показано на прокси
+import unittest
+import numpy as np
+from PIL import Image
+import engine
+from preview import PreviewDocument
+
+
+def speckled(width=3200, height=2400):
+    # Серый фон с редкими одиночными белыми пикселями: при уменьшении до прокси они
+    # усредняются, поэтому перцентили и среднее прокси и исходника различаются
+    rng = np.random.default_rng(0)
+    array = np.full((height, width), 90, dtype=np.uint8)
+    array += rng.integers(0, 40, array.shape, dtype=np.uint8)
+    array[rng.random(array.shape) < 0.03] = 255
+    return Image.fromarray(array)
+
+
+class FrozenStatisticsTest(unittest.TestCase):
+
+    def test_full_render_uses_preview_statistics(self):
+        source = speckled()
+        document = PreviewDocument(source)
+        self.assertTrue(document.is_proxy)
+        document.apply('contrast', value=1.5)
+        document.apply('linear_correction', gamma=1.2)
+
+        (_, contrast), (_, levels) = document.steps
+        proxy_ranges = engine.levels_ranges(engine.contrast(document.proxy, 1.5, contrast['mean']))
+        self.assertEqual(levels['ranges'], proxy_ranges)
+        self.assertNotEqual(levels['ranges'], engine.levels_ranges(engine.contrast(source, 1.5)))
+
+        full = document.render_full()
+        self.assertTrue(np.array_equal(np.asarray(full), np.asarray(engine.apply_recipe(source, document.steps))))
+        plain = [('contrast', {'value': 1.5}), ('linear_correction', {'gamma': 1.2})]
+        self.assertFalse(np.array_equal(np.asarray(full), np.asarray(engine.apply_recipe(source, plain))))
+
+
+class PublishedHistoryTest(unittest.TestCase):
+    # UI читает снимок журнала, а не сам журнал, который меняет поток обработки
+
+    def test_snapshot_follows_changes(self):
+        document = PreviewDocument(Image.new('RGB', (40, 30), 'gray'))
+        self.assertEqual((document.published.steps, document.published.can_undo), ((), False))
+        document.apply('brightness', group=1, absolute=True, value=1.2)
+        snapshot = document.published
+        document.apply('brightness', group=1, absolute=True, value=1.4)  # Замена на месте
+        self.assertEqual(snapshot.top('brightness'), {'value': 1.2})
+        self.assertEqual(document.published.top('brightness'), {'value': 1.4})
+        document.undo()
+        self.assertEqual((document.published.steps, document.published.can_redo), ((), True))
+        document.redo()
+        self.assertEqual(document.published.top('brightness'), {'value': 1.4})
+        document.reset()
+        self.assertEqual((document.published.steps, document.published.can_undo), ((), False))
+
+
+if __name__ == '__main__':
+    unittest.main()
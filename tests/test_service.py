@@ -0,0 +1,72 @@
+# Сквозная проверка HTTP-сервиса: start_server + ServiceClient
+import http.client
+import io
+import json
+import unittest
+import numpy as np
+from PIL import Image
+import engine
+import service
+
+
+def encode(array, format):
+    buffer = io.BytesIO()
+    Image.fromarray(array).save(buffer, format)
+    return buffer.getvalue()
+
+
+class ServiceTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = service.start_server(port=0, workers=2)
+        cls.client = service.ServiceClient(f'http://127.0.0.1:{cls.server.server_port}')
+        rng = np.random.default_rng(0)
+        cls.data = encode(rng.integers(0, 256, (120, 160, 3), dtype=np.uint8), 'PNG')
+
+    @classmethod
+    def tearDownClass(cls):
+        service.stop_server(cls.server)
+
+    def post(self, headers, body=b''):
+        connection = http.client.HTTPConnection('127.0.0.1', self.server.server_port, timeout=10)
+        try:
+            connection.putrequest('POST', '/process')
+            for name, value in headers.items():
+                connection.putheader(name, value)
+            connection.endheaders(body)
+            response = connection.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            connection.close()
+
+    def test_process_matches_engine(self):
+        recipe = [{'op': 'brightness', 'value': 1.2}, 'grayscale', {'op': 'rotate', 'angle': 90}]
+        body, headers = self.client.process(self.data, recipe, format='png')
+        expected = engine.apply_recipe(Image.open(io.BytesIO(self.data)), recipe)
+        result = Image.open(io.BytesIO(body))
+        self.assertEqual(headers['Content-Type'], 'image/png')
+        self.assertEqual(result.size, expected.size)
+        self.assertTrue(np.array_equal(np.asarray(result), np.asarray(expected)))
+
+        # Повтор того же файла берет декодированный исходник из кэша полосы
+        _, headers = self.client.process(self.data, recipe, format='png')
+        self.assertEqual(headers['X-Source-Cache'], 'hit')
+        self.assertGreaterEqual(self.client.stats()['completed'], 2)
+
+    def test_bad_requests(self):
+        for data, recipe in [(b'not an image', []), (self.data, ['nope']), (b'', [])]:
+            with self.assertRaisesRegex(RuntimeError, '^400'):
+                self.client.process(data, recipe)
+
+    def test_invalid_content_length(self):
+        for length in ('abc', '-1'):
+            status, reply = self.post({'Content-Length': length})
+            self.assertEqual(status, 400)
+            self.assertIn('Content-Length', reply['error'])
+        status, _ = self.post({'Content-Length': str(service.MAX_BODY_BYTES + 1)})
+        self.assertEqual(status, 413)
+
+
+if __name__ == '__main__':
+    unittest.main()
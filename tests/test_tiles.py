@@ -0,0 +1,128 @@
+# Несжатый TIFF, который пишет tiles.create_tiff, должен читаться PIL и open_source;
+# обработка полосами должна давать тот же результат, что engine.apply_recipe
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from PIL import Image
+import engine
+import tiles
+
+
+class CreateTiffTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='tiles-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_classic_round_trip(self):
+        rng = np.random.default_rng(0)
+        for mode, bands in tiles.BANDS.items():
+            path = os.path.join(self.dir, f'{mode}.tif')
+            expected = rng.integers(0, 256, (1200, 2000, bands), dtype=np.uint8)
+            array = tiles.create_tiff(path, 2000, 1200, mode)
+            array[:] = expected
+            array.flush()
+            del array
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(4), b'II*\x00')
+            with Image.open(path) as image:
+                self.assertEqual((image.size, image.mode), ((2000, 1200), mode))
+                self.assertGreater(len(image.tile), 1)  # Несколько полос
+                decoded = np.asarray(image).reshape(expected.shape)
+            self.assertTrue(np.array_equal(decoded, expected))
+            source, source_mode, _ = tiles.open_source(path)
+            self.assertIsInstance(source, np.memmap)
+            self.assertEqual(source_mode, mode)
+            self.assertTrue(np.array_equal(source, expected))
+            del source
+
+    def test_bigtiff_header(self):
+        # Больше 4 ГБ данных: файл разреженный, записываются только две строки
+        width, height = 65536, 65540
+        path = os.path.join(self.dir, 'big.tif')
+        array = tiles.create_tiff(path, width, height, 'L')
+        array[0] = 7
+        array[-1] = 9
+        array.flush()
+        offset = array.offset
+        del array
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(4), b'II+\x00')
+        image = tiles._open_unchecked(path)
+        try:
+            self.assertEqual((image.size, image.mode), ((width, height), 'L'))
+            self.assertEqual(image.tile[0].offset, offset)
+            self.assertEqual(image.tile[-1].extents[3], height)
+        finally:
+            image.close()
+        source, _, _ = tiles.open_source(path)
+        self.assertEqual(source.shape, (height, width, 1))
+        self.assertEqual((source[0].min(), source[-1].max()), (7, 9))
+        del source
+
+
+class ProcessFileTiledTest(unittest.TestCase):
+    # Маленькие полосы (по 8 строк) и рецепты, которым нужны несколько проходов
+
+    STRIP_BYTES = 8 * 97 * 4
+    RECIPES = [
+        [('brightness', {'value': 1.2}), ('contrast', {'value': 1.4}), ('rotate', {'angle': 90})],
+        [('linear_correction', {'gamma': 1.2}), ('flip', {'direction': 'vertical'})],
+        [('contrast', {'value': 0.8}), ('saturation', {'value': 1.6}), ('linear_correction', {'gamma': 0.9}),
+         ('rotate', {'angle': 270})],
+        [('brightness', {'value': 1.1}), ('grayscale', {}), ('contrast', {'value': 1.3}),
+         ('nonlinear_correction', {'gamma': 1.5}), ('linear_correction', {'gamma': 1.1})],
+    ]
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='tiles-test-')
+        self.output = os.path.join(self.dir, 'out')
+        os.makedirs(self.output)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def source(self, name, width, height, orientation=None):
+        rng = np.random.default_rng(0)
+        image = Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+        path = os.path.join(self.dir, name)
+        if orientation is None:
+            image.save(path)
+        else:
+            exif = Image.Exif()
+            exif[engine.ORIENTATION_TAG] = orientation
+            image.save(path, exif=exif)
+        return path
+
+    def assertMatchesEngine(self, path):
+        image, lead = engine.open_oriented(path)
+        for recipe in self.RECIPES:
+            expected = engine.apply_recipe(image, lead + recipe)
+            for extension in ('tif', 'png'):
+                target = tiles.process_file_tiled(path, recipe, self.output, extension, self.STRIP_BYTES)
+                with Image.open(target) as result:
+                    self.assertEqual((result.size, result.mode), (expected.size, expected.mode))
+                    self.assertTrue(np.array_equal(np.asarray(result), np.asarray(expected)), (recipe, extension))
+
+    def test_multiple_passes(self):
+        self.assertGreater(len(tiles.plan(self.RECIPES[2], 'RGB')[0]), 1)
+        self.assertGreater(len(tiles.plan(self.RECIPES[3], 'RGB')[0]), 1)
+        self.assertMatchesEngine(self.source('plain.png', 97, 61))
+
+    def test_oriented_raw_tiff(self):
+        # Несжатый TIFF с ориентацией читается через memmap, поворот — при записи
+        for width, height in ((64, 64), (97, 61)):
+            path = self.source(f'oriented-{width}x{height}.tif', width, height, orientation=6)
+            source, _, geometry = tiles.open_source(path)
+            self.assertIsInstance(source, np.memmap)
+            self.assertEqual((source.shape[:2], geometry.is_identity), ((height, width), False))
+            del source
+            self.assertMatchesEngine(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
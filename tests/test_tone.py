@@ -0,0 +1,91 @@
+# Тоновые операции на LUT против эталонов: ImageEnhance и формулы на numpy
+import unittest
+import numpy as np
+from PIL import Image, ImageEnhance
+import engine
+import tone
+
+
+def noise(mode, width=160, height=120):
+    rng = np.random.default_rng(0)
+    shape = (height, width) if mode == 'L' else (height, width, len(mode))
+    return Image.fromarray(rng.integers(0, 256, shape, dtype=np.uint8), mode)
+
+
+def stretch(array, low, high, gamma):
+    result = np.clip((array - low) * (255.0 / (high - low)), 0.0, 255.0)
+    return 255.0 * (result / 255.0) ** (1.0 / gamma)
+
+
+class ToneReferenceTest(unittest.TestCase):
+
+    def assertClose(self, result, expected, mode):
+        self.assertEqual(result.mode, mode)
+        difference = np.abs(np.asarray(result, dtype=np.float64) - np.asarray(expected, dtype=np.float64))
+        self.assertLessEqual(difference.max(), 1.0)
+
+    def test_enhance_operations(self):
+        for mode in ('L', 'RGB'):
+            image = noise(mode)
+            for value in (0.3, 0.8, 1.4, 2.0):
+                self.assertClose(engine.brightness(image, value),
+                                 ImageEnhance.Brightness(image).enhance(value), mode)
+                self.assertClose(engine.contrast(image, value), ImageEnhance.Contrast(image).enhance(value), mode)
+                if mode == 'RGB':
+                    self.assertClose(engine.saturation(image, value), ImageEnhance.Color(image).enhance(value), mode)
+
+    def test_alpha_is_kept(self):
+        image = noise('RGBA')
+        result = engine.brightness(image, 1.3)
+        self.assertTrue(np.array_equal(np.asarray(result)[..., 3], np.asarray(image)[..., 3]))
+        self.assertClose(result.convert('RGB'), ImageEnhance.Brightness(image.convert('RGB')).enhance(1.3), 'RGB')
+
+    def test_nonlinear_correction(self):
+        image = noise('L')
+        expected = 255.0 * (np.asarray(image) / 255.0) ** (1.0 / 1.5)
+        self.assertClose(engine.nonlinear_correction(image, 1.5), expected, 'L')
+        color = noise('RGB')
+        self.assertIs(engine.nonlinear_correction(color, 1.5), color)  # Только для grayscale
+
+    def test_linear_correction(self):
+        gray = noise('L')
+        array = np.asarray(gray, dtype=np.float64)
+        low, high = np.percentile(array, (1, 99))
+        self.assertClose(engine.linear_correction(gray, 1.2), stretch(array, low, high, 1.2), 'L')
+
+        color = noise('RGB')
+        array = np.asarray(color, dtype=np.float64)
+        low, high = np.percentile(np.asarray(color.convert('L')), (1, 99))
+        self.assertClose(engine.linear_correction(color, 0.8), stretch(array, low, high, 0.8), 'RGB')
+        expected = np.stack([stretch(array[..., c], *np.percentile(array[..., c], (1, 99)), 1.0)
+                             for c in range(3)], axis=-1)
+        self.assertClose(engine.linear_correction(color, 1.0, link=tone.LINK_CHANNELS), expected, 'RGB')
+
+
+class HistogramPercentilesTest(unittest.TestCase):
+
+    def test_matches_np_percentile(self):
+        rng = np.random.default_rng(1)
+        percentiles = (0, 1, 2.5, 25, 50, 75, 99, 99.9, 100)
+        samples = [rng.integers(0, 256, 10007), rng.integers(100, 110, 333), np.array([42]),
+                   np.array([0, 255]), rng.normal(128, 20, 5000).clip(0, 255).astype(int)]
+        for values in samples:
+            hist = np.bincount(values, minlength=256).astype(np.float64)
+            self.assertTrue(np.allclose(tone.histogram_percentiles(hist, percentiles),
+                                        np.percentile(values, percentiles)))
+
+    def test_mapped_values(self):
+        # Перцентили изображения после кривой — по гистограмме входа и значениям кривой
+        rng = np.random.default_rng(2)
+        values = rng.integers(0, 256, 5000)
+        curve = 255.0 - np.arange(256, dtype=np.float64) * 0.7
+        hist = np.bincount(values, minlength=256).astype(np.float64)
+        self.assertTrue(np.allclose(tone.histogram_percentiles(hist, (1, 50, 99), curve),
+                                    np.percentile(curve[values], (1, 50, 99))))
+
+    def test_empty_histogram(self):
+        self.assertEqual(tone.histogram_percentiles(np.zeros(256), (1, 99)), [0.0, 0.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+# Конвейер кадров (video.run_pipeline) и process_video на короткой последовательности PNG
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import numpy as np
+from PIL import Image
+import engine
+import tone
+import video
+from kernels import cv2_module
+
+RECIPE = [('brightness', {'value': 1.1}), ('linear_correction', {'gamma': 1.2}), ('rotate', {'angle': 90})]
+
+
+class Failure(Exception):
+    pass
+
+
+def run_with_timeout(test, func, seconds=20):
+    # Зависший конвейер не должен подвесить весь прогон тестов
+    outcome = []
+
+    def target():
+        try:
+            outcome.append(func())
+        except BaseException as e:
+            outcome.append(e)
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(seconds)
+    test.assertFalse(thread.is_alive(), "Конвейер не остановился")
+    return outcome[0]
+
+
+class RunPipelineTest(unittest.TestCase):
+
+    def test_keeps_frame_order(self):
+        rng = np.random.default_rng(0)
+        delays = rng.random(60) * 0.005
+        result = []
+
+        def process(index):
+            time.sleep(delays[index])  # Кадры обрабатываются за разное время
+            return index * 2
+
+        run_with_timeout(self, lambda: video.run_pipeline(iter(range(60)), process, result.append,
+                                                          workers=4, depth=3))
+        self.assertEqual(result, [index * 2 for index in range(60)])
+
+    def test_error_stops_all_stages(self):
+        def endless():
+            index = 0
+            while True:
+                yield index
+                index += 1
+
+        def failing_process(index):
+            if index == 5:
+                raise Failure(index)
+            return index
+
+        def failing_consume(index):
+            if index == 3:
+                raise Failure(index)
+
+        def failing_frames():
+            yield 0
+            raise Failure('decode')
+
+        for frames, process, consume in ((endless(), failing_process, lambda _: None),
+                                         (endless(), lambda index: index, failing_consume),
+                                         (failing_frames(), lambda index: index, lambda _: None)):
+            error = run_with_timeout(self, lambda: video.run_pipeline(frames, process, consume, workers=2, depth=2))
+            self.assertIsInstance(error, Failure)
+
+
+class RunningStatsTest(unittest.TestCase):
+
+    def test_running_stats_update(self):
+        running = video.RunningStats(0.25)
+        first = tone.ImageStats(channels=np.full((3, 256), 4.0), luma=np.full(256, 4.0))
+        second = tone.ImageStats(channels=np.zeros((3, 256)), luma=np.zeros(256))
+        running.update(first)
+        smoothed = running.update(second)
+        self.assertTrue(np.allclose(smoothed.channels, 3.0))
+        self.assertTrue(np.allclose(smoothed.luma, 3.0))
+
+
+@unittest.skipIf(cv2_module() is None, "нужен OpenCV")
+class ProcessVideoTest(unittest.TestCase):
+    # Кадры с разной яркостью: автоуровни по всему ролику и по каждому кадру дают разный результат
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='video-test-')
+        self.source = os.path.join(self.dir, 'frames')
+        os.makedirs(self.source)
+        os.makedirs(os.path.join(self.dir, 'out'))
+        rng = np.random.default_rng(0)
+        self.frames = []
+        for index in range(6):
+            low = 10 + 20 * index
+            array = rng.integers(low, low + 100, (24, 32, 3), dtype=np.uint8)
+            array[0, :index + 1] = 255  # Номер кадра виден в первой строке
+            self.frames.append(Image.fromarray(array))
+            self.frames[-1].save(os.path.join(self.source, f'{index:04d}.png'))
+        self.target = os.path.join(self.dir, 'out', '%04d.png')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def results(self):
+        names = sorted(os.listdir(os.path.dirname(self.target)))
+        self.assertEqual(names, [f'{index:04d}.png' for index in range(len(self.frames))])
+        return [np.asarray(Image.open(os.path.join(os.path.dirname(self.target), name))) for name in names]
+
+    def assertFrames(self, results, expected):
+        for index, (result, frame) in enumerate(zip(results, expected)):
+            self.assertTrue(np.array_equal(result, np.asarray(frame)), index)
+
+    def test_global_stats(self):
+        # Одни кривые на весь ролик: как рецепт, примененный к кадрам, сложенным в одно изображение
+        stats = video.process_video(self.source, RECIPE, self.target, 'global', stride=1, workers=3)
+        self.assertEqual(stats.frames, len(self.frames))
+        stacked = Image.fromarray(np.concatenate([np.asarray(frame) for frame in self.frames]))
+        tone_steps = [step for step in RECIPE if step[0] != 'rotate']
+        whole = np.asarray(engine.apply_recipe(stacked, tone_steps))
+        height = self.frames[0].height
+        expected = [engine.rotate(Image.fromarray(whole[i * height:(i + 1) * height]), 90)
+                    for i in range(len(self.frames))]
+        self.assertFrames(self.results(), expected)
+
+    def test_running_stats_without_smoothing(self):
+        # Без сглаживания статистика каждого кадра — его собственная
+        video.process_video(self.source, RECIPE, self.target, 'running', smoothing=0)
+        self.assertFrames(self.results(), [engine.apply_recipe(frame, RECIPE) for frame in self.frames])
+
+    def test_running_stats_are_smoothed(self):
+        video.process_video(self.source, RECIPE, self.target, 'running', smoothing=1.0, fps=25)
+        results = self.results()
+        own = [np.asarray(engine.apply_recipe(frame, RECIPE)) for frame in self.frames]
+        self.assertTrue(np.array_equal(results[0], own[0]))  # Первый кадр — без истории
+        self.assertFalse(np.array_equal(results[-1], own[-1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
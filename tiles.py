@@ -0,0 +1,431 @@
+# Потоковая (полосами) обработка очень больших изображений.
+# Изображение проходит через цепочку операций горизонтальными полосами,
+# промежуточные результаты лежат в отображаемых в память (np.memmap) файлах,
+# поэтому пиковое потребление памяти определяется размером полосы.
+# Глобальная статистика (среднее для контраста, перцентили 1/99 линейной
+# коррекции) берется из гистограмм, накопленных отдельным потоковым проходом.
+# Несжатые TIFF (одной или многими полосами) читаются без декодера PIL и записываются
+# через np.memmap; сжатые и прочие форматы приходится один раз декодировать целиком.
+import os
+import struct
+import tempfile
+import numpy as np
+from PIL import Image, ImageOps
+import engine
+import tone
+from geometry import Transform, IDENTITY
+
+# Размер одной полосы в байтах
+STRIP_BYTES = 64 * 1024 * 1024
+# С какого размера пакетная обработка автоматически переходит на полосы
+TILED_MIN_PIXELS = 100_000_000
+
+# Число байт на пиксель для режимов, которые обрабатываются напрямую
+BANDS = {'L': 1, 'RGB': 3, 'RGBA': 4}
+
+
+def _open_unchecked(path):
+    # Гигапиксельные сканы превышают защиту PIL от "decompression bomb"
+    limit = Image.MAX_IMAGE_PIXELS
+    Image.MAX_IMAGE_PIXELS = None
+    try:
+        return Image.open(path)
+    finally:
+        Image.MAX_IMAGE_PIXELS = limit
+
+
+def probe_pixels(path):
+    # Число пикселей по заголовку файла, без декодирования
+    with _open_unchecked(path) as im:
+        return im.width * im.height
+
+
+def _raw_strips(im):
+    # Полосы несжатого TIFF: ([(смещение в файле, первая строка, последняя строка)], (ширина, высота))
+    # или None. Размер — хранимый в файле: у TIFF с ориентацией 5-8 PIL сообщает уже
+    # повернутый размер, а полосы лежат в файле в исходном положении
+    if not im.tile:
+        return None
+    bands = BANDS[im.mode]
+    width = im.tile[0].extents[2]
+    strips = []
+    y = 0
+    for tile in im.tile:
+        args = tuple(tile.args) + (0, 1)
+        rawmode, stride, direction = args[0], args[1], args[2]
+        x0, y0, x1, y1 = tile.extents
+        if (tile.codec_name != 'raw' or (x0, y0, x1) != (0, y, width) or rawmode != im.mode
+                or stride not in (0, width * bands) or direction != 1):
+            return None
+        strips.append((tile.offset, y0, y1))
+        y = y1
+    return (strips, (width, y)) if sorted((width, y)) == sorted(im.size) else None
+
+
+def open_source(path, scratch=None):
+    # Источник пикселей: массив (высота, ширина, каналы) uint8, режим и геометрия
+    # (geometry.Transform), которую нужно применить при записи (EXIF-ориентация).
+    # scratch (Scratch) — куда копировать несмежные полосы TIFF; без него — в память.
+    im = _open_unchecked(path)
+    raw = _raw_strips(im) if im.format == 'TIFF' and im.mode in BANDS else None
+    if raw is not None:
+        strips, (width, height) = raw
+        bands = BANDS[im.mode]
+        row_bytes = width * bands
+        shape = (height, width, bands)
+        start = strips[0][0]
+        if all(offset == start + y0 * row_bytes for offset, y0, _ in strips):
+            # Полосы идут в файле подряд: пиксели отображаются в память без декодирования
+            array = np.memmap(path, dtype=np.uint8, mode='r', offset=start, shape=shape)
+        else:
+            # Полосы разбросаны по файлу: читаются по одной, без декодера PIL
+            array = scratch.buffer(*shape) if scratch is not None else np.empty(shape, np.uint8)
+            with open(path, 'rb') as f:
+                for offset, y0, y1 in strips:
+                    f.seek(offset)
+                    f.readinto(memoryview(array[y0:y1]).cast('B'))
+        geometry = Transform.from_orientation(im.getexif().get(engine.ORIENTATION_TAG, 1))
+        mode = im.mode
+        im.close()
+        return array, mode, geometry
+
+    # Сжатые и прочие форматы: PIL умеет только полное декодирование
+    image = ImageOps.exif_transpose(im)
+    if image.mode in tone.GRAY_ALPHA_MODES:
+        # Полосы хранят альфу только в RGBA: серый с альфой идёт как RGBA с равными каналами
+        image = image.convert('RGBA')
+    else:
+        image = tone.to_working_mode(image)
+    mode = image.mode
+    array = np.asarray(image)
+    if array.ndim == 2:
+        array = array[:, :, None]
+    return array, mode, IDENTITY
+
+
+def _to_image(array, mode):
+    if mode == 'L':
+        return Image.fromarray(np.ascontiguousarray(array[:, :, 0]), 'L')
+    return Image.fromarray(np.ascontiguousarray(array), mode)
+
+
+def _to_array(image):
+    array = np.asarray(image)
+    if array.ndim == 2:
+        array = array[:, :, None]
+    return array
+
+
+# --- Геометрия: 90-градусные повороты и отражения применяются к полосе
+# целиком, а прямоугольник полосы переносится в систему координат результата.
+
+def _transpose_array(array, method):
+    T = Image.Transpose
+    if method == T.FLIP_LEFT_RIGHT:
+        return array[:, ::-1]
+    if method == T.FLIP_TOP_BOTTOM:
+        return array[::-1]
+    if method == T.ROTATE_90:
+        return np.rot90(array, 1)
+    if method == T.ROTATE_180:
+        return np.rot90(array, 2)
+    if method == T.ROTATE_270:
+        return np.rot90(array, 3)
+    if method == T.TRANSPOSE:
+        return np.swapaxes(array, 0, 1)
+    if method == T.TRANSVERSE:
+        return np.swapaxes(array[::-1, ::-1], 0, 1)
+    raise ValueError(f"Неизвестное преобразование: {method}")
+
+
+def _map_rect(rect, frame, method):
+    # rect = (r0, r1, c0, c1) в кадре frame = (высота, ширина)
+    r0, r1, c0, c1 = rect
+    h, w = frame
+    T = Image.Transpose
+    if method == T.FLIP_LEFT_RIGHT:
+        return (r0, r1, w - c1, w - c0), frame
+    if method == T.FLIP_TOP_BOTTOM:
+        return (h - r1, h - r0, c0, c1), frame
+    if method == T.ROTATE_180:
+        return (h - r1, h - r0, w - c1, w - c0), frame
+    if method == T.ROTATE_90:
+        return (w - c1, w - c0, r0, r1), (w, h)
+    if method == T.ROTATE_270:
+        return (c0, c1, h - r1, h - r0), (w, h)
+    if method == T.TRANSPOSE:
+        return (c0, c1, r0, r1), (w, h)
+    if method == T.TRANSVERSE:
+        return (w - c1, w - c0, h - r1, h - r0), (w, h)
+    raise ValueError(f"Неизвестное преобразование: {method}")
+
+
+def transformed_size(size, geometry):
+    # (ширина, высота) после геометрических преобразований
+    width, height = size
+    for method in geometry:
+        if method in (Image.Transpose.ROTATE_90, Image.Transpose.ROTATE_270,
+                      Image.Transpose.TRANSPOSE, Image.Transpose.TRANSVERSE):
+            width, height = height, width
+    return width, height
+
+
+def _place(target, array, y0, frame, geometry):
+    # Записать полосу, начинающуюся со строки y0 исходного кадра, в target
+    rect = (y0, y0 + array.shape[0], 0, frame[1])
+    for method in geometry:
+        array = _transpose_array(array, method)
+        rect, frame = _map_rect(rect, frame, method)
+    r0, r1, c0, c1 = rect
+    target[r0:r1, c0:c1] = array
+
+
+# --- Запись несжатого TIFF, пиксели которого отображаются в память
+
+def create_tiff(path, width, height, mode):
+    # Пишет заголовок TIFF (или BigTIFF, если данные > 4 ГБ) и возвращает
+    # np.memmap (высота, ширина, каналы) на область пикселей файла.
+    bands = BANDS[mode]
+    row_bytes = width * bands
+    rows_per_strip = max(1, (1 << 20) // row_bytes)
+    strips = -(-height // rows_per_strip)
+    data_size = row_bytes * height
+    big = data_size + 16 * strips + 4096 >= 2 ** 32
+
+    if big:
+        header = struct.pack('<2sHHHQ', b'II', 43, 8, 0, 16)
+        count_fmt, entry_fmt, next_fmt, inline, offset_type, offset_fmt = '<Q', '<HHQ', '<Q', 8, 16, 'Q'
+    else:
+        header = struct.pack('<2sHI', b'II', 42, 8)
+        count_fmt, entry_fmt, next_fmt, inline, offset_type, offset_fmt = '<H', '<HHI', '<I', 4, 4, 'I'
+
+    entries = [
+        (256, 4, 'I', [width]),
+        (257, 4, 'I', [height]),
+        (258, 3, 'H', [8] * bands),
+        (259, 3, 'H', [1]),  # Без сжатия
+        (262, 3, 'H', [1 if mode == 'L' else 2]),  # MinIsBlack / RGB
+        (273, offset_type, offset_fmt, None),  # StripOffsets — заполняются ниже
+        (277, 3, 'H', [bands]),
+        (278, 4, 'I', [rows_per_strip]),
+        (279, offset_type, offset_fmt, [min(rows_per_strip, height - i * rows_per_strip) * row_bytes
+                                        for i in range(strips)]),
+        (284, 3, 'H', [1]),  # Chunky
+    ]
+    if mode == 'RGBA':
+        entries.append((338, 3, 'H', [2]))  # ExtraSamples: неассоциированная альфа
+
+    ifd_offset = len(header)
+    entry_size = struct.calcsize(entry_fmt) + inline
+    ifd_size = struct.calcsize(count_fmt) + entry_size * len(entries) + struct.calcsize(next_fmt)
+    extra_offset = ifd_offset + ifd_size
+
+    # Размер внешних массивов не зависит от значений, поэтому начало данных известно заранее
+    def external_size(fmt, count):
+        size = struct.calcsize('<' + fmt * count)
+        return size if size > inline else 0
+    extra_size = sum(external_size(fmt, strips if values is None else len(values))
+                     for _, _, fmt, values in entries)
+    data_offset = -(-(extra_offset + extra_size) // 16) * 16
+    entries[5] = (273, offset_type, offset_fmt,
+                  [data_offset + i * rows_per_strip * row_bytes for i in range(strips)])
+
+    ifd = struct.pack(count_fmt, len(entries))
+    extra = b''
+    for tag, kind, fmt, values in entries:
+        payload = struct.pack('<' + fmt * len(values), *values)
+        if len(payload) <= inline:
+            field = payload.ljust(inline, b'\0')
+        else:
+            field = struct.pack('<' + ('Q' if big else 'I'), extra_offset + len(extra))
+            extra += payload
+        ifd += struct.pack(entry_fmt, tag, kind, len(values)) + field
+    ifd += struct.pack(next_fmt, 0)
+
+    with open(path, 'wb') as f:
+        f.write(header + ifd + extra)
+        f.truncate(data_offset + data_size)
+    return np.memmap(path, dtype=np.uint8, mode='r+', offset=data_offset, shape=(height, width, bands))
+
+
+class Scratch:
+    # Временные буферы np.memmap; файлы удаляются в close()
+    def __init__(self, directory=None):
+        self.dir = tempfile.mkdtemp(prefix='imgproc-', dir=directory)
+        self._count = 0
+
+    def buffer(self, height, width, bands):
+        self._count += 1
+        path = os.path.join(self.dir, f'pass{self._count}.raw')
+        return np.memmap(path, dtype=np.uint8, mode='w+', shape=(height, width, bands))
+
+    def close(self):
+        for name in os.listdir(self.dir):
+            os.remove(os.path.join(self.dir, name))
+        os.rmdir(self.dir)
+
+
+# --- План выполнения
+
+
+def plan(recipe, mode):
+    # Делит рецепт на проходы. Новый проход нужен, когда шагу со статистикой
+    # предшествует не-тоновая операция (серый, насыщенность): ее результат
+    # нельзя описать кривыми, и гистограмму приходится набирать заново.
+    # Растяжению цветного изображения по яркости нужна гистограмма яркости
+    # самого входа прохода, поэтому оно всегда начинает новый проход.
+    # Повороты и отражения не зависят от пикселей: они сворачиваются в одно
+    # преобразование и откладываются до записи результата.
+    # Шагам с зафиксированной статистикой (engine.freeze_statistics) гистограмма не нужна.
+    passes = [[]]
+    transform = IDENTITY
+    dirty = False
+    for name, params in engine.normalize_recipe(recipe):
+        step = engine.step_transform(name, params)
+        if step is not None:
+            transform = transform.then(step)
+            continue
+        if name == 'rotate':
+            raise ValueError("В потоковом режиме поддерживается поворот только на угол, кратный 90°")
+        # Пропускаем шаги, которые ничего не меняют (как engine для этих режимов)
+        if name in ('grayscale', 'saturation') and mode == 'L':
+            continue
+        if name == 'nonlinear_correction' and mode != 'L':
+            continue
+        stats_step = engine.needs_stats(name, params)
+        luminance_link = (stats_step and name == 'linear_correction' and mode != 'L'
+                          and params.get('link', tone.LINK_LUMINANCE) == tone.LINK_LUMINANCE)
+        if (stats_step and dirty) or (luminance_link and passes[-1]):
+            passes.append([])
+            dirty = False
+        passes[-1].append((name, params))
+        if name == 'grayscale':
+            mode, dirty = 'L', True
+        elif name == 'saturation':
+            dirty = True
+    return passes, transform
+
+
+def build_stages(steps, mode, stats):
+    # Превращает шаги прохода в этапы обработки полосы: кривые (ToneCurves) и прочие операции
+    stages = []
+    curves = None
+    first_group = True
+    for name, params in steps:
+        if name in tone.TONE_OPERATIONS:
+            if curves is None:
+                # Статистика есть только у входа прохода (план это гарантирует)
+                curves = tone.ToneCurves(mode, stats if first_group else None)
+                stages.append(curves)
+            curves.apply(name, params)
+        else:
+            curves = None
+            first_group = False
+            stages.append((name, params))
+            if name == 'grayscale':
+                mode = 'L'
+    return stages, mode
+
+
+def run_stages(image, stages):
+    # Применить этапы build_stages к полосе (или кадру)
+    for stage in stages:
+        if isinstance(stage, tone.ToneCurves):
+            image = stage.render(image)
+        else:
+            name, params = stage
+            image = engine.OPERATIONS[name](image, **params)
+    return image
+
+
+def _strip_rows(width, strip_bytes):
+    return max(1, strip_bytes // (width * 4))
+
+
+def strip_stats(strip):
+    # Гистограммы полосы (или кадра): каналы и (для цвета) яркость
+    luma = tone.luma_histogram(strip) if strip.mode != 'L' else None
+    return tone.ImageStats(channels=tone.channel_histograms(strip), luma=luma)
+
+
+def _histogram(array, mode, strip_bytes):
+    # Потоковый проход: гистограммы без загрузки всего изображения
+    rows = _strip_rows(array.shape[1], strip_bytes)
+    stats = None
+    for y0 in range(0, array.shape[0], rows):
+        part = strip_stats(_to_image(array[y0:y0 + rows], mode))
+        stats = part if stats is None else stats + part
+    return stats
+
+
+def process_tiled(source, mode, recipe, make_output, strip_bytes=STRIP_BYTES, scratch_dir=None,
+                  geometry=IDENTITY):
+    # source — массив (высота, ширина, каналы); make_output(ширина, высота, режим) -> массив для результата.
+    # geometry — преобразование источника (EXIF-ориентация), оно сворачивается с поворотами рецепта.
+    # Возвращает (массив результата, режим).
+    passes, transform = plan(recipe, mode)
+    transform = geometry.then(transform)
+    geometry = [] if transform.is_identity else [transform.method]
+    scratch = Scratch(scratch_dir)
+    try:
+        current, current_mode = source, mode
+        stats = None  # Гистограммы current; None — их еще нет
+        for index, steps in enumerate(passes):
+            last = index == len(passes) - 1
+            height, width = current.shape[:2]
+            if stats is None:
+                array, array_mode = current, current_mode
+                stats_source = lambda: _histogram(array, array_mode, strip_bytes)
+            else:
+                stats_source = stats
+            stages, out_mode = build_stages(steps, current_mode, stats_source)
+            if last:
+                out_width, out_height = transformed_size((width, height), geometry)
+                target = make_output(out_width, out_height, out_mode)
+            else:
+                target = scratch.buffer(height, width, BANDS[out_mode])
+            stats = None
+            rows = _strip_rows(width, strip_bytes)
+            for y0 in range(0, height, rows):
+                strip = run_stages(_to_image(current[y0:y0 + rows], current_mode), stages)
+                if not last:
+                    # Гистограмма выхода набирается сразу, для шагов следующего прохода
+                    part = strip_stats(strip)
+                    stats = part if stats is None else stats + part
+                    _place(target, _to_array(strip), y0, (height, width), [])
+                else:
+                    _place(target, _to_array(strip), y0, (height, width), geometry)
+            if isinstance(target, np.memmap):
+                target.flush()
+            current, current_mode = target, out_mode
+        return current, current_mode
+    finally:
+        scratch.close()
+
+
+def process_file_tiled(input_path, recipe, output_dir, extension=None, strip_bytes=STRIP_BYTES,
+                       scratch_dir=None):
+    # Аналог engine.process_file для очень больших файлов
+    target = engine.output_path(input_path, output_dir, extension)
+    is_tiff = target.lower().endswith(('.tif', '.tiff'))
+    scratch = Scratch(scratch_dir)
+    try:
+        source, mode, geometry = open_source(input_path, scratch)
+        def make_output(width, height, out_mode):
+            if is_tiff:
+                # Результат пишется полосами прямо в файл
+                return create_tiff(target, width, height, out_mode)
+            return scratch.buffer(height, width, BANDS[out_mode])
+
+        result, result_mode = process_tiled(source, mode, recipe, make_output, strip_bytes,
+                                            scratch_dir, geometry)
+        if not is_tiff:
+            # Кодировщики PIL (JPEG, PNG) требуют изображение целиком
+            image = _to_image(result, result_mode)
+            if target.lower().endswith(engine.JPEG_EXTENSIONS) and image.mode not in ('L', 'RGB'):
+                image = image.convert('RGB')  # JPEG не поддерживает альфа-канал
+            image.save(target)
+        del result, source
+    finally:
+        scratch.close()
+    return target
@@ -0,0 +1,313 @@
+# Компилятор тоновых операций в таблицы преобразования (LUT).
+# Яркость, контраст, линейное растяжение и гамма — поканальные кривые 0..255,
+# поэтому цепочку таких шагов можно свернуть в одну 256-элементную таблицу
+# на канал и применить к изображению за один проход uint8 (Image.point).
+# Кривые хранятся во float и квантуются только один раз, в самом конце.
+import weakref
+import numpy as np
+from PIL import Image
+from instrument import span
+
+# Операции, которые сворачиваются в LUT
+TONE_OPERATIONS = ('brightness', 'contrast', 'linear_correction', 'nonlinear_correction')
+
+# Режимы, для которых работает LUT-путь (альфа-канал не меняется)
+SUPPORTED_MODES = ('L', 'RGB', 'RGBA')
+
+# Веса перевода RGB -> L (как в PIL convert('L'))
+LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114])
+
+
+# Способы линейного растяжения цветного изображения
+LINK_LUMINANCE = 'luminance'  # Одинаковое растяжение всех каналов по перцентилям яркости
+LINK_CHANNELS = 'channels'  # Каждый канал растягивается по своим перцентилям
+LINK_MODES = (LINK_LUMINANCE, LINK_CHANNELS)
+
+
+def supports(image):
+    return image.mode in SUPPORTED_MODES
+
+
+# Серый с альфой: тоновые кривые идут по L, альфа отделяется и возвращается без изменений
+GRAY_ALPHA_MODES = ('LA', 'La')
+# 16-битный серый: при переводе в L значения масштабируются (>> 8), а не обрезаются
+SIXTEEN_BIT_MODES = ('I;16', 'I;16L', 'I;16B', 'I;16N')
+
+
+def working_mode(mode):
+    # Ближайший режим, для которого работает LUT-путь.
+    # 'I' и 'F' переводятся в L преобразованием PIL: значения вне 0..255 обрезаются
+    # (диапазон таких данных неизвестен, в отличие от 16-битных режимов)
+    if mode in SUPPORTED_MODES:
+        return mode
+    if mode in ('1', 'I', 'F') + GRAY_ALPHA_MODES + SIXTEEN_BIT_MODES:
+        return 'L'
+    return 'RGBA' if mode in ('PA', 'RGBa') or mode.endswith('A') else 'RGB'
+
+
+def to_working_mode(image):
+    # Изображение в режиме working_mode (альфа серого с альфой при этом отбрасывается)
+    if image.mode in SIXTEEN_BIT_MODES:
+        return Image.fromarray((np.asarray(image) >> 8).astype(np.uint8), 'L')
+    mode = working_mode(image.mode)
+    return image if image.mode == mode else image.convert(mode)
+
+
+def apply_gamma(values, gamma):
+    # Гамма-коррекция: 255 * (x/255)^(1/гамма), values — float в диапазоне 0..255
+    safe_gamma = max(1e-6, gamma)
+    base = np.clip(values, 0.0, 255.0) / 255.0
+    base = np.maximum(base, 1e-12)
+    return 255.0 * (base ** (1.0 / safe_gamma))
+
+
+def channel_histograms(image):
+    # Гистограммы цветовых каналов за один проход: массив (каналы, 256)
+    bands = 1 if image.mode == 'L' else 3
+    with span('histogram'):
+        return np.array(image.histogram()[:256 * bands], dtype=np.float64).reshape(bands, 256)
+
+
+def luma_histogram(image):
+    # Гистограмма яркости (L) — для цветного изображения нужен перевод в L
+    if image.mode == 'L':
+        return channel_histograms(image)[0]
+    with span('histogram', luma=True):
+        return np.array(image.convert('L').histogram(), dtype=np.float64)
+
+
+class ImageStats:
+    # Гистограммы изображения по каналам и по яркости.
+    # Каждая считается не больше одного раза и только по требованию;
+    # на само изображение держится слабая ссылка, чтобы кэш не мешал его освобождению.
+
+    def __init__(self, image=None, channels=None, luma=None):
+        self._image = weakref.ref(image) if image is not None else None
+        self._channels = channels
+        self._luma = luma
+
+    def _source(self):
+        image = self._image() if self._image is not None else None
+        if image is None:
+            raise ValueError("Гистограмма недоступна: изображение уже освобождено")
+        return image
+
+    @property
+    def channels(self):
+        if self._channels is None:
+            self._channels = channel_histograms(self._source())
+        return self._channels
+
+    @property
+    def luma(self):
+        if self._luma is None:
+            if self._channels is not None and len(self._channels) == 1:
+                self._luma = self._channels[0]
+            else:
+                self._luma = luma_histogram(self._source())
+        return self._luma
+
+    def __add__(self, other):
+        # Сумма гистограмм (накопление по полосам)
+        luma = None
+        if self._luma is not None and other._luma is not None:
+            luma = self._luma + other._luma
+        return ImageStats(channels=self.channels + other.channels, luma=luma)
+
+
+# Кэш статистики по объекту изображения: id -> (слабая ссылка, ImageStats)
+_stats_cache = {}
+
+
+def image_stats(image):
+    # Статистика изображения из кэша; повторные коррекции одного кадра не сканируют его заново
+    entry = _stats_cache.get(id(image))
+    if entry is not None and entry[0]() is image:
+        return entry[1]
+    return remember_stats(image, ImageStats(image))
+
+
+def remember_stats(image, stats):
+    # Положить в кэш уже известную статистику кадра (например, прочитанную с диска)
+    key = id(image)
+    _stats_cache[key] = (weakref.ref(image, lambda _, key=key: _stats_cache.pop(key, None)), stats)
+    return stats
+
+
+def reset_caches():
+    # Забыть статистику всех кадров (замеры "с холодного старта")
+    _stats_cache.clear()
+
+
+def histogram_percentiles(hist, percentiles, values=None):
+    # Перцентили по гистограмме, совпадающие с np.percentile (линейная интерполяция).
+    # values — значения, соответствующие корзинам (по умолчанию 0..255),
+    # что позволяет считать перцентили уже преобразованного кривой изображения.
+    if values is None:
+        values = np.arange(256, dtype=np.float64)
+    order = np.argsort(values, kind='stable')
+    sorted_values = values[order]
+    cumulative = np.cumsum(hist[order])
+    total = cumulative[-1]
+    if total == 0:
+        return [0.0 for _ in percentiles]
+
+    def order_stat(k):
+        # k-й по величине элемент (с нуля)
+        return sorted_values[np.searchsorted(cumulative, k, side='right')]
+
+    result = []
+    for q in percentiles:
+        position = (total - 1) * q / 100.0
+        lower = int(np.floor(position))
+        low_value = order_stat(lower)
+        high_value = order_stat(min(lower + 1, total - 1))
+        result.append(float(low_value + (position - lower) * (high_value - low_value)))
+    return result
+
+
+def _mean_luma(curves, hist):
+    # Средняя яркость (L) изображения после применения кривых — без прохода по пикселям
+    means = (curves * hist).sum(axis=1) / np.maximum(hist.sum(axis=1), 1)
+    if len(means) == 1:
+        return float(means[0])
+    return float(np.dot(LUMA_WEIGHTS, means))
+
+
+def _apply_curves(image, curves):
+    # Единственный проход по пикселям: квантуем кривые и применяем Image.point
+    lut = np.rint(np.clip(curves, 0.0, 255.0)).astype(np.uint8)
+    table = lut.ravel().tolist()
+    if image.mode == 'RGBA':
+        table += list(range(256))  # альфа-канал без изменений
+    return image.point(table)
+
+
+def stretch_curve(curve, p_low, p_high, gamma):
+    # Линейное растяжение [p_low, p_high] -> [0, 255] и гамма поверх него
+    corrected = (curve - p_low) * (255.0 / (p_high - p_low))
+    if abs(gamma - 1.0) > 1e-3:
+        corrected = apply_gamma(corrected, gamma)
+    return np.clip(corrected, 0.0, 255.0)
+
+
+class ToneCurves:
+    # Накопленные кривые для изображения режима mode.
+    # stats — ImageStats входного изображения (или функция, которая его вернет;
+    # вызывается только если какому-то шагу действительно нужна статистика).
+
+    def __init__(self, mode, stats=None):
+        if mode not in SUPPORTED_MODES:
+            raise ValueError(f"LUT-путь не поддерживает режим {mode}")
+        self.mode = mode
+        self._stats = stats
+        bands = 1 if mode == 'L' else 3
+        self.curves = np.tile(np.arange(256, dtype=np.float64), (bands, 1))
+        self.last_stretch = None  # [(p_low, p_high) или None] по каналам последнего растяжения
+
+    @property
+    def stats(self):
+        if callable(self._stats):
+            self._stats = self._stats()
+        if self._stats is None:
+            raise ValueError("Для этого шага нужна гистограмма входного изображения")
+        return self._stats
+
+    @property
+    def is_identity(self):
+        return np.array_equal(self.curves, np.tile(np.arange(256, dtype=np.float64), (len(self.curves), 1)))
+
+    def needs_pixels(self, name, params):
+        # Растяжение цветного изображения по яркости требует гистограммы яркости
+        # уже преобразованного изображения, а ее не вывести из кривых каналов
+        # (кроме случая, когда перцентили уже заданы в шаге)
+        return (name == 'linear_correction' and self.mode != 'L' and params.get('ranges') is None
+                and params.get('link', LINK_LUMINANCE) == LINK_LUMINANCE and not self.is_identity)
+
+    def brightness(self, value=1.0):
+        # Смешивание с черным: x * value
+        self.curves = np.clip(self.curves * float(value), 0.0, 255.0)
+
+    def contrast_mean(self):
+        # Средняя яркость результата текущих кривых, с которой смешивает contrast
+        return int(_mean_luma(self.curves, self.stats.channels) + 0.5)
+
+    def contrast(self, value=1.0, mean=None):
+        # Смешивание с серым цветом средней яркости (как ImageEnhance.Contrast).
+        # mean — уже известная средняя яркость входа шага (тогда гистограмма не нужна)
+        if mean is None:
+            mean = self.contrast_mean()
+        self.curves = np.clip(mean + float(value) * (self.curves - mean), 0.0, 255.0)
+
+    def nonlinear_correction(self, gamma=1.5):
+        # Гамма-коррекция, только для grayscale
+        if self.mode == 'L':
+            self.curves = apply_gamma(self.curves, float(gamma))
+
+    def linear_correction(self, gamma=1.0, link=LINK_LUMINANCE, ranges=None):
+        # Автоуровни: линейное растяжение по перцентилям 1/99 (+ гамма).
+        # Для цветных изображений — по яркости (link='luminance') или по каждому каналу ('channels').
+        # ranges — уже известные перцентили входа шага ([(p1, p99) или None], одна пара на все
+        # каналы или по паре на канал); тогда гистограмма не нужна
+        if link not in LINK_MODES:
+            raise ValueError(f"Неизвестный способ растяжения: {link}")
+        gamma = float(gamma)
+        if ranges is not None:
+            if len(ranges) == 1:
+                ranges = list(ranges) * len(self.curves)
+            if len(ranges) != len(self.curves):
+                raise ValueError(f"Ожидается {len(self.curves)} пар перцентилей, получено {len(ranges)}")
+            ranges = [(0.0, 0.0) if r is None else r for r in ranges]
+        elif self.mode == 'L' or link == LINK_CHANNELS:
+            hists = self.stats.channels
+            ranges = [histogram_percentiles(hists[c], (1, 99), self.curves[c]) for c in range(len(self.curves))]
+        else:
+            if not self.is_identity:
+                raise ValueError("Растяжение по яркости требует применить предыдущие кривые")
+            p_low_high = histogram_percentiles(self.stats.luma, (1, 99))
+            ranges = [p_low_high] * len(self.curves)
+        self.last_stretch = [None if p_high == p_low else (p_low, p_high) for p_low, p_high in ranges]
+        for c, stretch in enumerate(self.last_stretch):
+            # Плоский канал — изменений не будет
+            if stretch is not None:
+                self.curves[c] = stretch_curve(self.curves[c], stretch[0], stretch[1], gamma)
+
+    def apply(self, name, params):
+        getattr(self, name)(**params)
+
+    def render(self, image):
+        # Единственный проход по пикселям image (режим должен совпадать с mode)
+        if self.is_identity:
+            return image.copy()
+        return _apply_curves(image, self.curves)
+
+
+class ToneChain:
+    # Кривые для одного изображения в памяти: шаги добавляются по очереди,
+    # пиксели трогаются только в render() (и если растяжению по яркости
+    # нужна гистограмма уже преобразованного изображения).
+
+    def __init__(self, image):
+        self.image = image
+        self.curves = ToneCurves(image.mode, lambda: image_stats(self.image))
+
+    @property
+    def last_stretch(self):
+        return self.curves.last_stretch
+
+    def apply(self, name, params):
+        if self.curves.needs_pixels(name, params):
+            self.image = self.curves.render(self.image)
+            self.curves = ToneCurves(self.image.mode, lambda: image_stats(self.image))
+        self.curves.apply(name, params)
+
+    def render(self):
+        return self.curves.render(self.image)
+
+
+def apply_tone_chain(image, steps):
+    # Свернуть последовательность шагов [(имя, параметры)] в LUT и применить за один проход
+    chain = ToneChain(image)
+    for name, params in steps:
+        chain.apply(name, params)
+    return chain.render()
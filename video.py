@@ -0,0 +1,397 @@
+# Потоковая обработка видео и пронумерованных последовательностей кадров.
+# Рецепт — тот же, что у engine (тон, цвет, гамма, повороты на 90° и отражения);
+# он делится на проходы так же, как при обработке полосами (tiles.plan),
+# и каждый кадр проходит цепочку этапов целиком.
+# Декодирование, обработка и кодирование идут в отдельных потоках, связанных
+# очередями ограниченной длины: все три этапа перекрываются, а в памяти
+# одновременно лежит лишь несколько кадров. OpenCV и NumPy отпускают GIL,
+# поэтому при статистике по всему ролику кадры обрабатываются несколькими потоками.
+# Статистика автоуровней и контраста (гистограммы входа прохода):
+#   'global'  — отдельный потоковый первый проход по ролику (каждый stride-й кадр),
+#               кривые одинаковы для всех кадров;
+#   'running' — один проход, экспоненциальное сглаживание гистограмм кадров
+#               с постоянной времени smoothing секунд (без мерцания, но с адаптацией к сцене).
+#   python processor.py video in.mp4 out.mp4 -r '[{"op": "linear_correction"}]'
+#   python processor.py video frames/%04d.png out/%04d.jpg -r recipe.json --stats running
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import math
+import os
+import queue
+import sys
+import threading
+import time
+import numpy as np
+from PIL import Image
+import engine
+from geometry import IDENTITY
+import tiles
+import tone
+from kernels import cv2_module
+
+STATS_MODES = ('global', 'running')
+QUEUE_FRAMES = 8  # Длина каждой очереди между этапами
+STATS_STRIDE = 5  # Первый проход 'global' смотрит каждый stride-й кадр
+STATS_MAX_PIXELS = 500_000  # Гистограммы кадра — по уменьшенной копии не больше этого размера
+SMOOTHING_SECONDS = 1.0
+DEFAULT_FPS = 25.0  # Для последовательностей кадров, у которых нет своей частоты
+# Кодек по расширению результата (FourCC для cv2.VideoWriter)
+FOURCC = {'.mp4': 'mp4v', '.m4v': 'mp4v', '.mov': 'mp4v', '.avi': 'MJPG', '.mkv': 'XVID'}
+DEFAULT_FOURCC = 'mp4v'
+
+_END = object()  # Конец потока кадров
+
+
+def _cv2():
+    cv2 = cv2_module()
+    if cv2 is None:
+        raise RuntimeError("Для обработки видео нужен OpenCV (cv2)")
+    return cv2
+
+
+def is_sequence(path):
+    # Шаблон последовательности кадров: frames/%04d.png
+    return '%' in os.path.basename(path)
+
+
+class FrameReader:
+    # Источник кадров: видеофайл, шаблон последовательности (через cv2.VideoCapture)
+    # или папка с изображениями. Кадры — массивы BGR, как их отдает OpenCV.
+
+    def __init__(self, source, fps=None):
+        self.source = source
+        self._files = engine.list_images(source) if os.path.isdir(source) else None
+        if self._files is not None:
+            if not self._files:
+                raise ValueError(f"В папке нет изображений: {source}")
+            self.count = len(self._files)
+            self.fps = fps or DEFAULT_FPS
+            return
+        capture = self._open()
+        try:
+            self.count = int(capture.get(_cv2().CAP_PROP_FRAME_COUNT)) or None
+            self.fps = fps or capture.get(_cv2().CAP_PROP_FPS) or DEFAULT_FPS
+        finally:
+            capture.release()
+
+    def _open(self):
+        capture = _cv2().VideoCapture(self.source)
+        if not capture.isOpened():
+            raise ValueError(f"Не удалось открыть видео: {self.source}")
+        return capture
+
+    def frames(self, stride=1):
+        # Каждый stride-й кадр; пропущенные кадры не преобразуются в массивы (grab без retrieve)
+        cv2 = _cv2()
+        if self._files is not None:
+            for path in self._files[::stride]:
+                frame = cv2.imread(path, cv2.IMREAD_COLOR)
+                if frame is None:
+                    raise ValueError(f"Не удалось прочитать кадр: {path}")
+                yield frame
+            return
+        capture = self._open()
+        try:
+            index = 0
+            while True:
+                if index % stride:
+                    if not capture.grab():
+                        return
+                else:
+                    ok, frame = capture.read()
+                    if not ok:
+                        return
+                    yield frame
+                index += 1
+        finally:
+            capture.release()
+
+
+class FrameWriter:
+    # Результат: видеофайл (cv2.VideoWriter) или последовательность кадров по шаблону (cv2.imwrite).
+    # VideoWriter создается по первому кадру: размер после поворота заранее не нужен.
+
+    def __init__(self, target, fps, fourcc=None):
+        self.target = target
+        self.fps = fps
+        self.fourcc = fourcc or FOURCC.get(os.path.splitext(target)[1].lower(), DEFAULT_FOURCC)
+        self.count = 0
+        self._writer = None
+
+    def write(self, frame):
+        cv2 = _cv2()
+        if is_sequence(self.target):
+            path = self.target % self.count
+            if not cv2.imwrite(path, frame):
+                raise ValueError(f"Не удалось записать кадр: {path}")
+        else:
+            if self._writer is None:
+                height, width = frame.shape[:2]
+                self._writer = cv2.VideoWriter(self.target, cv2.VideoWriter_fourcc(*self.fourcc),
+                                               self.fps, (width, height))
+                if not self._writer.isOpened():
+                    raise ValueError(f"Не удалось создать видео {self.target} (кодек {self.fourcc})")
+            self._writer.write(frame)
+        self.count += 1
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.release()
+            self._writer = None
+
+
+def to_image(frame):
+    # BGR-массив OpenCV -> RGB-изображение PIL
+    return Image.fromarray(_cv2().cvtColor(frame, _cv2().COLOR_BGR2RGB))
+
+
+def to_frame(image, transform=IDENTITY):
+    # Изображение PIL -> BGR-массив для кодировщика (серое — в три одинаковых канала).
+    # Поворот и отражение делаются здесь средствами OpenCV: на массиве это в 3 раза быстрее transpose PIL
+    cv2 = _cv2()
+    if image.mode not in ('L', 'RGB'):
+        image = image.convert('RGB')
+    array = _transpose_frame(np.asarray(image), transform)
+    return cv2.cvtColor(array, cv2.COLOR_GRAY2BGR if image.mode == 'L' else cv2.COLOR_RGB2BGR)
+
+
+def _transpose_frame(array, transform):
+    cv2 = _cv2()
+    if transform.is_identity:
+        return array
+    if transform.flip and transform.turns == 1:
+        return cv2.transpose(array)  # Отражение + поворот на 90° — одна транспозиция
+    if transform.flip:
+        array = cv2.flip(array, 1)
+    if transform.turns:
+        # Transform считает повороты против часовой стрелки
+        codes = {1: cv2.ROTATE_90_COUNTERCLOCKWISE, 2: cv2.ROTATE_180, 3: cv2.ROTATE_90_CLOCKWISE}
+        array = cv2.rotate(array, codes[transform.turns])
+    return array
+
+
+def frame_stats(image):
+    # Гистограммы кадра по уменьшенной копии: для перцентилей и среднего этого достаточно
+    factor = math.ceil(math.sqrt(image.width * image.height / STATS_MAX_PIXELS))
+    if factor > 1:
+        image = image.reduce(factor)
+    return tiles.strip_stats(image)
+
+
+def needs_stats(steps):
+    return any(engine.needs_stats(name, params) for name, params in steps)
+
+
+class RunningStats:
+    # Гистограммы, сглаженные во времени: h = h + alpha * (h_кадра - h)
+
+    def __init__(self, alpha):
+        self.alpha = alpha
+        self.channels = None
+        self.luma = None
+
+    def update(self, stats):
+        if self.channels is None:
+            self.channels, self.luma = stats.channels, stats.luma
+        else:
+            self.channels = self.channels + self.alpha * (stats.channels - self.channels)
+            if stats.luma is not None:  # У серого кадра яркость — его единственный канал
+                self.luma = self.luma + self.alpha * (stats.luma - self.luma)
+        return tone.ImageStats(channels=self.channels, luma=self.luma)
+
+
+def run_pipeline(frames, process, consume, workers=1, depth=QUEUE_FRAMES):
+    # frames (итератор) -> process(кадр) -> consume(результат) в исходном порядке.
+    # Декодирование и потребление — в своих потоках, обработка — в пуле из workers потоков;
+    # между этапами не больше depth кадров. Ошибка любого этапа останавливает все и пробрасывается.
+    stop = threading.Event()
+    errors = []
+    decoded = queue.Queue(depth)
+    processed = queue.Queue(depth)  # Future в порядке кадров
+
+    def put(q, item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(q):
+        while True:
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                if stop.is_set():
+                    return _END
+
+    def decode():
+        for frame in frames:
+            if not put(decoded, frame):
+                return
+        put(decoded, _END)
+
+    def dispatch():
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='video-process') as pool:
+            while (frame := get(decoded)) is not _END:
+                if not put(processed, pool.submit(process, frame)):
+                    return
+        put(processed, _END)
+
+    def encode():
+        while (future := get(processed)) is not _END:
+            consume(future.result())
+
+    def guarded(func):
+        def run():
+            try:
+                func()
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+        return run
+
+    threads = [threading.Thread(target=guarded(func), name=f'video-{func.__name__}', daemon=True)
+               for func in (decode, dispatch, encode)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+class VideoStats:
+    def __init__(self, total, fps):
+        self.total = total
+        self.source_fps = fps
+        self.frames = 0
+        self.started = time.perf_counter()
+        self.stats_seconds = 0.0  # Первый проход 'global'
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def fps(self):
+        return self.frames / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        realtime = self.fps / self.source_fps if self.source_fps else 0.0
+        return (f"Кадров: {self.frames}, {self.elapsed:.1f} с (статистика: {self.stats_seconds:.1f} с), "
+                f"{self.fps:.1f} кадр/с, x{realtime:.2f} от реального времени")
+
+
+def _global_stats(reader, earlier, stride, workers):
+    # Потоковый проход: гистограммы входа очередного прохода по каждому stride-му кадру.
+    # earlier — уже построенные этапы предыдущих проходов, они применяются к кадру
+    total = []
+
+    def process(frame):
+        image = to_image(frame)
+        for stages in earlier:
+            image = tiles.run_stages(image, stages)
+        return frame_stats(image)
+
+    def consume(stats):
+        total[:] = [stats if not total else total[0] + stats]
+
+    run_pipeline(reader.frames(stride), process, consume, workers)
+    if not total:
+        raise ValueError(f"В источнике нет кадров: {reader.source}")
+    return total[0]
+
+
+def process_video(source, recipe, target, stats='global', stride=STATS_STRIDE, smoothing=SMOOTHING_SECONDS,
+                  fourcc=None, fps=None, workers=None, on_progress=None):
+    # source — видеофайл, шаблон кадров (%d) или папка; target — видеофайл или шаблон кадров.
+    # on_progress(VideoStats) вызывается после каждого записанного кадра. Возвращает VideoStats.
+    if stats not in STATS_MODES:
+        raise ValueError(f"Неизвестный способ статистики: {stats}")
+    passes, transform = tiles.plan(recipe, 'RGB')
+    reader = FrameReader(source, fps)
+    result = VideoStats(reader.count, reader.fps)
+
+    if stats == 'global':
+        workers = workers or min(4, os.cpu_count() or 1)
+        built = []
+        mode = 'RGB'
+        for steps in passes:
+            pass_stats = None
+            if needs_stats(steps):
+                start = time.perf_counter()
+                pass_stats = _global_stats(reader, built, stride, workers)
+                result.stats_seconds += time.perf_counter() - start
+            stages, mode = tiles.build_stages(steps, mode, pass_stats)
+            built.append(stages)
+    else:
+        # Сглаживание зависит от порядка кадров: обработка в одном потоке
+        workers = 1
+        alpha = 1.0 - math.exp(-1.0 / (reader.fps * smoothing)) if smoothing > 0 else 1.0
+        running = [RunningStats(alpha) if needs_stats(steps) else None for steps in passes]
+
+    def process(frame):
+        image = to_image(frame)
+        if stats == 'global':
+            for stages in built:
+                image = tiles.run_stages(image, stages)
+        else:
+            # Кривые пересобираются на каждом кадре: это операции над 256 значениями
+            mode = 'RGB'
+            for steps, smoothed in zip(passes, running):
+                pass_stats = smoothed.update(frame_stats(image)) if smoothed is not None else None
+                stages, mode = tiles.build_stages(steps, mode, pass_stats)
+                image = tiles.run_stages(image, stages)
+        return to_frame(image, transform)
+
+    writer = FrameWriter(target, reader.fps, fourcc)
+
+    def consume(frame):
+        writer.write(frame)
+        result.frames += 1
+        if on_progress:
+            on_progress(result)
+
+    try:
+        run_pipeline(reader.frames(), process, consume, workers)
+    finally:
+        writer.close()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='processor.py video',
+                                     description='Применить рецепт к видео или последовательности кадров')
+    parser.add_argument('source', help='видеофайл, шаблон кадров (frames/%%04d.png) или папка с кадрами')
+    parser.add_argument('target', help='видеофайл или шаблон кадров (out/%%04d.jpg)')
+    parser.add_argument('-r', '--recipe', required=True, help='JSON-файл или JSON-строка с рецептом')
+    parser.add_argument('--stats', choices=STATS_MODES, default='global',
+                        help='статистика автоуровней: первый проход по ролику или сглаженная по кадрам')
+    parser.add_argument('--stride', type=int, default=STATS_STRIDE, help='шаг кадров первого прохода')
+    parser.add_argument('--smoothing', type=float, default=SMOOTHING_SECONDS,
+                        help='постоянная времени сглаживания для --stats running, секунд')
+    parser.add_argument('--fourcc', default=None, help='кодек (по умолчанию — по расширению результата)')
+    parser.add_argument('--fps', type=float, default=None, help='частота кадров (для последовательностей)')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='потоков обработки кадров')
+    args = parser.parse_args(argv)
+
+    try:
+        recipe = engine.load_recipe(args.recipe)
+    except (OSError, ValueError) as e:
+        parser.error(f"Не удалось прочитать рецепт: {e}")
+
+    def progress(stats):
+        if stats.frames % 100 == 0:
+            total = f"/{stats.total}" if stats.total else ""
+            print(f"\r{stats.frames}{total} кадров, {stats.fps:.1f} кадр/с", end='', file=sys.stderr)
+
+    try:
+        stats = process_video(args.source, recipe, args.target, args.stats, max(1, args.stride),
+                              args.smoothing, args.fourcc, args.fps, args.workers, progress)
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f"\nОшибка: {e}", file=sys.stderr)
+        return 1
+    print(f"\n{stats.summary()}")
+    return 0